@@ -0,0 +1,278 @@
+"""
+Benchmarks the scene paths of prim_visualizer on synthetic inputs of growing
+size: parsing the JSON, basic scene and OBJ formats, building the frame arrays
+and VTK polydata, updating the glyph and tube pipelines, the first offscreen
+render and a pick of the entity under the cursor. Every size runs in a fresh
+process so its peak memory can be told apart, and the results are written as
+JSON so two commits can be compared:
+
+    python3 benchmark.py -o before.json
+    python3 benchmark.py -o after.json --compare before.json
+"""
+import sys
+import os
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import vtk
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from scene_builder import entities_to_arrays, build_sphere_polydata,\
+        build_lines_polydata, make_glyph_actor, make_tube_actor
+from scene_format import JsonStepIndex
+
+SIZES_DEFAULT = '1e3,1e4,1e5,1e6'
+POLYLINE_POINTS = 5
+WINDOW_SIZE = (800, 600)
+# Ratio (new time over old) past which --compare calls a stage a regression
+THRESHOLD_DEFAULT = 1.2
+
+"""
+Writes a one step JSON document with n entities: half spheres, a quarter
+vectors and a quarter polylines, at random positions in a cube whose volume
+grows with n so the density stays the same
+"""
+def write_json_scene(filename, n, rng, chunk=100000):
+    side = max(n ** (1 / 3), 1.0) * 2
+    with open(filename, 'w') as f:
+        f.write('{"reset": true, "list": [{"entities": [')
+        first = True
+        for start in range(0, n, chunk):
+            entities = []
+            for i in range(start, min(start + chunk, n)):
+                if i % 4 < 2:
+                    pos = (rng.random(3) * side).round(4).tolist()
+                    kind = 'p'
+                elif i % 4 == 2:
+                    pos = (rng.random(6) * side).round(4).tolist()
+                    kind = 'v'
+                else:
+                    pos = (rng.random((POLYLINE_POINTS, 3)) * side)\
+                            .round(4).tolist()
+                    kind = 'y'
+                entities.append(json.dumps(
+                    {'t': kind, 'p': pos, 'c': [1.0, 0.5, 0.0],
+                     'd': f'Entity {i}'}))
+            if entities:
+                f.write(('' if first else ', ') + ', '.join(entities))
+                first = False
+        f.write(']}]}')
+
+"""
+Writes a basic mode file with n lines, alternating points and segments
+"""
+def write_basic_scene(filename, n, rng):
+    side = max(n ** (1 / 3), 1.0) * 2
+    points = (rng.random((n, 6)) * side).round(4)
+    with open(filename, 'w') as f:
+        for i, row in enumerate(points):
+            if i % 2:
+                f.write(','.join(map(str, row)) + ' red\n')
+            else:
+                f.write(','.join(map(str, row[:3])) + '\n')
+
+"""
+Writes a triangulated grid with about n vertices as an OBJ file, with normals
+so the faces use the v//vn form
+"""
+def write_obj(filename, n):
+    side = max(int(np.sqrt(n)), 2)
+    x, y = np.meshgrid(np.arange(side, dtype=np.float32),
+                       np.arange(side, dtype=np.float32))
+    verts = np.stack((x.ravel(), y.ravel(), np.zeros(side * side)), axis=1)
+    corners = (np.arange(side - 1)[None, :] +
+               side * np.arange(side - 1)[:, None]).ravel() + 1
+    faces = np.concatenate((
+        np.stack((corners, corners + 1, corners + side), axis=1),
+        np.stack((corners + 1, corners + side + 1, corners + side), axis=1)))
+    with open(filename, 'w') as f:
+        f.write('vn 0 0 1\n')
+        np.savetxt(f, verts, fmt='v %g %g %g')
+        np.savetxt(f, np.repeat(faces, 2, axis=1),
+                   fmt='f %d//%d %d//%d %d//%d')
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10)
+
+"""
+Runs every stage once for n entities and returns {stage: seconds}
+"""
+def run_stages(n, workdir, seed):
+    # prim_visualizer pulls in Qt, which only the workers need
+    from prim_visualizer import parse_basic_scene, read_obj, pick_entity
+    rng = np.random.default_rng(seed)
+    json_file = os.path.join(workdir, f'scene_{n}.json')
+    basic_file = os.path.join(workdir, f'scene_{n}.txt')
+    obj_file = os.path.join(workdir, f'scene_{n}.obj')
+    if not os.path.exists(json_file):
+        write_json_scene(json_file, n, rng)
+        write_basic_scene(basic_file, n, rng)
+        write_obj(obj_file, n)
+
+    times = {}
+    def timed(stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        times[stage] = time.perf_counter() - start
+        return result
+
+    step = timed('parse_json', lambda: JsonStepIndex(json_file)[0])
+    arrays = timed('build_arrays', entities_to_arrays, step['entities'],
+                   0.1, 0.05)
+    del step
+    sphere_pd = timed('build_sphere_polydata', build_sphere_polydata, arrays)
+    lines_pd = timed('build_lines_polydata', build_lines_polydata, arrays)
+    glyph_actor = timed('glyph_mapper_update', make_glyph_actor, sphere_pd)
+    tube_actor = timed('tube_filter_update', make_tube_actor, lines_pd)
+
+    ren = vtk.vtkRenderer()
+    ren_win = vtk.vtkRenderWindow()
+    ren_win.SetOffScreenRendering(1)
+    ren_win.SetSize(*WINDOW_SIZE)
+    ren_win.AddRenderer(ren)
+    ren.AddActor(glyph_actor)
+    ren.AddActor(tube_actor)
+    ren.ResetCamera()
+    timed('first_render', ren_win.Render)
+    # The same picks callback_function does for a click in the middle: the
+    # actor under the cursor, then the entity within it
+    x, y = WINDOW_SIZE[0] // 2, WINDOW_SIZE[1] // 2
+    picker = vtk.vtkPropPicker()
+    timed('pick', picker.PickProp, x, y, ren)
+    timed('pick_entity', pick_entity, ren,
+          picker.GetActor() or glyph_actor, x, y)
+    ren_win.Finalize()
+    del ren, ren_win, glyph_actor, tube_actor, sphere_pd, lines_pd, arrays
+
+    timed('parse_basic_scene', parse_basic_scene, basic_file)
+    timed('read_obj', read_obj, obj_file)
+    return times
+
+"""
+Runs one size repeat times in a fresh process, keeping the fastest time of
+each stage
+"""
+def run_size(n, workdir, repeat, seed):
+    vtk.vtkLogger.SetStderrVerbosity(vtk.vtkLogger.VERBOSITY_ERROR)
+    best = {}
+    for _ in range(repeat):
+        for stage, seconds in run_stages(n, workdir, seed).items():
+            best[stage] = min(seconds, best.get(stage, float('inf')))
+    return {'entities': n, 'seconds': best, 'peak_rss_mb': peak_rss_mb()}
+
+def git_commit():
+    try:
+        return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                text=True, check=True,
+                cwd=os.path.dirname(os.path.realpath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+"""
+Prints new/old time ratios for every stage both results share and returns
+the number of stages slower than threshold
+"""
+def compare(old, new, threshold):
+    old_runs = {run['entities']: run for run in old['runs']}
+    regressions = 0
+    print(f"{'entities':>10} {'stage':<24} {'old':>10} {'new':>10} "
+          f"{'ratio':>7}")
+    for run in new['runs']:
+        base = old_runs.get(run['entities'])
+        if base is None:
+            continue
+        for stage, seconds in run['seconds'].items():
+            if stage not in base['seconds']:
+                continue
+            ratio = seconds / max(base['seconds'][stage], 1e-9)
+            flag = ''
+            if ratio > threshold:
+                flag = '  slower'
+                regressions += 1
+            print(f"{run['entities']:>10} {stage:<24} "
+                  f"{base['seconds'][stage]:>10.4f} {seconds:>10.4f} "
+                  f"{ratio:>7.2f}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(
+            prog = 'benchmark',
+            description = 'Times the prim_visualizer scene paths on '
+                          'synthetic scenes'
+            )
+    parser.add_argument('-s', '--sizes', required=False,
+                        default=SIZES_DEFAULT,
+                        help='Comma separated entity counts, e.g. '
+                             '1e3,1e4,1e5,1e6,1e7')
+    parser.add_argument('-r', '--repeat', required=False, type=int,
+                        default=3,
+                        help='Runs per size; the fastest is kept')
+    parser.add_argument('-o', '--output', required=False,
+                        help='JSON file to write the results to')
+    parser.add_argument('-c', '--compare', required=False,
+                        help='Earlier results to compare against')
+    parser.add_argument('-t', '--threshold', required=False, type=float,
+                        default=THRESHOLD_DEFAULT,
+                        help='Slowdown ratio reported as a regression')
+    parser.add_argument('--seed', required=False, type=int, default=0)
+    parser.add_argument('--workdir', required=False,
+                        help='Where to keep the generated inputs (a '
+                             'temporary directory by default)')
+    args = parser.parse_args()
+    sizes = [int(float(i)) for i in args.sizes.split(',')]
+
+    results = {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'vtk': vtk.vtkVersion.GetVTKVersion(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'runs': [],
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        for n in sizes:
+            # One process per size keeps peak memory per size
+            with ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=multiprocessing.get_context('spawn')) as pool:
+                run = pool.submit(run_size, n, workdir, args.repeat,
+                                  args.seed).result()
+            results['runs'].append(run)
+            stages = ', '.join(f'{stage} {seconds:.4f}s'
+                               for stage, seconds in run['seconds'].items())
+            print(f"{n} entities: {stages}")
+            if run['peak_rss_mb'] is not None:
+                print(f"    peak memory {run['peak_rss_mb']:.0f} MB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print(f"{regressions} stages slower than {args.threshold}x")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
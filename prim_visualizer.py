@@ -5,77 +5,349 @@ import time
 import os
 import json
 import argparse
+import threading
 from pathlib import Path
-from copy import deepcopy
-from collections import defaultdict
+from itertools import chain
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from PyQt6.QtWidgets import QApplication, QLabel, QMainWindow, QPushButton,\
                             QSizePolicy
-from PyQt6.QtCore import QFile, QIODevice, pyqtSignal, QObject, QThread
+from PyQt6.QtCore import QFile, QIODevice, pyqtSignal, QObject, QThread,\
+                         QTimer
 from PyQt6.uic import loadUi
 from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
 import vtk
+from vtk.util import numpy_support
 import numpy as np
 
+from scene_builder import SceneArrays, json_get, entities_to_arrays,\
+                          make_scene_actors, ScenePipeline,\
+                          VertexIndex, ID_DTYPE, numpy_to_points,\
+                          numpy_to_cells, unique_edges, set_detail,\
+                          make_sphere_impostor_actor, make_line_impostor_actor,\
+                          Bounds, LiveScene, triangulate_cells, named_array,\
+                          strain_lookup_table, set_strain_cap, COLORMAPS,\
+                          STRAIN_CAP_DEFAULT
+from scene_format import SceneFile, JsonStepIndex, RenderBatch, CachedSteps,\
+                         is_scene_file, decode_stream_frame, stream_ack,\
+                         STREAM_MALFORMED, STREAM_BUSY
+from scene_cache import GeometryCache, CACHE_DIR_DEFAULT, CACHE_SIZE_DEFAULT
+
 # 2. Create a Signal mechanism to communicate with Qt
 class StreamScope(QObject):
-    # This signal will carry a string (str) payload
-    data_received = pyqtSignal(dict)
+    # Emitted when the server's FrameQueue stops being empty
+    frames_pending = pyqtSignal()
 
 # Global instance to be shared (or pass it via dependency injection)
 qt_signal_emitter = StreamScope()
 
+# Hands the result of background work back to the Qt thread
+class LoadScope(QObject):
+    finished = pyqtSignal(object, object)
+
+load_signal_emitter = LoadScope()
+load_signal_emitter.finished.connect(lambda done, future: done(future.result()))
+
+"""
+Server mode frames waiting for the Qt thread. The server thread puts frames in
+and the Qt thread takes all of them at once, at most once per display
+interval, so a client that sends faster than frames can be drawn only adds to
+one batch instead of to Qt's event queue. An init frame replaces whatever is
+still pending, and past max_pending frames other frames are turned away.
+"""
+class FrameQueue:
+
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending)
+
+    """
+    Queues (binary, payload) and returns the new queue depth, or None if the
+    queue is full
+    """
+    def put(self, binary, payload):
+        with self.lock:
+            if payload.get('action') == 'init':
+                self.pending = []
+            elif len(self.pending) >= self.max_pending:
+                return None
+            self.pending.append((binary, payload))
+            depth = len(self.pending)
+        if depth == 1:
+            qt_signal_emitter.frames_pending.emit()
+        return depth
+
+    def take(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        return pending
+
 TUBE_RADIUS_DEFAULT = 0.05
 SPHERE_RADIUS_DEFAULT = 0.1
+FPS_DEFAULT = 30
+# Server mode frames that may wait to be drawn before clients are told to back
+# off
+SERVER_QUEUE_DEFAULT = 64
+# Vertices listed around a picked model vertex
+MODEL_NEIGHBOURS = 6
+# Model wireframe detail levels, (tube sides, sphere theta, sphere phi), and
+# the pixel sizes used once a model is too big for any of them
+MODEL_LEVELS = ((8, 8, 8), (6, 6, 6), (4, 6, 4), (3, 4, 3))
+TRIANGLE_BUDGET_DEFAULT = 4000000
+MODEL_POINT_SIZE = 6
+MODEL_LINE_WIDTH = 2
+
+"""
+Runs work(*args) off the Qt thread and then calls done(result) on the Qt
+thread, the same way StreamScope hands server payloads over. Pure-Python
+parsing goes to a process pool (it would hold the GIL), NumPy/VTK work to a
+thread pool.
+"""
+def run_in_background(done, work, *args, processes = False):
+    if processes:
+        if run_in_background.processes is None:
+            run_in_background.processes = ProcessPoolExecutor(
+                    mp_context=multiprocessing.get_context('spawn'))
+        pool = run_in_background.processes
+    else:
+        if run_in_background.threads is None:
+            run_in_background.threads = ThreadPoolExecutor()
+        pool = run_in_background.threads
+    future = pool.submit(work, *args)
+    future.add_done_callback(
+            lambda f: load_signal_emitter.finished.emit(done, f))
+    return future
+
+run_in_background.processes = None
+run_in_background.threads = None
+
+"""
+Plays the step list back on a QTimer instead of in a blocking loop. While a step
+is on screen the next one is prepared by a background worker, and when showing
+a step overruns the frame budget the steps that a reset would have wiped anyway
+are dropped to catch up.
+"""
+class PlaybackController(QObject):
+    finished = pyqtSignal()
+
+    def __init__(self, fps, parent = None):
+        super().__init__(parent)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.tick)
+        self.set_fps(fps)
+        self.worker = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+        self.last_frame = None
+
+    def set_fps(self, fps):
+        self.budget = 1.0 / fps
+        self.timer.setInterval(max(int(self.budget * 1000), 1))
+
+    def playing(self):
+        return self.timer.isActive()
+
+    def play(self):
+        if self.playing():
+            return
+        self.last_frame = None
+        self.prefetch(load_next.i, 0)
+        self.timer.start()
+
+    def pause(self):
+        self.timer.stop()
+        self.discard_pending()
+
+    def toggle(self):
+        if self.playing():
+            self.pause()
+        else:
+            self.play()
+
+    def seek(self, i):
+        playing = self.playing()
+        self.pause()
+        try:
+            seek_step(i)
+        except (ValueError, OSError) as e:
+            self.finished.emit()
+            step_error(e)
+            return
+        if playing:
+            self.play()
+
+    def prefetch(self, i, skip):
+        self.pending = self.worker.submit(prepare_ahead, i, skip)
+
+    def discard_pending(self):
+        if self.pending is not None:
+            self.pending.cancel()
+            self.pending = None
+
+    def tick(self):
+        if self.pending is None or not self.pending.done():
+            # Still preparing, this frame is dropped
+            return
+        try:
+            step = self.pending.result()
+        except (ValueError, OSError) as e:
+            # A truncated or unreadable file ends playback at that step
+            self.pause()
+            self.finished.emit()
+            step_error(e)
+            return
+        except Exception:
+            self.pause()
+            self.finished.emit()
+            raise
+        self.pending = None
+        if step is None:
+            self.pause()
+            self.finished.emit()
+            return
+        show_step(step)
+        now = time.perf_counter()
+        skip = 0
+        if self.last_frame is not None and resets_every_step():
+            skip = max(int((now - self.last_frame) / self.budget) - 1, 0)
+        self.last_frame = now
+        self.prefetch(load_next.i, skip)
+
+"""
+Parses the command line, filling in the input file and radius defaults
+"""
+def parse_args():
+    parser = argparse.ArgumentParser(
+            prog = 'PrimitivesVisualizer',
+            description = 'Visualizes 3D geometry from a JSON file',
+            epilog = 'Filename can also be specified in ./default_input.txt'
+            )
+    parser.add_argument('-l', '--light-mode', required=False,
+                        action=argparse.BooleanOptionalAction)
+    parser.add_argument('-m', '--model-mode', required=False,
+                        action=argparse.BooleanOptionalAction)
+    parser.add_argument('-o', '--obj-mode', required=False,
+                        action=argparse.BooleanOptionalAction)
+    parser.add_argument('-b', '--basic-mode', required=False,
+                        action=argparse.BooleanOptionalAction)
+    parser.add_argument('-w', '--server-mode', required=False,
+                        action=argparse.BooleanOptionalAction)
+    parser.add_argument('-r', '--render-mode', required=False,
+                        action=argparse.BooleanOptionalAction)
+    parser.add_argument('-c', '--scalar-field-mode', required=False,
+                        action=argparse.BooleanOptionalAction)
+    parser.add_argument('-n', '--dont-reset', required=False,
+                        action=argparse.BooleanOptionalAction)
+    parser.add_argument('--step-cache', required=False, type=int,
+                        default=16,
+                        help='Number of built render mode steps to keep')
+    parser.add_argument('--fps', required=False, type=float,
+                        default=FPS_DEFAULT,
+                        help='Target frame rate for Run All playback and '
+                             'the most server mode redraws per second')
+    parser.add_argument('--server-queue', required=False, type=int,
+                        default=SERVER_QUEUE_DEFAULT,
+                        help='Pending server mode frames before new ones are '
+                             'refused')
+    parser.add_argument('--strain-cap', required=False, type=float,
+                        default=STRAIN_CAP_DEFAULT,
+                        help='Strain (length over rest length, minus 1) at '
+                             'which render and scalar field mode colors '
+                             'saturate; [ and ] halve and double it in '
+                             'render mode')
+    parser.add_argument('--colormap', required=False, default='strain',
+                        choices=sorted(COLORMAPS),
+                        help='Colormap for strain')
+    parser.add_argument('-i', '--impostors', required=False,
+                        action=argparse.BooleanOptionalAction,
+                        help='Draw spheres and tubes as shaded point and '
+                             'line sprites instead of triangles')
+    parser.add_argument('--triangle-budget', required=False, type=int,
+                        default=TRIANGLE_BUDGET_DEFAULT,
+                        help='Model mode: most triangles to spend on tubes '
+                             'and spheres before drawing lines and points')
+    parser.add_argument('--cache', required=False,
+                        action=argparse.BooleanOptionalAction,
+                        help='Keep built geometry on disk so that reopening '
+                             'the same file is instant (on by default, '
+                             'headless only with --cache or --cache-dir)')
+    parser.add_argument('--cache-dir', required=False,
+                        help='Where to keep the geometry cache (default '
+                             f'{CACHE_DIR_DEFAULT})')
+    parser.add_argument('--cache-size', required=False, type=float,
+                        default=CACHE_SIZE_DEFAULT,
+                        help='Megabytes the geometry cache may use before '
+                             'the least recently used entries are deleted')
+    parser.add_argument('--headless', required=False,
+                        action=argparse.BooleanOptionalAction,
+                        help='Render every step offscreen, without a window')
+    parser.add_argument('--frames', required=False,
+                        default='frame_%06d.png',
+                        help='Headless output file pattern, given the step '
+                             'index')
+    parser.add_argument('--pipe', required=False,
+                        action=argparse.BooleanOptionalAction,
+                        help='Headless: write raw RGB frames to stdout '
+                             'instead of PNG files')
+    parser.add_argument('--size', required=False, default='1280x720',
+                        help='Headless frame size, WIDTHxHEIGHT')
+    parser.add_argument('--step-range', required=False,
+                        help='Headless: steps to render, START:STOP')
+    parser.add_argument('--workers', required=False, type=int, default=1,
+                        help='Headless: split the steps across this many '
+                             'processes')
+    parser.add_argument('-f', '--filename', required=False)
+    parser.add_argument('-t', '--tube-radius', required=False, type=float)
+    parser.add_argument('-s', '--sphere-radius', required=False,
+                        type=float)
+    args = parser.parse_args()
+    if args.filename is None:
+        default_file = Path("./default_input.txt")
+        if default_file.is_file():
+            args.filename = open("./default_input.txt").readline().strip()
+        elif not args.server_mode:
+            print("Error: no input file name supplied")
+            parser.print_help()
+            exit(1)
+    if args.tube_radius is None:
+        args.tube_radius = TUBE_RADIUS_DEFAULT
+    if args.sphere_radius is None:
+        args.sphere_radius = SPHERE_RADIUS_DEFAULT
+    return args
+
+"""
+The geometry cache asked for on the command line, or None. Headless runs
+often go to machines whose home directory is read-only or over quota, so
+they only cache when given --cache or a --cache-dir.
+"""
+def geometry_cache(args):
+    enabled = args.cache
+    if enabled is None:
+        enabled = not args.headless or args.cache_dir is not None
+    if not enabled:
+        return None
+    try:
+        return GeometryCache(args.cache_dir or CACHE_DIR_DEFAULT,
+                             args.cache_size)
+    except OSError as e:
+        print(f"Not caching geometry: {e}", file=sys.stderr)
+        return None
 
 # Subclass QMainWindow similarly to in C++
 class MainWindow(QMainWindow):
 
-    def __init__(self, parent = None):
+    def __init__(self, args, parent = None):
         QMainWindow.__init__(self, parent)
-
-        parser = argparse.ArgumentParser(
-                prog = 'PrimitivesVisualizer',
-                description = 'Visualizes 3D geometry from a JSON file',
-                epilog = 'Filename can also be specified in ./default_input.txt'
-                )
-        parser.add_argument('-l', '--light-mode', required=False,
-                            action=argparse.BooleanOptionalAction)
-        parser.add_argument('-m', '--model-mode', required=False,
-                            action=argparse.BooleanOptionalAction)
-        parser.add_argument('-o', '--obj-mode', required=False,
-                            action=argparse.BooleanOptionalAction)
-        parser.add_argument('-b', '--basic-mode', required=False,
-                            action=argparse.BooleanOptionalAction)
-        parser.add_argument('-w', '--server-mode', required=False,
-                            action=argparse.BooleanOptionalAction)
-        parser.add_argument('-r', '--render-mode', required=False,
-                            action=argparse.BooleanOptionalAction)
-        parser.add_argument('-c', '--scalar-field-mode', required=False,
-                            action=argparse.BooleanOptionalAction)
-        parser.add_argument('-n', '--dont-reset', required=False,
-                            action=argparse.BooleanOptionalAction)
-        parser.add_argument('-f', '--filename', required=False)
-        parser.add_argument('-t', '--tube-radius', required=False, type=float)
-        parser.add_argument('-s', '--sphere-radius', required=False,
-                            type=float)
-        args = parser.parse_args()
-        if args.filename is None:
-            default_file = Path("./default_input.txt")
-            if default_file.is_file():
-                filename = open("./default_input.txt").readline().strip()
-            elif not args.server_mode:
-                print("Error: no input file name supplied")
-                parser.print_help()
-                exit(1)
-        else:
-            filename = args.filename
-        tube_radius = TUBE_RADIUS_DEFAULT
-        sphere_radius = SPHERE_RADIUS_DEFAULT
-        if args.tube_radius is not None:
-            tube_radius = args.tube_radius
-        if args.sphere_radius is not None:
-            sphere_radius = args.sphere_radius
+        filename = args.filename
+        tube_radius = args.tube_radius
+        sphere_radius = args.sphere_radius
+        cache = None if args.server_mode or args.obj_mode \
+                else geometry_cache(args)
 
         # Load the .ui file and associate its content with this MainWindow
         pyfile_path = os.path.dirname(os.path.realpath(__file__))
@@ -92,6 +364,12 @@ class MainWindow(QMainWindow):
         self.vtkWidget.GetRenderWindow().AddRenderer(self.ren)
         self.iren = self.vtkWidget.GetRenderWindow().GetInteractor()
         self.iren.SetInteractorStyle(vtk.vtkInteractorStyleTrackballCamera())
+        start_interaction.ren = self.ren
+        start_interaction.coarse = False
+        self.iren.GetInteractorStyle().AddObserver('StartInteractionEvent',
+                                                   start_interaction)
+        self.iren.GetInteractorStyle().AddObserver('EndInteractionEvent',
+                                                   end_interaction)
 
         self.exporter = vtk.vtkOBJExporter()
         self.exporter.SetActiveRenderer(self.ren)
@@ -120,67 +398,38 @@ class MainWindow(QMainWindow):
         callback_function.ren = self.ren
         callback_function.info_box = self.infoBox
         callback_function.basic = args.basic_mode
-        load_next.add_cube_axis = True
-        json_doc = None
         # Set up callback
-        if not (args.basic_mode or args.model_mode or args.obj_mode or args.server_mode):
-            if args.render_mode:
-                load_next.add_cube_axis = False
-                batch_json = json.load(open(filename))
-                json_doc = {}
-                json_doc["list"] = []
-                json_doc["glyph"] = True
-                sr = batch_json["scale_factor"] * 0.05
-                tr = batch_json["scale_factor"] * 0.025
-                for step in batch_json["positions"]:
-                    entry = {}
-                    entry["entities"] = []
-                    bpts = step["positions"]
-                    points = []
-                    for i in range(0, len(bpts), 3):
-                        points.append([bpts[i], bpts[i+1], bpts[i+2]])
-                        entry["entities"].append(
-                                {"type": "point",
-                                 "position": points[-1],
-                                 "color": [1.0, 1.0, 1.0],
-                                 "radius": sr})
-                    for edge in batch_json["edges"]:
-                        l = dist(points[edge["vertices"][0]], points[edge["vertices"][1]])
-                        c = ratio_to_rgb(l / edge["rest_length"])
-                        entry["entities"].append(
-                                {"type": "vector",
-                                 "position": points[edge["vertices"][0]] +
-                                 points[edge["vertices"][1]],
-                                 "color": c,
-                                 "radius": tr})
-                    json_doc["list"].append(entry)
-                    #break
-            else:
-                json_doc = json.load(open(filename))
-            if ("glyph" not in json_doc.keys() or not json_doc["glyph"]) and not\
-                    args.scalar_field_mode:
-                self.iren.AddObserver(
-                        'LeftButtonPressEvent', callback_function)
-        elif args.model_mode:
+        if args.model_mode:
             self.iren.AddObserver('LeftButtonPressEvent', model_callback)
+            model_callback.center_actor = None
         if args.server_mode:
             server_mode.ren = self.ren
             server_mode.tube_radius = tube_radius
             server_mode.sphere_radius = sphere_radius
+            server_mode.impostors = args.impostors
             server_mode.window = self
-            server_mode.actors = []
-            qt_signal_emitter.data_received.connect(self.update_scene)
+            server_mode.scene = LiveScene(sphere_radius, tube_radius)
+            server_mode.pipeline = None
+            server_mode.frames = FrameQueue(args.server_queue)
+            server_mode.interval = 1.0 / args.fps
+            server_mode.last_render = 0.0
+            qt_signal_emitter.frames_pending.connect(self.schedule_frames)
             server_mode()
         elif args.basic_mode:
             load_basic_scene.ren = self.ren
             load_basic_scene.filename = filename
             load_basic_scene.tube_radius = tube_radius
             load_basic_scene.sphere_radius = sphere_radius
+            load_basic_scene.impostors = args.impostors
+            load_basic_scene.cache = cache
             load_basic_scene.done = False
             load_basic_scene()
         elif args.scalar_field_mode:
             load_scalar_field.ren = self.ren
-            load_scalar_field.json_doc = json_doc
+            load_scalar_field.filename = filename
+            load_scalar_field.strain_cap = args.strain_cap
+            load_scalar_field.colormap = args.colormap
+            load_scalar_field.cache = cache
             load_scalar_field()
         elif args.obj_mode:
             load_obj.ren = self.ren
@@ -194,157 +443,123 @@ class MainWindow(QMainWindow):
             load_model.tube_radius = tube_radius
             load_model.sphere_radius = sphere_radius
             load_model.filename = filename
-            load_model.ren_win = self.vtkWidget.GetRenderWindow()
             load_model.done = False
             load_model.info_box = self.infoBox
+            load_model.triangle_budget = args.triangle_budget
+            load_model.impostors = args.impostors
+            load_model.cache = cache
             load_model()
         else:
-            self.runallButton.clicked.connect(run_all)
-            self.continueButton.clicked.connect(load_next)
-            #json_doc = json.load(open(filename))
-            #print(json_doc.keys())
-            # Associate a lot of persistent information with load_next
-            load_next.reset = not args.dont_reset
-            load_next.i = 0
-            load_next.ren = self.ren
-            load_next.json_doc = json_doc
-            load_next.actors = []
-            load_next.hold_actors = []
-            load_next.positions = [[], [], []]
-            load_next.hold_positions = [[], [], []]
-            load_next.cube_axis = None
-            load_next.descriptions = {}
-            load_next.tube_radius = tube_radius
-            load_next.sphere_radius = sphere_radius
+            run_all.playback = PlaybackController(args.fps, self)
+            run_all.playback.finished.connect(playback_finished)
+            run_all.button = self.runallButton
+            setup_load_next(self.ren, args)
+            if args.render_mode:
+                self.iren.AddObserver('KeyPressEvent', strain_cap_key)
+            load_next.step_box = self.stepBox
             load_next.vtkWidget = self.vtkWidget
-            load_next()
+            run_in_background(self.steps_ready, open_steps, filename,
+                              args.render_mode, args.step_cache,
+                              sphere_radius, tube_radius, cache, True)
+
+    """
+    Finishes setting up load_next once the step list has been opened
+    """
+    def steps_ready(self, opened):
+        load_next.steps, load_next.json_doc = opened
+        if not glyph_mode():
+            self.iren.AddObserver('LeftButtonPressEvent', callback_function)
+        self.runallButton.clicked.connect(run_all)
+        self.continueButton.clicked.connect(run_all.playback.pause)
+        self.continueButton.clicked.connect(playback_finished)
+        self.continueButton.clicked.connect(load_next)
+        self.stepBox.valueChanged.connect(seek)
+        load_next()
+
+    def schedule_frames(self):
+        # Draw no sooner than one display interval after the last frame
+        wait = server_mode.last_render + server_mode.interval -\
+                time.perf_counter()
+        QTimer.singleShot(max(int(wait * 1000), 0), self.show_pending_frames)
+
+    def show_pending_frames(self):
+        # Everything that arrived since the last frame is applied, then drawn
+        # once
+        frames = server_mode.frames.take()
+        if not frames:
+            return
+        for binary, payload in frames:
+            if binary:
+                self.update_stream(payload)
+            else:
+                self.update_scene(payload)
+        self.show_server_scene(
+                any(payload.get('action') == 'init' for _, payload in frames))
+        server_mode.last_render = time.perf_counter()
 
     def update_scene(self, payload):
         # This method runs on the Main Qt Thread
         #print(f"Received: {payload}")
 
-        if payload['action'] == 'init':
-            for actor in server_mode.actors:
-                server_mode.ren.RemoveActor(actor)
-            server_mode.actors = []
-
-            sphere_source = vtk.vtkSphereSource()
-            #sphere_source.SetRadius(server_mode.sphere_radius)
-            #sphere_source.SetRadius(.01)
-            sphere_pd = vtk.vtkPolyData()
-            sphere_points = vtk.vtkPoints()
-
-            lines_pd = vtk.vtkPolyData()
-            lines_points = vtk.vtkPoints()
-            lines_cells = vtk.vtkCellArray()
-
-            scale_factors_sphere = vtk.vtkFloatArray()
-            scale_factors_sphere.SetNumberOfComponents(3)
-            scale_factors_sphere.SetName("Scale Factors")
-            colors_sphere = vtk.vtkFloatArray()
-            colors_sphere.SetNumberOfComponents(4)
-            colors_sphere.SetName("Colors")
-
-            scale_factors_line = vtk.vtkFloatArray()
-            scale_factors_line.SetNumberOfComponents(1)
-            scale_factors_line.SetName("Tube Radii")
-            colors_line = vtk.vtkFloatArray()
-            colors_line.SetNumberOfComponents(4)
-            colors_line.SetName("Colors")
-
-            scene = payload['scene']
-            n = 0
-            for entity in scene:
-                if 'opacity' not in entity.keys() and 'o' not in entity.keys():
-                    entity['o'] = 1.0
-                if 'color' not in entity.keys() and 'c' not in entity.keys():
-                    entity['c'] = [1.0, 1.0, 1.0]
-                json_type = json_get(entity, 't', 'type')
-                if json_type == 'point' or json_type == 'p':
-                    #source.SetCenter(entity['position'])
-                    sphere_points.InsertNextPoint(json_get(entity, 'p', 'position'))
-                    colors_sphere.InsertNextTuple4(*json_get(entity, 'c', 'color'),
-                                                   json_get(entity, 'o', 'opacity'))
-                    if 'radius' not in entity.keys() and 'r' not in entity.keys():
-                        entity['r'] = server_mode.sphere_radius
-                    scale_factors_sphere.InsertNextTuple3(
-                            *[json_get(entity, 'r', 'radius') * 2 for _ in range(3)])
-                    #actor.GetProperty().SetColor(entity['color'])
-                    #actor.GetProperty().SetOpacity(entity['opacity'])
-                elif json_type == 'vector' or json_type == 'v':
-                    lines_points.InsertNextPoint(json_get(entity, 'p', 'position')[:3])
-                    lines_points.InsertNextPoint(json_get(entity, 'p', 'position')[3:])
-                    line = vtk.vtkLine()
-                    line.GetPointIds().SetId(0, n)
-                    line.GetPointIds().SetId(1, n+1)
-                    n += 2
-                    lines_cells.InsertNextCell(line)
-                    if 'radius' not in entity.keys() and 'r' not in entity.keys():
-                        entity['r'] = server_mode.tube_radius
-                    # This is not working as cell data, only point data,
-                    # so needs inserted twice
-                    for _ in range(2):
-                        colors_line.InsertNextTuple4(*json_get(entity, 'c', 'color'),
-                                                      json_get(entity, 'o', 'opacity'))
-                        scale_factors_line.InsertNextTuple1(json_get(entity, 'r', 'radius'))
-                elif json_type == 'polyline' or json_type == 'y':
-                    line = vtk.vtkPolyLine()
-                    id_count = len(json_get(entity, 'p', 'position'))
-                    line.GetPointIds().SetNumberOfIds(id_count)
-                    if 'radius' not in entity.keys() and 'r' not in entity.keys():
-                        entity['r'] = server_mode.tube_radius
-                    for i in range(id_count):
-                        pt = json_get(entity, 'p', 'position')[i]
-                        lines_points.InsertNextPoint(pt)
-                        line.GetPointIds().SetId(i, n)
-                        n += 1
-                        colors_line.InsertNextTuple4(*json_get(entity, 'c', 'color'),
-                                                      json_get(entity, 'o', 'opacity'))
-                        scale_factors_line.InsertNextTuple1(json_get(entity, 'r', 'radius'))
-                    lines_cells.InsertNextCell(line)
-
-            sphere_pd.SetPoints(sphere_points)
-            mapper = vtk.vtkGlyph3DMapper()
-
-            sphere_pd.GetPointData().AddArray(colors_sphere)
-            sphere_pd.GetPointData().AddArray(scale_factors_sphere)
-            mapper.SetInputData(sphere_pd)
-            mapper.SetSourceConnection(sphere_source.GetOutputPort())
-            mapper.SetScalarModeToUsePointFieldData()
-
-            mapper.SelectColorArray("Colors")
-            mapper.SetColorMode(2)
-
-            mapper.SetScaleModeToScaleByVectorComponents()
-            mapper.SetScaleArray("Scale Factors")
-            mapper.Update()
-
-            actor = vtk.vtkActor()
-            actor.SetMapper(mapper)
-            server_mode.ren.AddActor(actor)
-            server_mode.actors.append(actor)
-
-            lines_pd.SetPoints(lines_points)
-            lines_pd.SetLines(lines_cells)
-            lines_pd.GetPointData().AddArray(colors_line)
-            lines_pd.GetPointData().SetScalars(scale_factors_line)
-            lines_pd.GetPointData().SetActiveScalars("Tube Radii")
-            tube_filter = vtk.vtkTubeFilter()
-            tube_filter.SetInputData(lines_pd)
-            tube_filter.SetNumberOfSides(8)
-            tube_filter.SetVaryRadiusToVaryRadiusByAbsoluteScalar()
-            tube_filter.Update()
-            mapper = vtk.vtkPolyDataMapper()
-            mapper.SelectColorArray("Colors")
-            mapper.SetColorMode(2)
-            mapper.ScalarVisibilityOn()
-            mapper.SetScalarModeToUsePointFieldData()
-            mapper.SetInputConnection(tube_filter.GetOutputPort())
-            actor = vtk.vtkActor()
-            actor.SetMapper(mapper)
-            server_mode.ren.AddActor(actor)
-            server_mode.actors.append(actor)
+        action = payload.get('action')
+        scene = server_mode.scene
+        try:
+            if action == 'init':
+                # Built aside, so a bad scene leaves the old one showing
+                scene = LiveScene(scene.sphere_radius, scene.tube_radius)
+                scene.append(payload['scene'])
+                server_mode.scene = scene
+            elif action == 'append':
+                scene.append(payload['scene'])
+            elif action == 'update':
+                missing = scene.update(payload['ids'],
+                                       payload.get('positions'),
+                                       payload.get('colors'),
+                                       payload.get('radii'))
+                if len(missing):
+                    print(f"Ignoring unknown ids: {missing.tolist()}")
+            elif action == 'remove':
+                scene.remove(np.asarray(payload['ids'], dtype=ID_DTYPE))
+            else:
+                print(f"Unknown action: {action}")
+        except (AttributeError, KeyError, IndexError, TypeError,
+                ValueError) as e:
+            # Only the malformed frame is dropped
+            print(f"Ignoring {action}: {e!r}")
+
+    def update_stream(self, payload):
+        # Same as update_scene for a decoded binary stream frame
+        action = payload['action']
+        scene = server_mode.scene
+        try:
+            if action == 'init':
+                scene = LiveScene(scene.sphere_radius, scene.tube_radius)
+                scene.append_arrays(payload['arrays'])
+                server_mode.scene = scene
+            elif action == 'append':
+                scene.append_arrays(payload['arrays'])
+            elif action == 'update':
+                scene.update_arrays(payload['ids'], payload['positions'],
+                                    payload['colors'], payload['radii'])
+            else:
+                scene.remove(payload['ids'])
+        except (IndexError, ValueError) as e:
+            print(f"Ignoring {action}: {e!r}")
+
+    def show_server_scene(self, reset):
+        scene = server_mode.scene
+        # The actors are built once and only their arrays swapped afterwards
+        if server_mode.pipeline:
+            server_mode.pipeline.update(scene.arrays)
+        else:
+            server_mode.pipeline = ScenePipeline(scene.arrays,
+                                                 server_mode.impostors)
+            for actor in server_mode.pipeline.actors:
+                server_mode.ren.AddActor(actor)
+        if reset:
             reset_camera()
+        else:
+            reset_camera.renWin.Render()
 
     def closeEvent(self, event):
         # Clean up the thread when window closes
@@ -357,7 +572,9 @@ class MainWindow(QMainWindow):
 def server_mode():
     import uvicorn
     from uvicorn.server import Server
-    from fastapi import BackgroundTasks, FastAPI
+    from fastapi import BackgroundTasks, FastAPI, WebSocket,\
+                        WebSocketDisconnect
+    from fastapi.responses import JSONResponse
 
     app = FastAPI()
 
@@ -386,9 +603,46 @@ def server_mode():
 
         @app.post("/update_scene")
         async def update_scene(payload: dict):
-            # Emit the signal. This is thread-safe.
-            qt_signal_emitter.data_received.emit(payload)
-            return {"status": "Message sent to GUI", "payload": payload}
+            # An init drops the frames still waiting, so one without a scene
+            # is turned away here rather than on the Qt thread
+            if payload.get('action') == 'init' and \
+                    not isinstance(payload.get('scene'), list):
+                return JSONResponse({"status": "malformed"},
+                                    status_code=400)
+            # Queue for the Qt thread. This is thread-safe.
+            depth = server_mode.frames.put(False, payload)
+            if depth is None:
+                return JSONResponse(
+                        {"status": "busy",
+                         "queue_depth": len(server_mode.frames)},
+                        status_code=429)
+            return {"status": "queued", "queue_depth": depth}
+
+        @app.websocket("/stream")
+        async def stream(websocket: WebSocket):
+            # Binary frames from scene_format.encode_stream_frame, each
+            # answered with a STREAM_ACK
+            await websocket.accept()
+            try:
+                while True:
+                    frame = await websocket.receive_bytes()
+                    try:
+                        sequence, payload = decode_stream_frame(frame)
+                    except ValueError as e:
+                        print(f"Bad stream frame: {e}")
+                        await websocket.send_bytes(
+                                stream_ack(0, STREAM_MALFORMED))
+                        continue
+                    depth = server_mode.frames.put(True, payload)
+                    if depth is None:
+                        await websocket.send_bytes(stream_ack(
+                                sequence, STREAM_BUSY,
+                                len(server_mode.frames)))
+                    else:
+                        await websocket.send_bytes(stream_ack(sequence,
+                                                              depth=depth))
+            except WebSocketDisconnect:
+                pass
 
         @app.get("/")
         async def root():
@@ -399,93 +653,105 @@ def server_mode():
 
 
 def load_scalar_field():
-    jd = load_scalar_field.json_doc
-    #print(jd['edges'][jd['cells'][0]['edges'][0]])
-    vertices = []
-    faces = []
-    colors = []
-    colorDict = defaultdict(lambda: [])
-    for v in jd['vertices']:
-        v['new_index'] = -1
-    for e in jd['edges']:
-        e['center_index'] = -1
-        e['center'] = [-1, -1, -1]
-        if not e['type']:
-            e['center'] = np.mean([np.array(jd['vertices'][j]['position'])
-                                   for j in e['vertices']], axis=0).tolist()
-            vertices.append(e['center'])
-            e['center_index'] = len(vertices) - 1
-    for c in jd['cells']:
-        center = np.array([0.0, 0.0, 0.0])
-        count = 0
-        for e in c['edges']:
-            edge = jd['edges'][e]
-            if not edge['type']:
-                for v in edge['vertices']:
-                    vertex = jd['vertices'][v]
-                    center += np.array(vertex['position'])
-                    count += 1
-                    if vertex['new_index'] == -1:
-                        vertices.append(vertex['position'])
-                        vertex['new_index'] = len(vertices) - 1
-        center /= count
-        c['center'] = center.tolist()
-        vertices.append(c['center'])
-        c['center_index'] = len(vertices) - 1
-        e_count = -1
-        done = False
-        for e in c['edges']:
-            edge = jd['edges'][e]
-            if not edge['type']:
-                vert1 = jd['vertices'][edge['vertices'][0]]
-                vert2 = jd['vertices'][edge['vertices'][1]]
-                v1 = vert1['new_index']
-                v2 = vert2['new_index']
-                ec = edge['center_index']
-                cc = c['center_index']
-                faces.append([v1, ec, cc])
-                faces.append([ec, v2, cc])
-                #print(f'{v1}, {v2}, {ec}, {cc}')
-
-                l = dist(vert1['position'], vert2['position'])
-                rgb = ratio_to_rgb(l / edge['rest_length'])
-                colorDict[v1].append(rgb)
-                colorDict[v2].append(rgb)
-                colorDict[ec].append(rgb)
-                colorDict[cc].append(rgb)
-                e_count += 1
-            if not done and e_count == 5:
-                done = True
-                for _ in range(12):
-                    colors.append(rgb)
-
-    #for i in range(len(vertices)):
-    #    if (colorDict[i]):
-    #        colors.append(np.mean(colorDict[i], axis=0).tolist())
-    #    else:
-    #        colors.append([1.0, 1.0, 1.0])
-
-    points = vtk.vtkPoints()
-    triangles = vtk.vtkCellArray()
-    ptColors = vtk.vtkFloatArray()
-    ptColors.SetNumberOfComponents(3)
-    ptColors.SetName('Colors')
-    for i in vertices:
-        points.InsertNextPoint(i)
-    for i in faces:
-        triangle = vtk.vtkTriangle()
-        triangle.GetPointIds().SetId(0, i[0])
-        triangle.GetPointIds().SetId(1, i[1])
-        triangle.GetPointIds().SetId(2, i[2])
-        triangles.InsertNextCell(triangle)
-    for i in colors:
-        ptColors.InsertNextTuple3(*i)
+    load_geometry(load_scalar_field, show_scalar_field,
+                  triangulate_scalar_field,
+                  (load_scalar_field.strain_cap, load_scalar_field.colormap),
+                  'scalar_field', ('field',),
+                  {'strain_cap': load_scalar_field.strain_cap,
+                   'colormap': load_scalar_field.colormap},
+                  {'field': ('Colors',)})
+
+"""
+Has show(result) put a loader's geometry on screen. When loader.cache holds
+what was built from loader.filename with params before, result is that entry
+({name: polydata} for names, each with the arrays required lists for it);
+otherwise it is what read(loader.filename, *args) returns, run in a worker
+process. loader.cache_key is left holding the key for show to store what it
+builds under (None without a cache).
+"""
+def load_geometry(loader, show, read, args, mode, names, params,
+                  required=None):
+    def looked_up(result):
+        loader.cache_key, cached = result
+        if cached is None:
+            run_in_background(show, read, loader.filename, *args,
+                              processes=True)
+        else:
+            show(cached)
+    loader.cache_key = None
+    if loader.cache is None:
+        run_in_background(show, read, loader.filename, *args, processes=True)
+    else:
+        # Hashing the file and reading the entry stay off the Qt thread too
+        run_in_background(looked_up, loader.cache.lookup, loader.filename,
+                          mode, names, params, required)
+
+"""
+Saves {name: polydata} under key in cache, off the Qt thread
+"""
+def store_in_background(cache, key, polydata):
+    run_in_background(lambda _: None, cache.store, key, polydata)
+
+"""
+Saves the {name: polydata} a loader built under loader.cache_key
+"""
+def store_geometry(loader, polydata):
+    if loader.cache_key is not None:
+        store_in_background(loader.cache, loader.cache_key, polydata)
 
+"""
+Reads a scalar field document as CSR topology arrays and fans its cells into
+colored triangles (runs in a worker process)
+"""
+def triangulate_scalar_field(filename, strain_cap=STRAIN_CAP_DEFAULT,
+                             colormap='strain'):
+    with open(filename) as f:
+        jd = json.load(f)
+    return triangulate_cells(*scalar_field_topology(jd), strain_cap, colormap)
+
+"""
+The vertex positions, edge end points, edge types, rest lengths and the CSR
+cell-to-edge lists of a scalar field document, as arrays. The document is
+only read.
+"""
+def scalar_field_topology(jd):
+    positions = np.array([v['position'] for v in jd['vertices']],
+                         dtype=np.float64).reshape(-1, 3)
+    edges = jd['edges']
+    edge_vertices = np.array([e['vertices'][:2] for e in edges],
+                             dtype=ID_DTYPE).reshape(-1, 2)
+    edge_typed = np.array([bool(e['type']) for e in edges], dtype=bool)
+    # Typed edges are never measured, so they may leave out rest_length
+    rest_lengths = np.array([e.get('rest_length', np.nan) for e in edges],
+                            dtype=np.float64)
+    cells = jd['cells']
+    cell_offsets = np.zeros(len(cells) + 1, dtype=ID_DTYPE)
+    np.cumsum([len(c['edges']) for c in cells], out=cell_offsets[1:])
+    cell_edges = np.fromiter(chain.from_iterable(c['edges'] for c in cells),
+                             dtype=ID_DTYPE, count=int(cell_offsets[-1]))
+    return (positions, edge_vertices, edge_typed, rest_lengths, cell_offsets,
+            cell_edges)
+
+def show_scalar_field(result):
     polyData = vtk.vtkPolyData()
-    polyData.SetPoints(points)
-    polyData.SetPolys(triangles)
+    if isinstance(result, dict):
+        polyData.ShallowCopy(result['field'])
+        colors = polyData.GetFieldData().GetArray('Colors')
+    else:
+        vertices, faces, colors = result
+        polyData.SetPoints(numpy_to_points(vertices))
+        polyData.SetPolys(numpy_to_cells(
+            np.arange(0, faces.size + 1, 3, dtype=ID_DTYPE), faces.ravel()))
+        colors = named_array(colors, 'Colors')
+        # There are fewer colors than triangles, which the mapper takes but
+        # the .vtp reader does not, so the cached copy keeps them as field
+        # data
+        cached = vtk.vtkPolyData()
+        cached.ShallowCopy(polyData)
+        cached.GetFieldData().AddArray(colors)
+        store_geometry(load_scalar_field, {'field': cached})
     #polyData.GetPointData().SetScalars(ptColors)
-    polyData.GetCellData().SetScalars(ptColors)
+    polyData.GetCellData().SetScalars(colors)
     mapper = vtk.vtkPolyDataMapper()
     mapper.SetInputData(polyData)
     mapper.SetColorMode(2)
@@ -495,61 +761,87 @@ def load_scalar_field():
     load_scalar_field.ren.AddActor(actor)
     reset_camera()
 
-def dist(p1, p2):
-    np1 = np.array(p1)
-    np2 = np.array(p2)
-    return np.linalg.norm(np1 - np2)
-
-def ratio_to_rgb(ratio):
-    cap = 0.05
-    min_cap = 1.0 - cap
-    max_cap = 1.0 + cap
-    #result = np.zeros(3)
-
-    if ratio > max_cap:
-        result = [255.0, 0.0, 0.0]
-    elif ratio < min_cap:
-        result = [0.0, 0.0, 255.0]
-    elif ratio > 1.0:
-        other = (ratio - 1.0) / cap * 255.0
-        green = 255.0 - other
-        result = [other, green, 0.0]
-    elif ratio <= 1.0:
-        other = (1.0 - ratio) / cap * 255.0
-        green = 255.0 - other
-        result = [0.0, green, other]
-    else:
-        print("WARNING: NaN in ratio_to_rgb")
-
-    return [i / 255.0 for i in result]
-
-
 def export_scene():
     export_scene.exporter.Update()
 
+"""
+Captures a render window to images, reusing one vtkWindowToImageFilter and one
+writer for every frame. Frames go to PNG files named by pattern % index, or
+as raw top-to-bottom RGB bytes to stream when one is given.
+"""
+class FrameWriter:
+
+    def __init__(self, ren_win, pattern, stream = None):
+        self.pattern = pattern
+        self.stream = stream
+        self.window_to_image_filter = vtk.vtkWindowToImageFilter()
+        self.window_to_image_filter.SetInput(ren_win)
+        self.window_to_image_filter.SetScale(1) # image quality
+        self.window_to_image_filter.SetInputBufferTypeToRGB()
+        self.window_to_image_filter.ReadFrontBufferOff()
+        self.writer = vtk.vtkPNGWriter()
+        self.writer.SetInputConnection(
+                self.window_to_image_filter.GetOutputPort())
+
+    def write(self, index):
+        self.window_to_image_filter.Modified()
+        self.window_to_image_filter.Update()
+        if self.stream is None:
+            self.writer.SetFileName(self.pattern % index)
+            self.writer.Write()
+            return
+        image = self.window_to_image_filter.GetOutput()
+        width, height, _ = image.GetDimensions()
+        rgb = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+        # VTK images start at the bottom row
+        self.stream.write(rgb.reshape(height, width, 3)[::-1].tobytes())
+
 def export_png():
-    writer = vtk.vtkPNGWriter()
-    window_to_image_filter = vtk.vtkWindowToImageFilter()
-    window_to_image_filter.SetInput(export_png.renWin)
-    window_to_image_filter.SetScale(1) # image quality
-    window_to_image_filter.SetInputBufferTypeToRGB()
-    window_to_image_filter.ReadFrontBufferOff()
-    window_to_image_filter.Update()
+    if export_png.frame_writer is None:
+        export_png.frame_writer = FrameWriter(
+                export_png.renWin,
+                f"scene_{calendar.timegm(time.gmtime())}_%d.png")
+    # The counter keeps exports within the same second apart
+    export_png.frame_writer.write(export_png.count)
+    export_png.count += 1
 
-    writer.SetFileName(f"scene_{calendar.timegm(time.gmtime())}.png")
-    writer.SetInputConnection(window_to_image_filter.GetOutputPort())
-    writer.Write()
+export_png.frame_writer = None
+export_png.count = 0
+
+"""
+Drops the scene actors to their coarse mappers while the camera moves, if the
+last still frame took longer than the interactor's frame budget. The style
+renders again at full detail once the interaction ends.
+"""
+def start_interaction(caller, ev):
+    ren = start_interaction.ren
+    rate = ren.GetRenderWindow().GetInteractor().GetDesiredUpdateRate()
+    if ren.GetLastRenderTimeInSeconds() > 1.0 / rate:
+        set_detail(ren, True)
+        start_interaction.coarse = True
+
+def end_interaction(caller, ev):
+    if start_interaction.coarse:
+        set_detail(start_interaction.ren, False)
+        start_interaction.coarse = False
 
 def reset_camera():
     reset_camera.ren.ResetCamera()
     reset_camera.renWin.Render()
 
-def json_get(json_obj, *args):
-    for arg in args:
-        try:
-            return json_obj[arg]
-        except:
-            pass
+"""
+Halves ([) or doubles (]) the strain at which render mode colors saturate.
+Only the lookup table's range changes, the steps are not recolored.
+"""
+def strain_cap_key(caller, ev):
+    key = caller.GetKeySym()
+    if key not in ('bracketleft', 'bracketright'):
+        return
+    lo, hi = load_next.lookup_table.GetRange()
+    cap = (hi - lo) / 2 * (0.5 if key == 'bracketleft' else 2.0)
+    set_strain_cap(load_next.lookup_table, cap)
+    print(f"Strain cap: {cap:g}")
+    reset_camera.renWin.Render()
 
 """
 Prints which vertex was clicked on when in model mode
@@ -561,14 +853,52 @@ def model_callback(caller, ev):
     picked_actor = picker.GetActor()
     if picked_actor == model_callback.center_actor:
         pos = np.array(picker.GetPickPosition())
-        bestDist = float('inf')
-        bestInd = -1
-        for i in range(model_callback.vert_mat.shape[0]):
-            dist = np.linalg.norm(pos - model_callback.vert_mat[i])
-            if dist < bestDist:
-                bestDist = dist
-                bestInd = i
-        callback_function.info_box.setPlainText(f'Picked Vertex: {bestInd}\n{pos}')
+        index = model_callback.vertex_index
+        bestInd = index.nearest(pos)
+        # The picked vertex itself comes first, skip it
+        neighbours = index.k_nearest(index.vertices[bestInd],
+                                     MODEL_NEIGHBOURS + 1)[1:]
+        dists = index.distances(index.vertices[bestInd], neighbours)
+        neighbourhood = '\n'.join(f'{i}: {d:.4f}'
+                                  for i, d in zip(neighbours, dists))
+        callback_function.info_box.setPlainText(
+                f'Picked Vertex: {bestInd}\n{pos}\n\n'
+                f'Nearest Vertices:\n{neighbourhood}')
+
+"""
+Returns the index of the entity drawn at display position x, y by a batched
+glyph or tube actor, or None. A hardware selection gives the glyph index or
+the tube cell, which the "Entity Ids" array maps back to the entity.
+"""
+def pick_entity(ren, actor, x, y):
+    selector = vtk.vtkHardwareSelector()
+    selector.SetRenderer(ren)
+    selector.SetArea(x, y, x, y)
+    if isinstance(actor.GetMapper(), vtk.vtkPointGaussianMapper):
+        # Splats have no cells, they are selected as points
+        selector.SetFieldAssociation(
+                vtk.vtkDataObject.FIELD_ASSOCIATION_POINTS)
+    else:
+        selector.SetFieldAssociation(
+                vtk.vtkDataObject.FIELD_ASSOCIATION_CELLS)
+    selection = selector.Select()
+    for i in range(selection.GetNumberOfNodes()):
+        node = selection.GetNode(i)
+        if node.GetProperties().Get(vtk.vtkSelectionNode.PROP()) != actor or\
+                not node.GetSelectionList() or\
+                not node.GetSelectionList().GetNumberOfTuples():
+            continue
+        picked_id = int(node.GetSelectionList().GetTuple1(0))
+        mapper = actor.GetMapper()
+        if isinstance(mapper, (vtk.vtkGlyph3DMapper,
+                               vtk.vtkPointGaussianMapper)):
+            ids = mapper.GetInput().GetPointData().GetArray("Entity Ids")
+        else:
+            ids = mapper.GetInput().GetCellData().GetArray("Entity Ids")
+        if ids is None or picked_id >= ids.GetNumberOfTuples():
+            return None
+        return int(ids.GetTuple1(picked_id))
+    return None
 
 """
 Prints information on the selected entity to an info box in the GUI
@@ -579,13 +909,20 @@ def callback_function(caller, ev):
     picker.PickProp(pos[0], pos[1], callback_function.ren)
     picked_actor = picker.GetActor()
     if picked_actor:
+        x, y = pos
         pos = picker.GetPickPosition()
         string = f'3D Scene Position: {pos[0]:.2f}, {pos[1]:.2f}, {pos[2]:.2f}\n\n'
         if not callback_function.basic:
-            try:
-                string += str(load_next.descriptions[picked_actor])
-            except KeyError:
-                string += "No entity description provided"
+            description = None
+            if picked_actor in load_next.descriptions:
+                entity = pick_entity(callback_function.ren, picked_actor,
+                                     x, y)
+                if entity is not None:
+                    description = \
+                            load_next.descriptions[picked_actor][entity]
+            if description is None:
+                description = "No entity description provided"
+            string += str(description)
         callback_function.info_box.setPlainText(string)
     else:
         callback_function.info_box.setPlainText(
@@ -593,11 +930,84 @@ def callback_function(caller, ev):
                 'No actor picked')
 
 """
-Runs through all entities in the list (not an instantaneous process)
+Starts or pauses playback through the rest of the list
 """
 def run_all():
-    while load_next.i < len(load_next.json_doc['list']):
-        load_next()
+    run_all.playback.toggle()
+    run_all.button.setText("Pause" if run_all.playback.playing()
+                           else "Run All")
+
+def playback_finished():
+    run_all.button.setText("Run All")
+
+"""
+Jumps to the step picked in the step box
+"""
+def seek(i):
+    run_all.playback.seek(i)
+
+"""
+Checks for step i without forcing a streamed step list to be read to the end,
+or building the step
+"""
+def has_step(i):
+    try:
+        load_next.steps.is_held(i)
+    except IndexError:
+        return False
+    return True
+
+def step_is_held(i):
+    return load_next.steps.is_held(i)
+
+def resets_every_step():
+    return 'reset' not in load_next.json_doc.keys() or\
+            load_next.json_doc['reset']
+
+"""
+Runs on the playback worker: prepares step i, or the step up to skip places
+after it if none of the steps jumped over are held. Only the step prepared is
+read and built, the ones jumped over are just checked for hold. Returns None
+at the end.
+"""
+def prepare_ahead(i, skip):
+    target = i
+    for j in range(i, i + skip):
+        if not has_step(j + 1) or step_is_held(j):
+            break
+        target = j + 1
+    try:
+        return prepare_step(target)
+    except IndexError:
+        return None
+
+"""
+Removes everything load_next has put on screen, held entries included
+"""
+def clear_scene():
+    for actor in load_next.actors + load_next.hold_actors:
+        load_next.ren.RemoveActor(actor)
+    load_next.actors = []
+    load_next.hold_actors = []
+    load_next.descriptions = {}
+    if load_next.pipeline:
+        load_next.pipeline.update(SceneArrays())
+    load_next.bounds = Bounds()
+    load_next.hold_bounds = Bounds()
+
+"""
+Shows step i as if the list had been stepped through up to it: held steps
+before it (or every step, when the document does not reset) are replayed
+"""
+def seek_step(i):
+    if not has_step(i):
+        print("No more scenes to render", file=sys.stderr)
+        return
+    clear_scene()
+    for j in range(i):
+        if not resets_every_step() or step_is_held(j):
+            show_step(prepare_step(j))
+    show_step(prepare_step(i))
 
 """
 Loads obj file and visualizes it
@@ -621,104 +1031,231 @@ Loads model
 """
 def load_model():
     if load_model.done:
-        print("No more scenes to render")
+        print("No more scenes to render", file=sys.stderr)
         return
-    importer = vtk.vtkOBJImporter()
-    importer.SetFileName(load_model.filename)
-    importer.SetRenderWindow(load_model.ren_win)
-    importer.Update()
+    load_geometry(load_model, show_model, read_obj, (), 'model',
+                  ('lines', 'tubes'),
+                  {'sphere_radius': load_model.sphere_radius,
+                   'tube_radius': load_model.tube_radius,
+                   'triangle_budget': load_model.triangle_budget,
+                   'impostors': bool(load_model.impostors)})
 
-    all_actors = importer.GetRenderer().GetActors()
-    model_actor = all_actors.GetLastActor()
-    mesh_in = model_actor.GetMapper().GetInput()
-
-    # Points
-    f = open(load_model.filename)
-    lines = f.readlines()
-    vertices = []
-    faces = []
-    for line in lines:
-        if len(line) and line[0:2] == 'v ':
-            vertices.append([float(i) for i in line.strip().split()[1:4]])
-        if len(line) and line[0:2] == 'f ':
-            faces.append([int(i) for i in np.array(line.replace('//',
-                         ' ').split())[[1, 3, 5]]])
-    num_vertices = len(vertices)
-    vert_mat = np.array(vertices)
-    points = vtk.vtkPoints()
-    positions = [[], [], []]
-    for i in range(0, num_vertices):
-        x = vert_mat[i, 0]
-        y = vert_mat[i, 1]
-        z = vert_mat[i, 2]
-        points.InsertNextPoint(x, y, z)
-        positions[0].append(x)
-        positions[1].append(y)
-        positions[2].append(z)
-    # Lines
-    num_faces = len(faces)
-    lines = vtk.vtkCellArray()
-    for i in range(0, num_faces):
-        face = faces[i]
-        for j in range(0, 3):
-            line = vtk.vtkLine()
-            line.GetPointIds().SetId(0, face[j]-1)
-            line.GetPointIds().SetId(1, face[(j+1)%3]-1)
-            lines.InsertNextCell(line)
+"""
+Picks the tube sides and sphere resolution for a model so that its tubes and
+vertex spheres stay within budget triangles, going down from the default 8
+sided tubes and 8x8 spheres. Returns (sides, theta, phi), or None when even
+the coarsest level is over budget and plain lines and points should be drawn.
+"""
+def model_resolution(num_vertices, num_edges, budget):
+    for sides, theta, phi in MODEL_LEVELS:
+        # Two triangles per side of a tube, 2 * theta * (phi - 1) per sphere
+        triangles = 2 * sides * num_edges + \
+                2 * theta * (phi - 1) * num_vertices
+        if triangles <= budget:
+            return sides, theta, phi
+    return None
 
-    load_model.ren.RemoveActor(all_actors.GetLastActor())
-    sphere_source = vtk.vtkSphereSource()
-    sphere_source.SetRadius(load_model.sphere_radius)
-    sphere_pd = vtk.vtkPolyData()
-    sphere_points = points
+"""
+Reads the vertices and faces of an OBJ file (runs in a worker process). The
+file is read in chunks and each chunk's "v" and "f" lines are converted with
+a handful of NumPy calls; faces may be written as v, v/vt, v/vt/vn or v//vn.
+Returns (n, 3) vertices and the faces in CSR form with 0-based indices.
+"""
+def read_obj(filename, chunk_size=1 << 24):
+    vertex_line = re.compile(rb'^v[ \t]+([^\n]*)', re.M)
+    face_line = re.compile(rb'^f[ \t]+([^\n]*)', re.M)
+    vertex_chunks = []
+    count_chunks = []
+    index_chunks = []
+    num_vertices = 0
+    with open(filename, 'rb') as f:
+        rest = b''
+        while True:
+            data = f.read(chunk_size)
+            chunk = rest + data
+            if data:
+                # Keep the partial last line for the next chunk
+                end = chunk.rfind(b'\n') + 1
+                chunk, rest = chunk[:end], chunk[end:]
+            if chunk:
+                vertices = obj_vertices(vertex_line.findall(chunk))
+                counts, indices = obj_faces(face_line.findall(chunk))
+                if (indices < 0).any():
+                    # Negative indices count back from the last vertex
+                    # defined before their face, turned 1-based here
+                    before = np.searchsorted(
+                            [m.start() for m in vertex_line.finditer(chunk)],
+                            [m.start() for m in face_line.finditer(chunk)])
+                    before = np.repeat(before + num_vertices, counts)
+                    indices = np.where(indices < 0, indices + before + 1,
+                                       indices)
+                num_vertices += len(vertices)
+                vertex_chunks.append(vertices)
+                count_chunks.append(counts)
+                index_chunks.append(indices)
+            if not data:
+                break
+    vertices = np.concatenate(vertex_chunks)
+    offsets = np.concatenate(([0], np.cumsum(np.concatenate(count_chunks))))\
+            .astype(ID_DTYPE)
+    # OBJ indices are 1-based
+    connectivity = np.concatenate(index_chunks) - 1
+    return vertices, (offsets, connectivity)
 
-    lines_pd = vtk.vtkPolyData()
-    lines_points = points
-    lines_cells = lines
+"""
+The number of whitespace separated tokens on each of the num_lines lines of
+text, counted without splitting the lines one by one
+"""
+def tokens_per_line(text, num_lines):
+    data = np.frombuffer(text, dtype=np.uint8)
+    space = data <= ord(' ')
+    starts = ~space
+    starts[1:] &= space[:-1]
+    newlines = np.flatnonzero(data == ord('\n'))
+    lines = np.searchsorted(newlines, np.flatnonzero(starts))
+    return np.bincount(lines, minlength=num_lines)
 
-    sphere_pd.SetPoints(sphere_points)
-    mapper = vtk.vtkGlyph3DMapper()
-    mapper.SetInputData(sphere_pd)
-    mapper.SetSourceConnection(sphere_source.GetOutputPort())
-    mapper.ScalarVisibilityOff()
-    mapper.ScalingOff()
+"""
+Converts the text after "f" on each face line to the number of vertices of
+each face and their (1-based) vertex indices. Every corner is cut down to the
+text before its first slash, so v, v/vt, v/vt/vn and v//vn corners may be
+mixed freely.
+"""
+def obj_faces(lines):
+    text = b'\n'.join(lines)
+    if b'/' in text:
+        # Blank out every byte from a slash up to the end of its corner
+        data = np.frombuffer(text, dtype=np.uint8).copy()
+        index = np.arange(len(data), dtype=np.int64)
+        last_slash = np.maximum.accumulate(
+                np.where(data == ord('/'), index, -1))
+        last_space = np.maximum.accumulate(
+                np.where(data <= ord(' '), index, -1))
+        data[last_slash > last_space] = ord(' ')
+        text = data.tobytes()
+    corners = text.split()
+    # Faces have at least three corners, so this many means only triangles
+    if len(corners) == 3 * len(lines):
+        counts = np.full(len(lines), 3, dtype=ID_DTYPE)
+    else:
+        counts = tokens_per_line(text, len(lines)).astype(ID_DTYPE)
+    return counts, np.array(corners, dtype=ID_DTYPE)
 
-    actor = vtk.vtkActor()
-    actor.SetMapper(mapper)
+"""
+Converts the text after "v" on each vertex line to an (n, 3) array, dropping
+any w or vertex color columns. Lines may differ in how many columns they have.
+"""
+def obj_vertices(lines):
+    text = b'\n'.join(lines)
+    values = np.array(text.split(), dtype=np.float64)
+    # Vertices have at least three coordinates, so this many means no line
+    # has more
+    if len(values) == 3 * len(lines):
+        return values.reshape(-1, 3)
+    counts = tokens_per_line(text, len(lines))
+    if counts.min() < 3:
+        raise ValueError("OBJ vertex with fewer than 3 coordinates")
+    firsts = np.cumsum(counts) - counts
+    return values[firsts[:, None] + np.arange(3)]
+
+"""
+Draws a model from read_obj's result, or from its cached mesh edges and tubes
+"""
+def show_model(result):
+    tubes_pd = None
+    if isinstance(result, dict):
+        lines_pd, tubes_pd = result['lines'], result['tubes']
+        points = lines_pd.GetPoints()
+        if points is None:
+            points = vtk.vtkPoints()
+        vert_mat = numpy_support.vtk_to_numpy(points.GetData())
+    else:
+        vert_mat, (offsets, connectivity) = result
+        points = numpy_to_points(vert_mat)
+        # Each edge is tubed once, not once per face that shares it
+        edges = unique_edges(offsets, connectivity)
+        lines_pd = vtk.vtkPolyData()
+        lines_pd.SetPoints(points)
+        lines_pd.SetLines(numpy_to_cells(
+            np.arange(0, 2 * len(edges) + 1, 2), edges.ravel()))
+    num_edges = lines_pd.GetNumberOfLines()
+
+    sphere_pd = vtk.vtkPolyData()
+    sphere_pd.SetPoints(points)
+
+    if load_model.impostors:
+        # Splats and shaded lines, whatever the size
+        resolution = None
+    else:
+        resolution = model_resolution(len(vert_mat), num_edges,
+                                      load_model.triangle_budget)
+        if resolution is None:
+            print(f"Model has {len(vert_mat)} vertices and {num_edges} "
+                  f"edges, over the {load_model.triangle_budget} triangle "
+                  "budget: drawing points and lines")
+    if load_model.impostors:
+        actor = make_sphere_impostor_actor(sphere_pd, load_model.sphere_radius)
+    elif resolution is None:
+        sphere_pd.SetVerts(numpy_to_cells(np.arange(len(vert_mat) + 1),
+                                          np.arange(len(vert_mat))))
+        mapper = vtk.vtkPolyDataMapper()
+        mapper.SetInputData(sphere_pd)
+        actor = vtk.vtkActor()
+        actor.SetMapper(mapper)
+        actor.GetProperty().RenderPointsAsSpheresOn()
+        actor.GetProperty().SetPointSize(MODEL_POINT_SIZE)
+    else:
+        sides, theta, phi = resolution
+        sphere_source = vtk.vtkSphereSource()
+        sphere_source.SetRadius(load_model.sphere_radius)
+        sphere_source.SetThetaResolution(theta)
+        sphere_source.SetPhiResolution(phi)
+        mapper = vtk.vtkGlyph3DMapper()
+        mapper.SetInputData(sphere_pd)
+        mapper.SetSourceConnection(sphere_source.GetOutputPort())
+        mapper.ScalarVisibilityOff()
+        mapper.ScalingOff()
+        actor = vtk.vtkActor()
+        actor.SetMapper(mapper)
     load_model.ren.AddActor(actor)
 
     model_callback.center_actor = actor
-    model_callback.vert_mat = vert_mat
+    model_callback.vertex_index = VertexIndex(vert_mat)
 
-    lines_pd.SetPoints(lines_points)
-    lines_pd.SetLines(lines_cells)
-    tube_filter = vtk.vtkTubeFilter()
-    tube_filter.SetInputData(lines_pd)
-    tube_filter.SetNumberOfSides(8)
-    tube_filter.SetRadius(load_model.tube_radius)
-    tube_filter.Update()
     mapper = vtk.vtkPolyDataMapper()
-    mapper.SetInputConnection(tube_filter.GetOutputPort())
     actor2 = vtk.vtkActor()
+    if resolution is None:
+        mapper.SetInputData(lines_pd)
+        actor2.GetProperty().RenderLinesAsTubesOn()
+        actor2.GetProperty().SetLineWidth(MODEL_LINE_WIDTH)
+    else:
+        if tubes_pd is None:
+            tube_filter = vtk.vtkTubeFilter()
+            tube_filter.SetInputData(lines_pd)
+            tube_filter.SetNumberOfSides(sides)
+            tube_filter.SetRadius(load_model.tube_radius)
+            tube_filter.Update()
+            tubes_pd = tube_filter.GetOutput()
+        mapper.SetInputData(tubes_pd)
     actor2.SetMapper(mapper)
     load_model.ren.AddActor(actor2)
+    if not isinstance(result, dict):
+        # Lines and points need no tubes
+        store_geometry(load_model, {
+            'lines': lines_pd,
+            'tubes': vtk.vtkPolyData() if tubes_pd is None else tubes_pd})
 
     # Make the axes actor to the correct sizing based on the elements on screen
     cube_axis = vtk.vtkCubeAxesActor()
     cube_axis.SetCamera(load_model.ren.GetActiveCamera())
-    mins = [min(i) for i in positions]
-    maxs = [max(i) for i in positions]
-    dists = [i[0] - i[1] for i in zip(maxs, mins)]
-    mins = [i[0] - max(load_model.sphere_radius, i[1] * 0.1)
-            for i in zip(mins, dists)]
-    maxs = [i[0] + max(load_model.sphere_radius, i[1] * 0.1)
-            for i in zip(maxs, dists)]
-    bbox = [maxs[i] - mins[i] for i in range(3)]
+    bounds = Bounds()
+    bounds.add_points(vert_mat)
+    bounds = bounds.padded(load_model.sphere_radius)
+    bbox = [bounds[2 * i + 1] - bounds[2 * i] for i in range(3)]
     load_model.info_box.setPlainText(
             f'Bounding Box Size: {bbox[0]}, {bbox[1]}, {bbox[2]}')
     cube_axis.SetFlyModeToStaticEdges()
-    cube_axis.SetBounds((mins[0], maxs[0], mins[1], maxs[1],
-        mins[2], maxs[2]))
+    cube_axis.SetBounds(bounds)
     load_model.ren.AddActor(cube_axis)
 
     reset_camera()
@@ -728,8 +1265,20 @@ Loads basic mode scene
 """
 def load_basic_scene():
     if load_basic_scene.done:
-        print("No more scenes to render")
+        print("No more scenes to render", file=sys.stderr)
         return
+    load_geometry(load_basic_scene, show_basic_scene, parse_basic_scene, (),
+                  'basic', ('spheres', 'lines', 'tubes'),
+                  {'sphere_radius': load_basic_scene.sphere_radius,
+                   'tube_radius': load_basic_scene.tube_radius,
+                   'impostors': bool(load_basic_scene.impostors)},
+                  {'spheres': ('Colors',)})
+
+"""
+Parses the positions and color names of a basic mode file (runs in a worker
+process)
+"""
+def parse_basic_scene(filename):
     '''
     try:
         scene = [[float(j) for j in i.strip().split(',')] for i in
@@ -740,23 +1289,25 @@ def load_basic_scene():
                open(load_basic_scene.filename).readlines() if i != '\n' and
                  '#' not in i]
     '''
-    scene = [[float(j) for j in re.findall(r'-?[\d\.]+', i.strip())] for i in
-               open(load_basic_scene.filename).readlines() if i != '\n' and
-                 '#' not in i]
-    colors = [re.findall(r'[a-zA-Z]+', i.strip()) for i in
-               open(load_basic_scene.filename).readlines() if i != '\n' and
-                 '#' not in i]
+    lines = [i for i in open(filename).readlines() if i != '\n' and
+             '#' not in i]
+    scene = [[float(j) for j in re.findall(r'-?[\d\.]+', i.strip())]
+             for i in lines]
+    colors = [re.findall(r'[a-zA-Z]+', i.strip()) for i in lines]
     colors = [i[0].title() if len(i) else 'Cornsilk' for i in colors]
+    return scene, colors
+
+"""
+The sphere and line polydata of a parsed basic mode file
+"""
+def basic_polydata(scene, colors):
     #print(scene)
     #print(colors)
     #exit(0)
-    positions = [[], [], []]
-    sphere_source = vtk.vtkSphereSource()
-    sphere_source.SetRadius(load_basic_scene.sphere_radius)
     sphere_pd = vtk.vtkPolyData()
     sphere_points = vtk.vtkPoints()
 
-    colors_sphere = vtk.vtkFloatArray()
+    colors_sphere = vtk.vtkUnsignedCharArray()
     colors_sphere.SetNumberOfComponents(4)
     colors_sphere.SetName("Colors")
 
@@ -766,17 +1317,12 @@ def load_basic_scene():
     n = 0
     nc = vtk.vtkNamedColors()
     for entity, color in zip(scene, colors):
-        if len(entity) == 6:
-            for i in range(3):
-                positions[i].append(entity[i+3])
-        elif len(entity) == 2:
+        if len(entity) == 2:
             entity.append(0)
-        for i in range(3):
-            positions[i].append(entity[i])
         actor = None
         if len(entity) == 3:
             sphere_points.InsertNextPoint(entity)
-            colors_sphere.InsertNextTuple4(*nc.GetColor4d(color))
+            colors_sphere.InsertNextTuple4(*nc.GetColor4ub(color))
         elif len(entity) == 6:
             lines_points.InsertNextPoint(entity[:3])
             lines_points.InsertNextPoint(entity[3:])
@@ -786,6 +1332,24 @@ def load_basic_scene():
             lines_cells.InsertNextCell(line)
             n += 2
 
+    sphere_pd.SetPoints(sphere_points)
+    sphere_pd.GetPointData().AddArray(colors_sphere)
+    lines_pd.SetPoints(lines_points)
+    lines_pd.SetLines(lines_cells)
+    return sphere_pd, lines_pd
+
+"""
+Draws a basic mode file from parse_basic_scene's result, or from its cached
+spheres, lines and tubes
+"""
+def show_basic_scene(result):
+    tubes_pd = None
+    if isinstance(result, dict):
+        sphere_pd, lines_pd, tubes_pd = \
+                result['spheres'], result['lines'], result['tubes']
+    else:
+        sphere_pd, lines_pd = basic_polydata(*result)
+
     '''
     sphere_pd.SetPoints(sphere_points)
     sphere_pd.GetPointData().AddArray(colors_sphere)
@@ -802,10 +1366,34 @@ def load_basic_scene():
     actor.SetMapper(mapper)
     '''
 
-    sphere_pd.SetPoints(sphere_points)
+    if load_basic_scene.impostors:
+        load_basic_scene.ren.AddActor(make_sphere_impostor_actor(
+            sphere_pd, load_basic_scene.sphere_radius))
+        load_basic_scene.ren.AddActor(make_line_impostor_actor(lines_pd))
+    else:
+        show_basic_glyphs(sphere_pd)
+        if tubes_pd is None:
+            tube_filter = vtk.vtkTubeFilter()
+            tube_filter.SetInputData(lines_pd)
+            tube_filter.SetNumberOfSides(8)
+            tube_filter.SetRadius(load_basic_scene.tube_radius)
+            tube_filter.Update()
+            tubes_pd = tube_filter.GetOutput()
+        mapper = vtk.vtkPolyDataMapper()
+        mapper.SetInputData(tubes_pd)
+        actor = vtk.vtkActor()
+        actor.SetMapper(mapper)
+        load_basic_scene.ren.AddActor(actor)
+    if not isinstance(result, dict):
+        store_geometry(load_basic_scene, {
+            'spheres': sphere_pd, 'lines': lines_pd,
+            'tubes': vtk.vtkPolyData() if tubes_pd is None else tubes_pd})
+    show_basic_bounds(sphere_pd, lines_pd)
+
+def show_basic_glyphs(sphere_pd):
+    sphere_source = vtk.vtkSphereSource()
+    sphere_source.SetRadius(load_basic_scene.sphere_radius)
     mapper = vtk.vtkGlyph3DMapper()
-
-    sphere_pd.GetPointData().AddArray(colors_sphere)
     mapper.SetInputData(sphere_pd)
     mapper.SetSourceConnection(sphere_source.GetOutputPort())
     mapper.SetScalarModeToUsePointFieldData()
@@ -813,8 +1401,8 @@ def load_basic_scene():
     mapper.SelectColorArray("Colors")
     mapper.SetColorMode(2)
 
-    mapper.SetScaleModeToScaleByVectorComponents()
-    mapper.SetScaleArray("Scale Factors")
+    # The sphere source already has the sphere radius
+    mapper.ScalingOff()
     mapper.Update()
 
     actor = vtk.vtkActor()
@@ -822,275 +1410,213 @@ def load_basic_scene():
 
     load_basic_scene.ren.AddActor(actor)
 
-    lines_pd.SetPoints(lines_points)
-    lines_pd.SetLines(lines_cells)
-    tube_filter = vtk.vtkTubeFilter()
-    tube_filter.SetInputData(lines_pd)
-    tube_filter.SetNumberOfSides(8)
-    tube_filter.SetRadius(load_basic_scene.tube_radius)
-    tube_filter.Update()
-    mapper = vtk.vtkPolyDataMapper()
-    mapper.SetInputConnection(tube_filter.GetOutputPort())
-    actor = vtk.vtkActor()
-    actor.SetMapper(mapper)
-    load_basic_scene.ren.AddActor(actor)
-
+def show_basic_bounds(*polydata):
     # Make the axes actor to the correct sizing based on the elements on screen
+    bounds = Bounds()
+    for i in polydata:
+        if i.GetNumberOfPoints():
+            bounds.add_points(
+                numpy_support.vtk_to_numpy(i.GetPoints().GetData()))
     cube_axis = vtk.vtkCubeAxesActor()
     cube_axis.SetCamera(load_basic_scene.ren.GetActiveCamera())
-    mins = [min(i) for i in positions]
-    maxs = [max(i) for i in positions]
-    dists = [i[0] - i[1] for i in zip(maxs, mins)]
-    mins = [i[0] - max(load_basic_scene.sphere_radius, i[1] * 0.1)
-            for i in zip(mins, dists)]
-    maxs = [i[0] + max(load_basic_scene.sphere_radius, i[1] * 0.1)
-            for i in zip(maxs, dists)]
     cube_axis.SetFlyModeToStaticEdges()
-    cube_axis.SetBounds((mins[0], maxs[0], mins[1], maxs[1],
-        mins[2], maxs[2]))
+    cube_axis.SetBounds(bounds.padded(load_basic_scene.sphere_radius))
     #load_basic_scene.ren.AddActor(cube_axis)
 
     reset_camera()
 
+"""
+Associates a lot of persistent information with load_next
+"""
+def setup_load_next(ren, args):
+    load_next.add_cube_axis = not args.render_mode
+    # Render mode tubes are colored by strain on the GPU, so the cap can be
+    # changed without touching the steps
+    load_next.lookup_table = strain_lookup_table(args.strain_cap,
+                                                 args.colormap)\
+            if args.render_mode else None
+    load_next.reset = not args.dont_reset
+    load_next.i = 0
+    load_next.ren = ren
+    load_next.actors = []
+    load_next.hold_actors = []
+    load_next.pipeline = None
+    load_next.bounds = Bounds()
+    load_next.hold_bounds = Bounds()
+    load_next.cube_axis = None
+    load_next.descriptions = {}
+    load_next.tube_radius = args.tube_radius
+    load_next.sphere_radius = args.sphere_radius
+    load_next.impostors = args.impostors
+    load_next.step_box = None
+
+"""
+Opens the step list for load_next, returning it with the document level keys.
+With a cache, built JSON and render mode steps are kept in it, and written to
+it off the Qt thread when background is set.
+"""
+def open_steps(filename, render_mode, step_cache, sphere_radius, tube_radius,
+               cache=None, background=False):
+    store = None
+    if background and cache is not None:
+        store = lambda key, polydata: store_in_background(cache, key,
+                                                          polydata)
+    if render_mode:
+        # The lookup table colors the tubes, so the steps do not depend on
+        # the cap or the colormap
+        steps = RenderBatch(filename, step_cache, colors=False)
+        if cache is not None:
+            key = cache.key(filename, 'render')
+            steps = CachedSteps(steps, cache, key, steps.sphere_radius,
+                                steps.tube_radius, store=store)
+        return steps, {"glyph": True}
+    if is_scene_file(filename):
+        steps = SceneFile(filename, sphere_radius, tube_radius)
+        json_doc = dict(steps.meta)
+        # Binary files carry no descriptions, so always batch them
+        json_doc["glyph"] = True
+        return steps, json_doc
+    # Only the first entry is parsed here, the rest are read from their byte
+    # offsets as load_next asks for them. "reset" and "glyph" keep their
+    # defaults until the list has been read past, if they follow it.
+    steps = JsonStepIndex(filename)
+    if cache is not None:
+        key = cache.key(filename, 'steps', sphere_radius=sphere_radius,
+                        tube_radius=tube_radius)
+        # Descriptions are only needed when entities can be picked
+        return CachedSteps(steps, cache, key, sphere_radius, tube_radius,
+                           not steps.meta.get("glyph"), store), steps.meta
+    return steps, steps.meta
+
+"""
+Whether the document asked for glyphs only, which skips descriptions and
+picking
+"""
+def glyph_mode():
+    return "glyph" in load_next.json_doc.keys() and load_next.json_doc["glyph"]
+
+"""
+Reads step i and does all of the work that does not touch the renderer, so it
+can run off the GUI thread. Raises IndexError past the last step.
+"""
+def prepare_step(i):
+    curr = load_next.steps[i]
+    step = {'index': i}
+    if isinstance(curr, SceneArrays):
+        # Steps from a binary scene file are already in array form
+        step['arrays'] = curr
+        step['scene'] = []
+        step['hold'] = curr.hold
+        step['reset'] = curr.reset
+    else:
+        step['arrays'] = None
+        # List of entities to process
+        step['scene'] = json_get(curr, 'entities', 'e')
+        # Whether this scene should be persistent through resets
+        step['hold'] = 'hold' in curr.keys() and curr['hold']
+        if 'reset' in curr:
+            step['reset'] = curr['reset']
+        else:
+            step['reset'] = False
+    if step['arrays'] is None:
+        # Descriptions are only needed when entities can be picked
+        step['arrays'] = entities_to_arrays(step['scene'],
+                                            load_next.sphere_radius,
+                                            load_next.tube_radius,
+                                            not glyph_mode())
+    return step
+
 """
 Loads the next entity into the scene, and clears it if appropriate
 """
 def load_next():
-    if load_next.i > len(load_next.json_doc['list']) - 1:
-        print("No more scenes to render")
+    try:
+        step = prepare_step(load_next.i)
+    except IndexError:
+        print("No more scenes to render", file=sys.stderr)
         return
+    except (ValueError, OSError) as e:
+        step_error(e)
+        return
+    show_step(step)
 
-    curr = load_next.json_doc['list'][load_next.i]
-    # List of entities to process
-    scene = json_get(curr, 'entities', 'e')
-    # Whether this scene should be persistent through resets
-    hold = 'hold' in curr.keys() and curr['hold']
-    if 'reset' in curr:
-        curr_reset_check = curr['reset']
-    else:
-        curr_reset_check = False
+"""
+Reports a step that could not be read, such as one cut short by a truncated
+file, on stderr and in the info box. It must not escape the Qt slot reading
+the step, PyQt aborts the process when an exception does.
+"""
+def step_error(e):
+    message = f"Could not read step: {e}"
+    print(message, file=sys.stderr)
+    info_box = getattr(callback_function, 'info_box', None)
+    if info_box is not None:
+        info_box.setPlainText(message)
+
+"""
+Puts a step returned by prepare_step on screen
+"""
+def show_step(step):
+    arrays = step['arrays']
+    hold = step['hold']
+    curr_reset_check = step['reset']
     # Perform a reset if requested
-    if ('reset' not in load_next.json_doc.keys() or\
+    reset = ('reset' not in load_next.json_doc.keys() or\
             load_next.json_doc['reset']) or\
-            curr_reset_check:
-        load_next.positions = deepcopy(load_next.hold_positions)
+            curr_reset_check
+    if reset:
+        load_next.bounds = load_next.hold_bounds.copy()
         for actor in load_next.actors:
             # Hold the actors marked as such
             if actor not in load_next.hold_actors:
                 load_next.ren.RemoveActor(actor)
+                load_next.descriptions.pop(actor, None)
         load_next.actors = []
-    # Process every entity within this scene/JSON entry
-    for entity in scene:
-        # Determine how large to make the axes
-        #try:
-        pos = json_get(entity, 'p', 'position')
-        for i in range(len(pos)):
-            if type(pos[i]) is float:
-                load_next.positions[i % 3].append(pos[i])
-            else:
-                for j in range(len(pos[i])):
-                    load_next.positions[j].append(pos[i][j])
-            if hold:
-                if type(pos) is int:
-                    load_next.positions[i % 3].append(pos[i])
-                else:
-                    for j in range(len(pos[i])):
-                        load_next.positions[j].append(pos[i][j])
-        #except:
-        #    print(entity)
-        #    exit(1)
-    if "glyph" in load_next.json_doc.keys() and load_next.json_doc["glyph"]:
-        sphere_source = vtk.vtkSphereSource()
-        #sphere_source.SetRadius(load_next.sphere_radius)
-        #sphere_source.SetRadius(.01)
-        sphere_pd = vtk.vtkPolyData()
-        sphere_points = vtk.vtkPoints()
-
-        lines_pd = vtk.vtkPolyData()
-        lines_points = vtk.vtkPoints()
-        lines_cells = vtk.vtkCellArray()
-
-        scale_factors_sphere = vtk.vtkFloatArray()
-        scale_factors_sphere.SetNumberOfComponents(3)
-        scale_factors_sphere.SetName("Scale Factors")
-        colors_sphere = vtk.vtkFloatArray()
-        colors_sphere.SetNumberOfComponents(4)
-        colors_sphere.SetName("Colors")
-
-        scale_factors_line = vtk.vtkFloatArray()
-        scale_factors_line.SetNumberOfComponents(1)
-        scale_factors_line.SetName("Tube Radii")
-        colors_line = vtk.vtkFloatArray()
-        colors_line.SetNumberOfComponents(4)
-        colors_line.SetName("Colors")
-
-        n = 0
-        for entity in scene:
-            if 'opacity' not in entity.keys() and 'o' not in entity.keys():
-                entity['o'] = 1.0
-            if 'color' not in entity.keys() and 'c' not in entity.keys():
-                entity['c'] = [1.0, 1.0, 1.0]
-            json_type = json_get(entity, 't', 'type')
-            if json_type == 'point' or json_type == 'p':
-                #source.SetCenter(entity['position'])
-                sphere_points.InsertNextPoint(json_get(entity, 'p', 'position'))
-                colors_sphere.InsertNextTuple4(*json_get(entity, 'c', 'color'),
-                                               json_get(entity, 'o', 'opacity'))
-                if 'radius' not in entity.keys() and 'r' not in entity.keys():
-                    entity['r'] = load_next.sphere_radius
-                scale_factors_sphere.InsertNextTuple3(
-                        *[json_get(entity, 'r', 'radius') * 2 for _ in range(3)])
-                #actor.GetProperty().SetColor(entity['color'])
-                #actor.GetProperty().SetOpacity(entity['opacity'])
-            elif json_type == 'vector' or json_type == 'v':
-                lines_points.InsertNextPoint(json_get(entity, 'p', 'position')[:3])
-                lines_points.InsertNextPoint(json_get(entity, 'p', 'position')[3:])
-                line = vtk.vtkLine()
-                line.GetPointIds().SetId(0, n)
-                line.GetPointIds().SetId(1, n+1)
-                n += 2
-                lines_cells.InsertNextCell(line)
-                if 'radius' not in entity.keys() and 'r' not in entity.keys():
-                    entity['r'] = load_next.tube_radius
-                # This is not working as cell data, only point data,
-                # so needs inserted twice
-                for _ in range(2):
-                    colors_line.InsertNextTuple4(*json_get(entity, 'c', 'color'),
-                                                  json_get(entity, 'o', 'opacity'))
-                    scale_factors_line.InsertNextTuple1(json_get(entity, 'r', 'radius'))
-            elif json_type == 'polyline' or json_type == 'y':
-                line = vtk.vtkPolyLine()
-                id_count = len(json_get(entity, 'p', 'position'))
-                line.GetPointIds().SetNumberOfIds(id_count)
-                if 'radius' not in entity.keys() and 'r' not in entity.keys():
-                    entity['r'] = load_next.tube_radius
-                for i in range(id_count):
-                    pt = json_get(entity, 'p', 'position')[i]
-                    lines_points.InsertNextPoint(pt)
-                    line.GetPointIds().SetId(i, n)
-                    n += 1
-                    colors_line.InsertNextTuple4(*json_get(entity, 'c', 'color'),
-                                                  json_get(entity, 'o', 'opacity'))
-                    scale_factors_line.InsertNextTuple1(json_get(entity, 'r', 'radius'))
-                lines_cells.InsertNextCell(line)
-
-        sphere_pd.SetPoints(sphere_points)
-        mapper = vtk.vtkGlyph3DMapper()
-
-        sphere_pd.GetPointData().AddArray(colors_sphere)
-        sphere_pd.GetPointData().AddArray(scale_factors_sphere)
-        mapper.SetInputData(sphere_pd)
-        mapper.SetSourceConnection(sphere_source.GetOutputPort())
-        mapper.SetScalarModeToUsePointFieldData()
-
-        mapper.SelectColorArray("Colors")
-        mapper.SetColorMode(2)
-
-        mapper.SetScaleModeToScaleByVectorComponents()
-        mapper.SetScaleArray("Scale Factors")
-        mapper.Update()
-
-        actor = vtk.vtkActor()
-        actor.SetMapper(mapper)
-        load_next.ren.AddActor(actor)
-        load_next.actors.append(actor)
-
-        lines_pd.SetPoints(lines_points)
-        lines_pd.SetLines(lines_cells)
-        lines_pd.GetPointData().AddArray(colors_line)
-        lines_pd.GetPointData().SetScalars(scale_factors_line)
-        lines_pd.GetPointData().SetActiveScalars("Tube Radii")
-        tube_filter = vtk.vtkTubeFilter()
-        tube_filter.SetInputData(lines_pd)
-        tube_filter.SetNumberOfSides(8)
-        tube_filter.SetVaryRadiusToVaryRadiusByAbsoluteScalar()
-        tube_filter.Update()
-        mapper = vtk.vtkPolyDataMapper()
-        mapper.SelectColorArray("Colors")
-        mapper.SetColorMode(2)
-        mapper.ScalarVisibilityOn()
-        mapper.SetScalarModeToUsePointFieldData()
-        mapper.SetInputConnection(tube_filter.GetOutputPort())
-        actor = vtk.vtkActor()
-        actor.SetMapper(mapper)
-        load_next.ren.AddActor(actor)
-        load_next.actors.append(actor)
-
-    #linesPolyData->GetCellData()->SetScalars(colors)
-    #vtkNew<vtkTubeFilter> tubeFilter
-    #tubeFilter->SetInputData(linesPolyData)
-    #tubeFilter->SetNumberOfSides(8)
-    #tubeFilter->SetRadius(radius)
-    #tubeFilter->Update()
-    #vtkNew<vtkPolyDataMapper> mapper
-    #mapper->SetInputConnection(tubeFilter->GetOutputPort())
-    #mapper->SetColorMode(2)
-
-    #vtkNew<vtkActor> actor
-    #actor->SetMapper(mapper)
-    #actor->GetProperty()->SetLineWidth(4)
+        if load_next.pipeline and hold:
+            # Nothing transient is drawn this step
+            load_next.pipeline.update(SceneArrays())
+    # Determine how large to make the axes
+    load_next.bounds.add_arrays(arrays)
+    if hold:
+        load_next.hold_bounds.add_arrays(arrays)
+    if reset and not hold:
+        # Transient content reuses one pipeline across steps, only its arrays
+        # are swapped
+        if load_next.pipeline:
+            load_next.pipeline.update(arrays)
+        else:
+            load_next.pipeline = ScenePipeline(arrays, load_next.impostors,
+                                               load_next.lookup_table)
+            for actor in load_next.pipeline.actors:
+                load_next.ren.AddActor(actor)
+        actors = load_next.pipeline.actors
     else:
-        for entity in scene:
-            actor = vtk.vtkActor()
-            mapper = vtk.vtkPolyDataMapper()
-            if 'opacity' not in entity.keys() and 'o' not in entity.keys():
-                entity['o'] = 1.0
-            if 'color' not in entity.keys() and 'c' not in entity.keys():
-                entity['c'] = [1.0, 1.0, 1.0]
-            if 'description' not in entity.keys() and 'd' not in entity.keys():
-                entity['d'] = "No entity description provided"
-            json_type = json_get(entity, 't', 'type')
-            if json_type == 'point' or json_type == 'p':
-                if 'radius' not in entity.keys() and 'r' not in entity.keys():
-                    entity['r'] = load_next.sphere_radius
-                source = vtk.vtkSphereSource()
-                source.SetRadius(json_get(entity, 'r', 'radius'))
-                source.SetCenter(json_get(entity, 'p', 'position'))
-                mapper.SetInputConnection(source.GetOutputPort())
-            elif json_type == 'vector' or json_type == 'v':
-                if 'radius' not in entity.keys() and 'r' not in entity.keys():
-                    entity['r'] = load_next.tube_radius
-                line_source = vtk.vtkLineSource()
-                line_source.SetPoint1(json_get(entity, 'p', 'position')[:3])
-                line_source.SetPoint2(json_get(entity, 'p', 'position')[3:])
-                line_source.SetResolution(6)
-                line_source.Update()
-                tube_filter = vtk.vtkTubeFilter()
-                tube_filter.SetInputConnection(line_source.GetOutputPort())
-                tube_filter.SetNumberOfSides(8)
-                tube_filter.SetRadius(json_get(entity, 'r', 'radius'))
-                tube_filter.Update()
-                mapper.SetInputConnection(tube_filter.GetOutputPort())
-            actor.SetMapper(mapper)
-            actor.GetProperty().SetColor(json_get(entity, 'c', 'color'))
-            actor.GetProperty().SetOpacity(json_get(entity, 'o', 'opacity'))
+        actors = make_scene_actors(arrays, load_next.impostors,
+                                   load_next.lookup_table)
+        for actor in actors:
             load_next.ren.AddActor(actor)
             load_next.actors.append(actor)
             if hold:
                 load_next.hold_actors.append(actor)
-            if actor:
-                load_next.descriptions[actor] = json_get(entity, 'd', 'description')
+    if arrays.descriptions is not None:
+        for actor in actors:
+            load_next.descriptions[actor] = arrays.descriptions
 
     # Make the axes actor to the correct sizing based on the elements on screen
     cube_axis = vtk.vtkCubeAxesActor()
     cube_axis.SetCamera(load_next.ren.GetActiveCamera())
-    mins = [min(i) for i in load_next.positions]
-    maxs = [max(i) for i in load_next.positions]
-    dists = [i[0] - i[1] for i in zip(maxs, mins)]
-    mins = [i[0] - max(load_next.sphere_radius, i[1] * 0.1)
-            for i in zip(mins, dists)]
-    maxs = [i[0] + max(load_next.sphere_radius, i[1] * 0.1)
-            for i in zip(maxs, dists)]
     cube_axis.SetFlyModeToStaticEdges()
-    cube_axis.SetBounds((mins[0], maxs[0], mins[1], maxs[1],
-        mins[2], maxs[2]))
+    cube_axis.SetBounds(load_next.bounds.padded(load_next.sphere_radius))
     if load_next.add_cube_axis:
         load_next.ren.AddActor(cube_axis)
     if load_next.cube_axis:
         load_next.ren.RemoveActor(load_next.cube_axis)
     load_next.cube_axis = cube_axis
 
-    load_next.i += 1
+    load_next.i = step['index'] + 1
+    if load_next.step_box:
+        load_next.step_box.blockSignals(True)
+        load_next.step_box.setValue(step['index'])
+        load_next.step_box.blockSignals(False)
 
     if (load_next.i == 1 or load_next.reset):
         reset_camera()
@@ -1121,9 +1647,86 @@ def load_next():
     #exit(0)
 
 
+"""
+Renders steps start up to stop of the input into an offscreen window, writing
+each one out as a frame. Steps held before start are replayed first, so a
+range renders the same as it would in a full run.
+"""
+def render_steps(args, start, stop):
+    width, height = [int(i) for i in args.size.split('x')]
+    ren = vtk.vtkRenderer()
+    ren_win = vtk.vtkRenderWindow()
+    ren_win.SetOffScreenRendering(1)
+    ren_win.SetSize(width, height)
+    ren_win.AddRenderer(ren)
+    if args.light_mode:
+        ren.SetBackground(vtk.vtkNamedColors().GetColor3d("white"))
+    reset_camera.ren = ren
+    reset_camera.renWin = ren_win
+
+    setup_load_next(ren, args)
+    load_next.steps, load_next.json_doc = open_steps(
+            args.filename, args.render_mode, args.step_cache,
+            args.sphere_radius, args.tube_radius, geometry_cache(args))
+    frame_writer = FrameWriter(ren_win, args.frames,
+                               sys.stdout.buffer if args.pipe else None)
+    if start >= stop or not has_step(start):
+        return 0
+    if start > 0 and not load_next.reset:
+        # A full run fits the camera to the first step and keeps it
+        seek_step(0)
+    seek_step(start)
+    frame_writer.write(start)
+    for i in range(start + 1, stop):
+        if not has_step(i):
+            break
+        load_next()
+        frame_writer.write(i)
+    if args.pipe:
+        sys.stdout.buffer.flush()
+    return load_next.i - start
+
+"""
+Headless entry point: renders --step-range (default every step), optionally
+split into contiguous chunks across --workers processes
+"""
+def render_headless(args):
+    start, stop = 0, None
+    if args.step_range is not None:
+        start, stop = [int(i) if i else None
+                       for i in args.step_range.split(':')]
+        start = start or 0
+    if args.workers <= 1:
+        count = render_steps(args, start,
+                             sys.maxsize if stop is None else stop)
+        print(f"Rendered {count} frames", file=sys.stderr)
+        return
+    if args.pipe:
+        print("Error: --pipe needs a single worker, frames would interleave",
+              file=sys.stderr)
+        exit(1)
+
+    # Splitting needs the step count up front
+    steps, _ = open_steps(args.filename, args.render_mode, args.step_cache,
+                          args.sphere_radius, args.tube_radius)
+    stop = len(steps) if stop is None else min(stop, len(steps))
+    del steps
+    chunk = max(1, -(-(stop - start) // args.workers))
+    bounds = [(i, min(i + chunk, stop)) for i in range(start, stop, chunk)]
+    with ProcessPoolExecutor(
+            max_workers=len(bounds),
+            mp_context=multiprocessing.get_context('spawn')) as pool:
+        counts = pool.map(render_steps, [args] * len(bounds),
+                          *zip(*bounds))
+        print(f"Rendered {sum(counts)} frames", file=sys.stderr)
+
 def main():
+    args = parse_args()
+    if args.headless:
+        render_headless(args)
+        return
     app = QApplication(sys.argv)
-    window = MainWindow()
+    window = MainWindow(args)
     window.show()
     sys.exit(app.exec())
 
@@ -0,0 +1,989 @@
+"""
+Builds the VTK geometry for a frame out of NumPy arrays. Entities are first
+gathered into typed arrays (points, RGBA, radii, line connectivity) and those
+arrays are then handed to VTK without copying, so a frame costs a handful of
+array operations instead of one VTK call per entity.
+"""
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+POINT_TYPES = ('point', 'p')
+VECTOR_TYPES = ('vector', 'v')
+POLYLINE_TYPES = ('polyline', 'y')
+
+ID_DTYPE = numpy_support.get_numpy_array_type(vtk.VTK_ID_TYPE)
+
+# Detail used while the camera moves: sphere (theta, phi) resolution and the
+# pixel width of the lines standing in for tubes
+LOD_SPHERE_RESOLUTION = (4, 3)
+LOD_LINE_WIDTH = 3
+# Pixel width of the lines drawn in place of tubes in impostor mode
+IMPOSTOR_LINE_WIDTH = 4
+
+# Strain ratios this far from 1 get the end colors of a strain colormap
+STRAIN_CAP_DEFAULT = 0.05
+# Strain colormaps as (t, RGB) stops, t going from -1 (shortest) to 1
+COLORMAPS = {
+    'strain': ((-1.0, (0.0, 0.0, 1.0)), (0.0, (0.0, 1.0, 0.0)),
+               (1.0, (1.0, 0.0, 0.0))),
+    'coolwarm': ((-1.0, (0.230, 0.299, 0.754)), (0.0, (0.865, 0.865, 0.865)),
+                 (1.0, (0.706, 0.016, 0.150))),
+    'grayscale': ((-1.0, (0.0, 0.0, 0.0)), (1.0, (1.0, 1.0, 1.0))),
+}
+
+# Splat shader for vtkPointGaussianMapper that cuts each splat to a disc and
+# shades it like the sphere it stands in for
+SPHERE_SPLAT_SHADER = """
+//VTK::Color::Impl
+float dist = dot(offsetVCVSOutput.xy, offsetVCVSOutput.xy);
+if (dist > 1.0) {
+  discard;
+} else {
+  float scale = sqrt(1.0 - dist);
+  ambientColor *= scale;
+  diffuseColor *= scale;
+}
+"""
+
+def json_get(json_obj, *args):
+    for arg in args:
+        try:
+            return json_obj[arg]
+        except:
+            pass
+
+"""
+Typed arrays describing one frame: sphere glyph centers plus the polylines
+that get turned into tubes (a vector is a polyline with two points). Line
+points may be shared by several lines. Colors are RGBA bytes, one per sphere
+and one per line, and radii one float per sphere or line point.
+"""
+class SceneArrays:
+
+    def __init__(self):
+        self.sphere_points = np.zeros((0, 3), dtype=np.float32)
+        self.sphere_colors = np.zeros((0, 4), dtype=np.uint8)
+        self.sphere_radii = np.zeros(0, dtype=np.float32)
+        self.line_points = np.zeros((0, 3), dtype=np.float32)
+        self.line_colors = np.zeros((0, 4), dtype=np.uint8)
+        self.line_radii = np.zeros(0, dtype=np.float32)
+        # CSR layout: line i uses line_connectivity[offsets[i]:offsets[i+1]]
+        self.line_offsets = np.zeros(1, dtype=ID_DTYPE)
+        self.line_connectivity = np.zeros(0, dtype=ID_DTYPE)
+        # Index of the entity each sphere and each line came from, and the
+        # entity descriptions in entity order (None when not collected)
+        self.sphere_ids = None
+        self.line_ids = None
+        self.descriptions = None
+        # Per line values to color through a lookup table instead of
+        # line_colors (None when there are none)
+        self.line_scalars = None
+        # Step flags, as in the JSON "hold" and "reset" keys
+        self.hold = False
+        self.reset = None
+
+    def num_spheres(self):
+        return len(self.sphere_points)
+
+    def num_lines(self):
+        return len(self.line_offsets) - 1
+
+"""
+Running axis-aligned bounds of everything added to it. Adding a step only
+looks at that step's points, so the bounds of a long sequence cost nothing to
+keep up to date
+"""
+class Bounds:
+
+    def __init__(self, mins=None, maxs=None):
+        self.mins = np.full(3, np.inf) if mins is None else np.array(mins)
+        self.maxs = np.full(3, -np.inf) if maxs is None else np.array(maxs)
+
+    def empty(self):
+        return bool((self.mins > self.maxs).any())
+
+    def add_points(self, points):
+        if len(points):
+            np.minimum(self.mins, points.min(axis=0), out=self.mins)
+            np.maximum(self.maxs, points.max(axis=0), out=self.maxs)
+
+    def add_arrays(self, arrays):
+        self.add_points(arrays.sphere_points)
+        self.add_points(arrays.line_points)
+
+    def copy(self):
+        return Bounds(self.mins, self.maxs)
+
+    """
+    (xmin, xmax, ymin, ymax, zmin, zmax) grown on each side by a tenth of the
+    extent along that axis, or by margin if that is more
+    """
+    def padded(self, margin):
+        if self.empty():
+            return (-margin, margin) * 3
+        pad = np.maximum(margin, (self.maxs - self.mins) * 0.1)
+        return tuple(np.stack((self.mins - pad, self.maxs + pad),
+                              axis=1).ravel().tolist())
+
+"""
+json_get for entity dicts without the cost of raising KeyError on every
+missing short key
+"""
+def entity_get(entity, short, long, default=None):
+    value = entity.get(short)
+    if value is None:
+        value = entity.get(long, default)
+    return value
+
+def rgba(entity):
+    return [*entity_get(entity, 'c', 'color', [1.0, 1.0, 1.0]),
+            entity_get(entity, 'o', 'opacity', 1.0)]
+
+"""
+Float colors in [0, 1] as bytes
+"""
+def to_uint8(colors):
+    return (np.clip(np.asarray(colors, dtype=np.float32), 0.0, 1.0) * 255 +
+            0.5).astype(np.uint8)
+
+"""
+Collects a list of JSON entities into a SceneArrays. This is the only
+per-entity Python loop left, and it makes no VTK calls. With descriptions,
+the entity descriptions are kept too so picks can be mapped back to them.
+"""
+def entities_to_arrays(scene, sphere_radius, tube_radius, descriptions=False):
+    sphere_ids = []
+    vector_ids = []
+    poly_ids = []
+    sphere_points = []
+    sphere_colors = []
+    sphere_radii = []
+    vector_points = []
+    vector_colors = []
+    vector_radii = []
+    poly_points = []
+    poly_colors = []
+    poly_radii = []
+    poly_counts = []
+    for index, entity in enumerate(scene):
+        json_type = entity_get(entity, 't', 'type')
+        pos = entity_get(entity, 'p', 'position')
+        if json_type in POINT_TYPES:
+            sphere_ids.append(index)
+            sphere_points.append(pos)
+            sphere_colors.append(rgba(entity))
+            sphere_radii.append(
+                entity_get(entity, 'r', 'radius', sphere_radius))
+        elif json_type in VECTOR_TYPES:
+            vector_ids.append(index)
+            vector_points.append(pos)
+            vector_colors.append(rgba(entity))
+            vector_radii.append(
+                entity_get(entity, 'r', 'radius', tube_radius))
+        elif json_type in POLYLINE_TYPES:
+            poly_ids.append(index)
+            poly_points.extend(pos)
+            poly_colors.append(rgba(entity))
+            poly_radii.append(
+                entity_get(entity, 'r', 'radius', tube_radius))
+            poly_counts.append(len(pos))
+
+    arrays = SceneArrays()
+    if descriptions:
+        arrays.descriptions = [entity_get(entity, 'd', 'description')
+                               for entity in scene]
+    arrays.sphere_ids = np.array(sphere_ids, dtype=ID_DTYPE)
+    arrays.line_ids = np.array(vector_ids + poly_ids, dtype=ID_DTYPE)
+    if sphere_points:
+        arrays.sphere_points = np.array(sphere_points, dtype=np.float32)
+        arrays.sphere_colors = to_uint8(sphere_colors)
+        arrays.sphere_radii = np.array(sphere_radii, dtype=np.float32)
+
+    # Vectors come first, then polylines. Line ends that meet at the same
+    # place with the same radius become one point
+    counts = np.concatenate((np.full(len(vector_points), 2, dtype=ID_DTYPE),
+                             np.array(poly_counts, dtype=ID_DTYPE)))
+    points = [np.array(vector_points, dtype=np.float32).reshape(-1, 3),
+              np.array(poly_points, dtype=np.float32).reshape(-1, 3)]
+    radii = np.array(vector_radii + poly_radii, dtype=np.float32)
+    arrays.line_points, arrays.line_radii, arrays.line_connectivity = \
+            share_points(np.concatenate(points), np.repeat(radii, counts))
+    arrays.line_colors = to_uint8(vector_colors + poly_colors).reshape(-1, 4)
+    arrays.line_offsets = np.concatenate(([0], np.cumsum(counts)))\
+            .astype(ID_DTYPE)
+    return arrays
+
+"""
+Merges line vertices with the same position and radius (bit for bit) into
+one point. Returns the points and radii that are left, in order of first use,
+and the index of every vertex into them.
+"""
+def share_points(points, radii):
+    if not len(points):
+        return points, radii, np.zeros(0, dtype=ID_DTYPE)
+    # x, y, z and r as two 64 bit keys, so NaN radii compare equal too.
+    # Sorting on a hash of both is much faster than sorting on the pair, and
+    # a collision can only keep two equal points apart, never merge others
+    keys = np.column_stack((points, radii)).astype(np.float32)\
+            .view(np.uint64)
+    order = np.argsort(keys[:, 0] * np.uint64(0x9E3779B97F4A7C15) ^
+                       keys[:, 1], kind='stable')
+    keys = keys[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = (keys[1:, 0] != keys[:-1, 0]) | (keys[1:, 1] != keys[:-1, 1])
+    # The stable sort puts the first use of each point at the head of its run
+    used = order[first]
+    renumber = np.empty(len(used), dtype=ID_DTYPE)
+    renumber[np.argsort(used, kind='stable')] = np.arange(len(used))
+    connectivity = np.empty(len(points), dtype=ID_DTYPE)
+    connectivity[order] = renumber[np.cumsum(first) - 1]
+    used.sort()
+    return points[used], radii[used], connectivity
+
+"""
+Maps strain ratios to RGBA through a colormap: ratios 1 - cap and below get
+the first color of the map, 1 + cap and above the last, and the colors in
+between are interpolated. Returns float32 colors in [0, 1], or bytes when
+dtype is uint8.
+"""
+def ratios_to_rgba(ratios, cap=STRAIN_CAP_DEFAULT, colormap='strain',
+                   dtype=np.float32):
+    t = np.clip((np.asarray(ratios, dtype=np.float32) - 1.0) / cap, -1.0, 1.0)
+    stops, colors = colormap_stops(colormap)
+    rgba = np.ones(t.shape + (4,), dtype=np.float32)
+    for i in range(3):
+        rgba[..., i] = np.interp(t, stops, colors[:, i])
+    if np.dtype(dtype) == np.uint8:
+        return to_uint8(rgba)
+    return rgba.astype(dtype, copy=False)
+
+def colormap_stops(colormap):
+    stops = COLORMAPS[colormap]
+    return (np.array([i[0] for i in stops], dtype=np.float32),
+            np.array([i[1] for i in stops], dtype=np.float32))
+
+"""
+A vtkLookupTable for coloring strain ratios on the GPU: the ratios go in as
+scalars and the table maps them like ratios_to_rgba would. Changing the cap
+afterwards is just set_strain_cap.
+"""
+def strain_lookup_table(cap=STRAIN_CAP_DEFAULT, colormap='strain',
+                        size=256):
+    t = np.linspace(-1.0, 1.0, size, dtype=np.float32)
+    table = ratios_to_rgba(1.0 + t, 1.0, colormap, np.uint8)
+    lut = vtk.vtkLookupTable()
+    lut.SetNumberOfTableValues(size)
+    lut.SetTable(numpy_support.numpy_to_vtk(table))
+    lut.SetRange(1.0 - cap, 1.0 + cap)
+    return lut
+
+"""
+Changes the cap of a strain_lookup_table in place
+"""
+def set_strain_cap(lookup_table, cap):
+    lookup_table.SetRange(1.0 - cap, 1.0 + cap)
+
+"""
+Builds a render mode step: a white sphere per vertex and a tube per edge
+colored by its strain (current length over rest length), all in one pass.
+points is (n, 3), edges is (e, 2) vertex indices and rest_lengths is (e,).
+The edges share the vertices as their points. The ratios are kept as
+line_scalars too, for coloring through a lookup table; with colors False that
+is all the tubes get, and line_colors is left empty.
+"""
+def strain_step_arrays(points, edges, rest_lengths, sphere_radius,
+                       tube_radius, cap=STRAIN_CAP_DEFAULT, colormap='strain',
+                       colors=True):
+    arrays = SceneArrays()
+    num_points = len(points)
+    num_edges = len(edges)
+    arrays.sphere_points = np.ascontiguousarray(points, dtype=np.float32)
+    arrays.sphere_colors = np.full((num_points, 4), 255, dtype=np.uint8)
+    arrays.sphere_radii = np.full(num_points, sphere_radius, dtype=np.float32)
+
+    ends = arrays.sphere_points[edges]
+    lengths = np.linalg.norm(ends[:, 0] - ends[:, 1], axis=1)
+    ratios = (lengths / rest_lengths).astype(np.float32)
+    arrays.line_points = arrays.sphere_points
+    if colors:
+        arrays.line_colors = ratios_to_rgba(ratios, cap, colormap, np.uint8)
+    arrays.line_scalars = ratios
+    arrays.line_radii = np.full(num_points, tube_radius, dtype=np.float32)
+    arrays.line_offsets = np.arange(0, 2 * num_edges + 1, 2, dtype=ID_DTYPE)
+    arrays.line_connectivity = np.ascontiguousarray(edges, dtype=ID_DTYPE)\
+            .ravel()
+    return arrays
+
+"""
+Fans the cells of a cell complex into triangles, all in bulk. Each untyped
+edge of a cell gives two triangles, (first vertex, edge center, cell center)
+and (edge center, second vertex, cell center); typed edges are skipped. The
+points are the untyped edge centers, then for each cell the vertices it is
+the first to use followed by its center (the mean of its untyped edges' end
+points). A cell with six or more untyped edges gets twelve triangle colors,
+the strain color of its sixth untyped edge. positions is (v, 3),
+edge_vertices (e, 2), edge_typed and rest_lengths (e,), and the cells are CSR
+edge indices. Returns the points, the (t, 3) triangles and the colors.
+"""
+def triangulate_cells(positions, edge_vertices, edge_typed, rest_lengths,
+                      cell_offsets, cell_edges, cap=STRAIN_CAP_DEFAULT,
+                      colormap='strain'):
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    edge_vertices = np.asarray(edge_vertices, dtype=ID_DTYPE).reshape(-1, 2)
+    rest_lengths = np.asarray(rest_lengths, dtype=np.float64)
+    cell_edges = np.asarray(cell_edges, dtype=ID_DTYPE)
+    untyped = ~np.asarray(edge_typed, dtype=bool)
+    num_cells = len(cell_offsets) - 1
+    num_centers = int(untyped.sum())
+    center_index = np.full(len(edge_vertices), -1, dtype=ID_DTYPE)
+    center_index[untyped] = np.arange(num_centers, dtype=ID_DTYPE)
+
+    # The untyped edges of every cell, in order, and their end points in the
+    # order the cells visit them
+    cell_counts = np.diff(cell_offsets)
+    keep = untyped[cell_edges]
+    edges = cell_edges[keep]
+    cells = np.repeat(np.arange(num_cells, dtype=ID_DTYPE), cell_counts)[keep]
+    ends = edge_vertices[edges]
+    visits = ends.ravel()
+    visit_cells = np.repeat(cells, 2)
+    order = np.argsort(visits, kind='stable')
+    first = np.ones(len(visits), dtype=bool)
+    first[1:] = visits[order][1:] != visits[order][:-1]
+    is_first = np.zeros(len(visits), dtype=bool)
+    is_first[order[first]] = True
+
+    # A vertex goes after every earlier new vertex and earlier cell center
+    new_index = np.full(len(positions), -1, dtype=ID_DTYPE)
+    new_index[visits[is_first]] = num_centers +\
+            np.cumsum(is_first)[is_first] - 1 + visit_cells[is_first]
+    new_per_cell = np.bincount(visit_cells[is_first], minlength=num_cells)
+    cell_index = num_centers + np.cumsum(new_per_cell) +\
+            np.arange(num_cells, dtype=ID_DTYPE)
+
+    visit_counts = np.bincount(visit_cells, minlength=num_cells)
+    cell_centers = np.stack(
+            [np.bincount(visit_cells, weights=positions[visits, i],
+                         minlength=num_cells) for i in range(3)], axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cell_centers = cell_centers / visit_counts[:, None]
+
+    points = np.empty((num_centers + int(is_first.sum()) + num_cells, 3))
+    points[:num_centers] = positions[edge_vertices[untyped]].mean(axis=1)
+    points[new_index[visits[is_first]]] = positions[visits[is_first]]
+    points[cell_index] = cell_centers
+
+    v1 = new_index[ends[:, 0]]
+    v2 = new_index[ends[:, 1]]
+    ec = center_index[edges]
+    cc = cell_index[cells]
+    triangles = np.stack((np.stack((v1, ec, cc), axis=1),
+                          np.stack((ec, v2, cc), axis=1)), axis=1)\
+            .reshape(-1, 3)
+
+    lengths = np.linalg.norm(positions[ends[:, 0]] - positions[ends[:, 1]],
+                             axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratios = lengths / rest_lengths[edges]
+    if np.isnan(ratios).any():
+        print(f"WARNING: {np.isnan(ratios).sum()} NaN strain ratios")
+    untyped_counts = np.bincount(cells, minlength=num_cells)
+    sixth = (np.cumsum(untyped_counts) - untyped_counts + 5)\
+            [untyped_counts >= 6]
+    colors = np.repeat(
+            ratios_to_rgba(ratios[sixth], cap, colormap, np.uint8)[:, :3], 12,
+            axis=0)
+    return points, triangles, colors
+
+"""
+Wraps an (n, 3) array as vtkPoints without copying
+"""
+def numpy_to_points(arr):
+    points = vtk.vtkPoints()
+    points.SetData(numpy_support.numpy_to_vtk(
+        np.ascontiguousarray(arr, dtype=np.float32)))
+    return points
+
+"""
+Wraps an array as a named VTK data array without copying
+"""
+def named_array(arr, name):
+    vtk_arr = numpy_support.numpy_to_vtk(np.ascontiguousarray(arr))
+    vtk_arr.SetName(name)
+    return vtk_arr
+
+"""
+Wraps CSR offsets/connectivity as a vtkCellArray without copying
+"""
+def numpy_to_cells(offsets, connectivity):
+    cells = vtk.vtkCellArray()
+    cells.SetData(
+        numpy_support.numpy_to_vtkIdTypeArray(
+            np.ascontiguousarray(offsets, dtype=ID_DTYPE)),
+        numpy_support.numpy_to_vtkIdTypeArray(
+            np.ascontiguousarray(connectivity, dtype=ID_DTYPE)))
+    return cells
+
+"""
+Entity ids for a set of glyphs or lines, counting from 0 when the arrays do
+not say which entities they came from
+"""
+def entity_ids(ids, count):
+    if ids is None:
+        return np.arange(count, dtype=ID_DTYPE)
+    return ids
+
+"""
+Puts a frame's sphere centers and their attributes into sphere_pd (a new
+vtkPolyData unless one is given; same-named arrays are replaced)
+"""
+def build_sphere_polydata(arrays, sphere_pd=None):
+    if sphere_pd is None:
+        sphere_pd = vtk.vtkPolyData()
+    sphere_pd.SetPoints(numpy_to_points(arrays.sphere_points))
+    sphere_pd.GetPointData().AddArray(
+        named_array(arrays.sphere_colors, "Colors"))
+    sphere_pd.GetPointData().AddArray(named_array(arrays.sphere_radii, "Radii"))
+    sphere_pd.GetPointData().AddArray(named_array(
+        entity_ids(arrays.sphere_ids, arrays.num_spheres()), "Entity Ids"))
+    return sphere_pd
+
+"""
+Same as build_sphere_polydata for the tube polylines. The cells can be left
+alone when the caller knows the topology has not changed.
+"""
+def build_lines_polydata(arrays, lines_pd=None, same_topology=False):
+    if lines_pd is None:
+        lines_pd = vtk.vtkPolyData()
+    lines_pd.SetPoints(numpy_to_points(arrays.line_points))
+    if not same_topology:
+        lines_pd.SetLines(numpy_to_cells(arrays.line_offsets,
+                                         arrays.line_connectivity))
+    # Cell data, which the tube filter copies onto every strip of a line.
+    # Lines colored through a lookup table may come without colors.
+    if arrays.line_scalars is None or len(arrays.line_colors):
+        lines_pd.GetCellData().AddArray(
+            named_array(arrays.line_colors, "Colors"))
+    if arrays.line_scalars is not None:
+        lines_pd.GetCellData().AddArray(
+            named_array(arrays.line_scalars, "Strain"))
+    lines_pd.GetCellData().AddArray(named_array(
+        entity_ids(arrays.line_ids, arrays.num_lines()), "Entity Ids"))
+    lines_pd.GetPointData().SetScalars(
+        named_array(arrays.line_radii, "Tube Radii"))
+    lines_pd.GetPointData().SetActiveScalars("Tube Radii")
+    return lines_pd
+
+"""
+Reads the SceneArrays back out of polydata made by build_sphere_polydata and
+build_lines_polydata (and saved and read back since), as views of their arrays
+"""
+def polydata_to_arrays(sphere_pd, lines_pd):
+    arrays = SceneArrays()
+    def column(data, name, default):
+        array = data.GetArray(name)
+        if array is None or not array.GetNumberOfTuples():
+            return default
+        return numpy_support.vtk_to_numpy(array)
+    if sphere_pd.GetNumberOfPoints():
+        arrays.sphere_points = numpy_support.vtk_to_numpy(
+                sphere_pd.GetPoints().GetData())
+    point_data = sphere_pd.GetPointData()
+    arrays.sphere_colors = column(point_data, "Colors", arrays.sphere_colors)
+    arrays.sphere_radii = column(point_data, "Radii", arrays.sphere_radii)
+    arrays.sphere_ids = column(point_data, "Entity Ids",
+                               np.zeros(0, dtype=ID_DTYPE))
+    if lines_pd.GetNumberOfPoints():
+        arrays.line_points = numpy_support.vtk_to_numpy(
+                lines_pd.GetPoints().GetData())
+    arrays.line_radii = column(lines_pd.GetPointData(), "Tube Radii",
+                               arrays.line_radii)
+    cell_data = lines_pd.GetCellData()
+    arrays.line_colors = column(cell_data, "Colors", arrays.line_colors)
+    arrays.line_scalars = column(cell_data, "Strain", None)
+    arrays.line_ids = column(cell_data, "Entity Ids",
+                             np.zeros(0, dtype=ID_DTYPE))
+    lines = lines_pd.GetLines()
+    if lines is not None and lines.GetNumberOfCells():
+        arrays.line_offsets = numpy_support.vtk_to_numpy(
+                lines.GetOffsetsArray()).astype(ID_DTYPE, copy=False)
+        arrays.line_connectivity = numpy_support.vtk_to_numpy(
+                lines.GetConnectivityArray()).astype(ID_DTYPE, copy=False)
+    return arrays
+
+def make_glyph_mapper(sphere_pd, theta=8, phi=8):
+    sphere_source = vtk.vtkSphereSource()
+    sphere_source.SetThetaResolution(theta)
+    sphere_source.SetPhiResolution(phi)
+    mapper = vtk.vtkGlyph3DMapper()
+    mapper.SetInputData(sphere_pd)
+    mapper.SetSourceConnection(sphere_source.GetOutputPort())
+    mapper.SetScalarModeToUsePointFieldData()
+
+    mapper.SelectColorArray("Colors")
+    mapper.SetColorMode(2)
+
+    # The glyph source has a radius of 0.5, so scale by the diameter
+    mapper.SetScaleModeToScaleByMagnitude()
+    mapper.SetScaleArray("Radii")
+    mapper.SetScaleFactor(2.0)
+    mapper.Update()
+    return mapper
+
+"""
+Scene actors keep a coarse mapper next to their full one in lod_mappers, for
+set_detail to swap in while the camera moves. For glyphs it draws the same
+points with a low resolution sphere.
+"""
+def make_glyph_actor(sphere_pd):
+    actor = vtk.vtkActor()
+    actor.lod_mappers = (make_glyph_mapper(sphere_pd),
+                         make_glyph_mapper(sphere_pd, *LOD_SPHERE_RESOLUTION))
+    actor.SetMapper(actor.lod_mappers[0])
+    return actor
+
+"""
+Colors a line mapper by the "Colors" cell array, or by mapping the "Strain"
+cell array through lookup_table when one is given
+"""
+def color_lines(mapper, lookup_table=None):
+    mapper.ScalarVisibilityOn()
+    mapper.SetScalarModeToUseCellFieldData()
+    if lookup_table is None:
+        mapper.SelectColorArray("Colors")
+        mapper.SetColorMode(2)
+    else:
+        mapper.SelectColorArray("Strain")
+        mapper.SetColorModeToMapScalars()
+        mapper.SetLookupTable(lookup_table)
+        mapper.UseLookupTableScalarRangeOn()
+
+"""
+The coarse mapper of a tube actor draws the bare polylines, shaded as tubes
+"""
+def make_tube_actor(lines_pd, lookup_table=None):
+    tube_filter = vtk.vtkTubeFilter()
+    tube_filter.SetInputData(lines_pd)
+    tube_filter.SetNumberOfSides(8)
+    tube_filter.SetVaryRadiusToVaryRadiusByAbsoluteScalar()
+    tube_filter.Update()
+    mapper = vtk.vtkPolyDataMapper()
+    mapper.SetInputConnection(tube_filter.GetOutputPort())
+    line_mapper = vtk.vtkPolyDataMapper()
+    line_mapper.SetInputData(lines_pd)
+    for i in (mapper, line_mapper):
+        color_lines(i, lookup_table)
+    actor = vtk.vtkActor()
+    actor.lod_mappers = (mapper, line_mapper)
+    actor.SetMapper(mapper)
+    # Only affects the line mapper, the tubes are polygons
+    actor.GetProperty().RenderLinesAsTubesOn()
+    actor.GetProperty().SetLineWidth(LOD_LINE_WIDTH)
+    return actor
+
+"""
+Switches every scene actor of a renderer to its coarse (or back to its full)
+mapper; other actors are left alone
+"""
+def set_detail(ren, coarse):
+    actors = ren.GetActors()
+    actors.InitTraversal()
+    for _ in range(actors.GetNumberOfItems()):
+        actor = actors.GetNextActor()
+        mappers = getattr(actor, 'lod_mappers', None)
+        if mappers is not None:
+            actor.SetMapper(mappers[1 if coarse else 0])
+
+"""
+Impostor version of make_glyph_actor: each sphere is one screen aligned splat
+shaded as a sphere rather than a triangulated glyph. The radius comes from the
+"Radii" array, or is radius for every point when given.
+"""
+def make_sphere_impostor_actor(sphere_pd, radius=None):
+    mapper = vtk.vtkPointGaussianMapper()
+    mapper.SetInputData(sphere_pd)
+    mapper.SetSplatShaderCode(SPHERE_SPLAT_SHADER)
+    # The splat only has to cover the disc the shader keeps; VTK sizes it
+    # three times as wide by default, for a gaussian falloff. Newer VTK calls
+    # the setting BoundScale.
+    if hasattr(mapper, 'SetBoundScale'):
+        mapper.SetBoundScale(1.0)
+    else:
+        mapper.SetTriangleScale(1.0)
+    mapper.EmissiveOff()
+    if radius is None:
+        mapper.SetScaleArray("Radii")
+        mapper.SetScaleFactor(1.0)
+    else:
+        mapper.SetScaleFactor(radius)
+    if sphere_pd.GetPointData().HasArray("Colors"):
+        mapper.SetScalarModeToUsePointFieldData()
+        mapper.SelectColorArray("Colors")
+        mapper.SetColorMode(2)
+    else:
+        mapper.ScalarVisibilityOff()
+    actor = vtk.vtkActor()
+    actor.SetMapper(mapper)
+    return actor
+
+"""
+Impostor version of make_tube_actor: the polylines are drawn as lines shaded
+as tubes, a fixed number of pixels wide
+"""
+def make_line_impostor_actor(lines_pd, lookup_table=None):
+    mapper = vtk.vtkPolyDataMapper()
+    mapper.SetInputData(lines_pd)
+    cell_data = lines_pd.GetCellData()
+    if cell_data.HasArray("Colors" if lookup_table is None else "Strain"):
+        color_lines(mapper, lookup_table)
+    else:
+        mapper.ScalarVisibilityOff()
+    actor = vtk.vtkActor()
+    actor.SetMapper(mapper)
+    actor.GetProperty().RenderLinesAsTubesOn()
+    actor.GetProperty().SetLineWidth(IMPOSTOR_LINE_WIDTH)
+    return actor
+
+"""
+Returns the glyph actor and the tube actor for a frame (or their impostors).
+With a lookup table the tubes are colored by the frame's line_scalars.
+"""
+def make_scene_actors(arrays, impostors=False, lookup_table=None):
+    if impostors:
+        return [make_sphere_impostor_actor(build_sphere_polydata(arrays)),
+                make_line_impostor_actor(build_lines_polydata(arrays),
+                                         lookup_table)]
+    return [make_glyph_actor(build_sphere_polydata(arrays)),
+            make_tube_actor(build_lines_polydata(arrays), lookup_table)]
+
+"""
+A glyph/tube pipeline that outlives a single frame. update swaps the point,
+color and radius arrays (and the line cells) of the existing polydata and
+marks them modified, so the mappers, filters and actors are built only once.
+"""
+class ScenePipeline:
+
+    def __init__(self, arrays, impostors=False, lookup_table=None):
+        self.sphere_pd = build_sphere_polydata(arrays)
+        self.lines_pd = build_lines_polydata(arrays)
+        if impostors:
+            self.actors = [make_sphere_impostor_actor(self.sphere_pd),
+                           make_line_impostor_actor(self.lines_pd,
+                                                    lookup_table)]
+        else:
+            self.actors = [make_glyph_actor(self.sphere_pd),
+                           make_tube_actor(self.lines_pd, lookup_table)]
+        self.line_offsets = arrays.line_offsets
+        self.line_connectivity = arrays.line_connectivity
+
+    def update(self, arrays):
+        build_sphere_polydata(arrays, self.sphere_pd)
+        self.sphere_pd.Modified()
+
+        # Topology is usually fixed between steps, so the cells are only
+        # rebuilt when it is not
+        same_topology = \
+                np.array_equal(self.line_offsets, arrays.line_offsets) and\
+                np.array_equal(self.line_connectivity, arrays.line_connectivity)
+        build_lines_polydata(arrays, self.lines_pd, same_topology)
+        self.line_offsets = arrays.line_offsets
+        self.line_connectivity = arrays.line_connectivity
+        self.lines_pd.Modified()
+
+"""
+A scene kept as persistent SceneArrays and edited by entity id, for clients
+that stream changes instead of whole scenes. sphere_ids and line_ids hold the
+ids the client gave (the "i"/"id" key), or ones counted on from the highest id
+so far. Unlike in entities_to_arrays, every line vertex is its own point, so
+that moving one entity never drags another one along.
+"""
+class LiveScene:
+
+    def __init__(self, sphere_radius, tube_radius):
+        self.sphere_radius = sphere_radius
+        self.tube_radius = tube_radius
+        self.init([])
+
+    def init(self, scene):
+        self.arrays = SceneArrays()
+        self.arrays.sphere_ids = np.zeros(0, dtype=ID_DTYPE)
+        self.arrays.line_ids = np.zeros(0, dtype=ID_DTYPE)
+        self.next_id = 0
+        self.append(scene)
+
+    """
+    Replaces ids below 0 with the next free ones, in place
+    """
+    def assign_ids(self, ids):
+        if len(ids):
+            self.next_id = max(self.next_id, int(ids.max()) + 1)
+        missing = ids < 0
+        ids[missing] = self.next_id + np.arange(missing.sum(), dtype=ID_DTYPE)
+        self.next_id += int(missing.sum())
+
+    """
+    Adds JSON entities to the scene; an entity whose id is already used
+    replaces the old one
+    """
+    def append(self, scene):
+        new = entities_to_arrays(scene, self.sphere_radius, self.tube_radius)
+        ids = np.array([entity_get(entity, 'i', 'id', -1) for entity in scene],
+                       dtype=ID_DTYPE)
+        arrays, next_id = self.arrays, self.next_id
+        try:
+            self.assign_ids(ids)
+            new.sphere_ids = ids[new.sphere_ids]
+            new.line_ids = ids[new.line_ids]
+            self.merge_arrays(new)
+        except Exception:
+            self.arrays, self.next_id = arrays, next_id
+            raise
+
+    """
+    append for entities that are already in a SceneArrays, with their ids in
+    sphere_ids and line_ids (below 0 for new ones) and NaN for radii left to
+    the defaults. Shared line points are copied out to every line using them.
+    """
+    def append_arrays(self, new):
+        arrays, next_id = self.arrays, self.next_id
+        try:
+            self.merge_arrays(new)
+        except Exception:
+            self.arrays, self.next_id = arrays, next_id
+            raise
+
+    """
+    The body of append and append_arrays, which put the scene back as it was
+    when new turns out to be malformed part way through
+    """
+    def merge_arrays(self, new):
+        sphere_ids = np.array(new.sphere_ids, dtype=ID_DTYPE)
+        line_ids = np.array(new.line_ids, dtype=ID_DTYPE)
+        self.assign_ids(sphere_ids)
+        self.assign_ids(line_ids)
+        self.remove(np.concatenate((sphere_ids, line_ids)))
+
+        old = self.arrays
+        arrays = SceneArrays()
+        arrays.sphere_ids = np.concatenate((old.sphere_ids, sphere_ids))
+        arrays.line_ids = np.concatenate((old.line_ids, line_ids))
+        connectivity = new.line_connectivity
+        for name, column in (('sphere_points', new.sphere_points),
+                             ('sphere_colors', new.sphere_colors),
+                             ('sphere_radii', new.sphere_radii),
+                             ('line_points', new.line_points[connectivity]),
+                             ('line_colors', new.line_colors),
+                             ('line_radii', new.line_radii[connectivity])):
+            old_column = getattr(old, name)
+            setattr(arrays, name, np.concatenate((old_column, column))
+                    .astype(old_column.dtype))
+        for name, default, start in (
+                ('sphere_radii', self.sphere_radius, old.num_spheres()),
+                ('line_radii', self.tube_radius, len(old.line_points))):
+            radii = getattr(arrays, name)[start:]
+            radii[np.isnan(radii)] = default
+        arrays.line_offsets = np.concatenate(
+                (old.line_offsets, new.line_offsets[1:] + old.line_offsets[-1]))
+        arrays.line_connectivity = np.arange(len(arrays.line_points),
+                                             dtype=ID_DTYPE)
+        self.arrays = arrays
+
+    def remove(self, ids):
+        old = self.arrays
+        keep_spheres = ~np.isin(old.sphere_ids, ids)
+        keep_lines = ~np.isin(old.line_ids, ids)
+        if keep_spheres.all() and keep_lines.all():
+            return
+        counts = np.diff(old.line_offsets)
+        keep_points = np.repeat(keep_lines, counts)
+        arrays = SceneArrays()
+        arrays.sphere_ids = old.sphere_ids[keep_spheres]
+        arrays.sphere_points = old.sphere_points[keep_spheres]
+        arrays.sphere_colors = old.sphere_colors[keep_spheres]
+        arrays.sphere_radii = old.sphere_radii[keep_spheres]
+        arrays.line_ids = old.line_ids[keep_lines]
+        arrays.line_points = old.line_points[keep_points]
+        arrays.line_colors = old.line_colors[keep_lines]
+        arrays.line_radii = old.line_radii[keep_points]
+        arrays.line_offsets = np.concatenate(
+                ([0], np.cumsum(counts[keep_lines]))).astype(ID_DTYPE)
+        arrays.line_connectivity = np.arange(len(arrays.line_points),
+                                             dtype=ID_DTYPE)
+        self.arrays = arrays
+
+    """
+    Changes the positions, colors (RGB or RGBA) and/or radii of the entities
+    with the given ids in place, given as JSON lists with one entry per id. A
+    line's new position must have as many points as it already has. Returns
+    the ids that are not in the scene.
+    """
+    def update(self, ids, positions=None, colors=None, radii=None):
+        ids = np.asarray(ids, dtype=ID_DTYPE)
+        found, counts = self.point_counts(ids)
+        if positions is not None:
+            positions = [np.array(positions[i], dtype=np.float32)
+                         .reshape(-1, 3) for i in found]
+            if [len(i) for i in positions] != counts.tolist():
+                raise ValueError("Line positions must keep their point count")
+            positions = np.concatenate(positions) if positions else None
+        if colors is not None:
+            # RGB colors get a NaN alpha, meaning the old opacity is kept
+            colors = np.array([[*colors[i], np.nan][:4] for i in found],
+                              dtype=np.float32).reshape(-1, 4)
+            if len(colors) != len(found):
+                raise ValueError("Colors must be RGB or RGBA")
+        if radii is not None:
+            radii = np.asarray(radii, dtype=np.float32)[found]
+            if radii.ndim != 1:
+                raise ValueError("Need one radius per id")
+        self.update_arrays(ids[found], positions, colors, radii)
+        missing = np.ones(len(ids), dtype=bool)
+        missing[found] = False
+        return ids[missing]
+
+    """
+    Where ids are in the scene (positions in ids) and how many points each of
+    those entities has
+    """
+    def point_counts(self, ids):
+        arrays = self.arrays
+        spheres, _ = rows_of(arrays.sphere_ids, ids)
+        lines, line_rows = rows_of(arrays.line_ids, ids)
+        found = np.concatenate((spheres, lines))
+        counts = np.concatenate((
+            np.ones(len(spheres), dtype=ID_DTYPE),
+            np.diff(arrays.line_offsets)[line_rows].astype(ID_DTYPE)))
+        order = np.argsort(found, kind='stable')
+        return found[order], counts[order]
+
+    """
+    update for arrays: positions holds every point of every entity in ids, in
+    id order, colors is (n, 4), either bytes or floats with NaN for values to
+    keep, and radii is (n,). Every id has to be in the scene.
+    """
+    def update_arrays(self, ids, positions=None, colors=None, radii=None):
+        arrays = self.arrays
+        spheres, sphere_rows = rows_of(arrays.sphere_ids, ids)
+        lines, line_rows = rows_of(arrays.line_ids, ids)
+        if len(spheres) + len(lines) != len(ids):
+            raise ValueError("Unknown ids")
+        counts = np.ones(len(ids), dtype=ID_DTYPE)
+        starts = arrays.line_offsets[line_rows]
+        counts[lines] = arrays.line_offsets[line_rows + 1] - starts
+        # Every point of the updated lines, in the scene and in positions
+        points = ranges(starts, counts[lines])
+        firsts = np.cumsum(counts) - counts
+
+        if positions is not None:
+            if len(positions) != counts.sum():
+                raise ValueError("Need a position for every point")
+            arrays.sphere_points[sphere_rows] = positions[firsts[spheres]]
+            arrays.line_points[points] = \
+                    positions[ranges(firsts[lines], counts[lines])]
+        if colors is not None:
+            keep = np.zeros(colors.shape, dtype=bool)
+            if colors.dtype != np.uint8:
+                keep = np.isnan(colors)
+                colors = to_uint8(np.nan_to_num(colors))
+            for rows, index, target in \
+                    ((sphere_rows, spheres, arrays.sphere_colors),
+                     (line_rows, lines, arrays.line_colors)):
+                new = colors[index]
+                new[keep[index]] = target[rows][keep[index]]
+                target[rows] = new
+        if radii is not None:
+            arrays.sphere_radii[sphere_rows] = radii[spheres]
+            arrays.line_radii[points] = np.repeat(radii[lines], counts[lines])
+
+"""
+Finds ids in entity_ids (which has no repeats): returns the positions in ids
+that were found and the matching rows of entity_ids
+"""
+def rows_of(entity_ids, ids):
+    if not len(entity_ids):
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    order = np.argsort(entity_ids, kind='stable')
+    pos = np.searchsorted(entity_ids[order], ids)
+    rows = order[np.minimum(pos, len(entity_ids) - 1)]
+    found = np.flatnonzero(entity_ids[rows] == ids)
+    return found, rows[found]
+
+"""
+starts[0]..starts[0]+counts[0]-1, starts[1].., ... as one index array
+"""
+def ranges(starts, counts):
+    return np.repeat(starts - np.cumsum(counts) + counts, counts) +\
+            np.arange(counts.sum(), dtype=ID_DTYPE)
+
+"""
+Spatial index over a fixed set of vertices, built once with a
+vtkStaticPointLocator. Answers nearest, k-nearest and radius queries without
+visiting every vertex; results are vertex indices, nearest first.
+"""
+class VertexIndex:
+
+    def __init__(self, vertices):
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float64)
+        self.polydata = vtk.vtkPolyData()
+        points = vtk.vtkPoints()
+        points.SetData(numpy_support.numpy_to_vtk(self.vertices))
+        self.polydata.SetPoints(points)
+        self.locator = vtk.vtkStaticPointLocator()
+        self.locator.SetDataSet(self.polydata)
+        if len(self):
+            self.locator.BuildLocator()
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def nearest(self, pos):
+        if not len(self):
+            return -1
+        return self.locator.FindClosestPoint(pos)
+
+    def k_nearest(self, pos, k):
+        ids = vtk.vtkIdList()
+        if not len(self):
+            return self.sorted_by_distance(pos, ids)
+        self.locator.FindClosestNPoints(min(k, len(self)), pos, ids)
+        return self.sorted_by_distance(pos, ids)
+
+    def within_radius(self, pos, radius):
+        ids = vtk.vtkIdList()
+        if not len(self):
+            return self.sorted_by_distance(pos, ids)
+        self.locator.FindPointsWithinRadius(radius, pos, ids)
+        return self.sorted_by_distance(pos, ids)
+
+    def distances(self, pos, ids):
+        return np.linalg.norm(self.vertices[ids] - np.asarray(pos), axis=1)
+
+    def sorted_by_distance(self, pos, id_list):
+        ids = np.array([id_list.GetId(i)
+                        for i in range(id_list.GetNumberOfIds())],
+                       dtype=ID_DTYPE)
+        return ids[np.argsort(self.distances(pos, ids), kind='stable')]
+
+"""
+The edges of a set of polygons given in CSR form, each listed once however
+many polygons share it, as an (e, 2) array with the lower vertex first
+"""
+def unique_edges(offsets, connectivity):
+    offsets = np.asarray(offsets, dtype=ID_DTYPE)
+    connectivity = np.asarray(connectivity, dtype=ID_DTYPE)
+    if not len(connectivity):
+        return np.zeros((0, 2), dtype=ID_DTYPE)
+    # Every vertex connects to the next one, and the last vertex of each
+    # polygon back to its first
+    following = np.arange(1, len(connectivity) + 1, dtype=ID_DTYPE)
+    following[offsets[1:] - 1] = offsets[:-1]
+    ends = connectivity[following]
+    # One integer key per edge makes the deduplication a 1-D sort
+    stride = np.int64(connectivity.max()) + 1
+    keys = np.sort(np.minimum(connectivity, ends).astype(np.int64) * stride +
+                   np.maximum(connectivity, ends))
+    first = np.ones(len(keys), dtype=bool)
+    np.not_equal(keys[1:], keys[:-1], out=first[1:])
+    keys = keys[first]
+    return np.stack((keys // stride, keys % stride), axis=1).astype(ID_DTYPE)
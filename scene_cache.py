@@ -0,0 +1,234 @@
+"""
+On-disk cache of built geometry, so reopening a file skips reading it and
+running the VTK filters on it. An entry is keyed on a hash of the input file's
+contents, the mode it is shown in and every parameter that changes what gets
+built (radii, triangle budget, strain cap, ...), and holds one or more named
+vtkPolyData saved as .vtp files whose arrays are appended as raw binary, so
+reading one back is little more than a copy.
+
+The directory is kept under a size limit by deleting the entries that were
+used longest ago. File hashes are remembered by path, size and modification
+time, so an unchanged file is only hashed once.
+"""
+import os
+import sys
+import json
+import hashlib
+import threading
+
+import vtk
+
+# Bump when what is stored under the same key changes
+CACHE_VERSION = 1
+CACHE_DIR_DEFAULT = os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+        'primitives-visualizer')
+# Megabytes
+CACHE_SIZE_DEFAULT = 2048
+# Eviction goes down to this fraction of the limit, so that it does not run
+# again on the very next store
+CACHE_LOW_WATER = 0.9
+HASH_CHUNK = 1 << 24
+DIGESTS_FILE = 'digests.json'
+
+# Guards the running size and the digests file between threads
+cache_lock = threading.Lock()
+
+def write_polydata(filename, polydata):
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetFileName(filename)
+    writer.SetInputData(polydata)
+    writer.SetDataModeToAppended()
+    writer.EncodeAppendedDataOff()
+    writer.SetCompressorTypeToNone()
+    writer.SetHeaderTypeToUInt64()
+    return writer.Write() == 1
+
+"""
+Reads a .vtp file back, or returns None when the reader reports an error, as
+it does for a truncated or otherwise damaged file
+"""
+def read_polydata(filename):
+    reader = vtk.vtkXMLPolyDataReader()
+    errors = []
+    reader.AddObserver('ErrorEvent', lambda *_: errors.append(True))
+    reader.SetFileName(filename)
+    reader.Update()
+    if errors:
+        return None
+    return reader.GetOutput()
+
+"""
+Whether polydata has an array of every one of names, as point, cell or field
+data
+"""
+def has_arrays(polydata, names):
+    return all(any(data.GetAbstractArray(name) is not None
+                   for data in (polydata.GetPointData(),
+                                polydata.GetCellData(),
+                                polydata.GetFieldData()))
+               for name in names)
+
+def file_digest(filename):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+"""
+A cache directory holding at most max_size megabytes of entries. Each entry
+is the files <key>.<name>.vtp, one per named polydata.
+"""
+class GeometryCache:
+
+    def __init__(self, directory=CACHE_DIR_DEFAULT,
+                 max_size=CACHE_SIZE_DEFAULT):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = int(max_size * (1 << 20))
+        # Bytes of entries in the directory, counted on the first store
+        self.size = None
+
+    """
+    Content hash of filename, hashing it only if it changed since last time
+    """
+    def digest(self, filename):
+        stat = os.stat(filename)
+        path = os.path.realpath(filename)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        digests_file = os.path.join(self.directory, DIGESTS_FILE)
+        with cache_lock:
+            try:
+                with open(digests_file) as f:
+                    digests = json.load(f)
+            except (OSError, ValueError):
+                digests = {}
+        if digests.get(path, [])[:2] == stamp:
+            return digests[path][2]
+        digest = file_digest(filename)
+        with cache_lock:
+            digests[path] = stamp + [digest]
+            tmp = f'{digests_file}.{os.getpid()}.tmp'
+            try:
+                with open(tmp, 'w') as f:
+                    json.dump(digests, f)
+                os.replace(tmp, digests_file)
+            except OSError as e:
+                print(f"Could not save file hashes to the cache: {e}",
+                      file=sys.stderr)
+        return digest
+
+    """
+    The key of what mode builds from filename with the given parameters,
+    which have to be JSON serializable
+    """
+    def key(self, filename, mode, **params):
+        text = json.dumps([CACHE_VERSION, self.digest(filename), mode,
+                           params], sort_keys=True)
+        return hashlib.blake2b(text.encode(), digest_size=20).hexdigest()
+
+    def path(self, key, name):
+        return os.path.join(self.directory, f'{key}.{name}.vtp')
+
+    """
+    Returns {name: polydata} for an entry, or None unless all of names are
+    there. The entry is marked as just used. required maps names to the
+    arrays their polydata must have; an entry that cannot be read back or
+    lacks one of them is deleted and counts as missing, so it is built again.
+    """
+    def load(self, key, names, required=None):
+        paths = [self.path(key, name) for name in names]
+        try:
+            for path in paths:
+                os.utime(path)
+        except OSError:
+            return None
+        required = required or {}
+        entry = {}
+        for name, path in zip(names, paths):
+            polydata = read_polydata(path)
+            if polydata is None or \
+                    not has_arrays(polydata, required.get(name, ())):
+                print(f"Dropping damaged geometry cache entry {path}",
+                      file=sys.stderr)
+                self.remove(paths)
+                return None
+            entry[name] = polydata
+        return entry
+
+    """
+    Works out the key and loads the entry in one go, for running off the Qt
+    thread: returns the key and the entry, or None for it when it is missing
+    """
+    def lookup(self, filename, mode, names, params, required=None):
+        key = self.key(filename, mode, **params)
+        return key, self.load(key, names, required)
+
+    def remove(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    """
+    Saves {name: polydata} under key, then evicts old entries if the cache has
+    grown too big. Failures are reported and otherwise ignored, the cache is
+    only an optimization.
+    """
+    def store(self, key, polydata):
+        added = 0
+        for name, data in polydata.items():
+            path = self.path(key, name)
+            # Written under another name first so readers never see half a
+            # file
+            tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            try:
+                if not write_polydata(tmp, data):
+                    raise OSError(f"could not write {tmp}")
+                os.replace(tmp, path)
+                added += os.path.getsize(path)
+            except OSError as e:
+                print(f"Could not save to the geometry cache: {e}",
+                      file=sys.stderr)
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                return
+        self.evict(added)
+
+    """
+    (key, last use, bytes, paths) of every entry in the directory
+    """
+    def entries(self):
+        entries = {}
+        with os.scandir(self.directory) as it:
+            for item in it:
+                if not item.name.endswith('.vtp'):
+                    continue
+                try:
+                    stat = item.stat()
+                except OSError:
+                    continue
+                key = item.name.split('.', 1)[0]
+                used, size, paths = entries.get(key, (0, 0, []))
+                entries[key] = (max(used, stat.st_mtime), size + stat.st_size,
+                                paths + [item.path])
+        return [(key, *entry) for key, entry in entries.items()]
+
+    def evict(self, added=0):
+        with cache_lock:
+            if self.size is None:
+                self.size = sum(entry[2] for entry in self.entries())
+            else:
+                self.size += added
+            if self.size <= self.max_bytes:
+                return
+            # Other processes may have added entries too, so count again
+            entries = sorted(self.entries(), key=lambda entry: entry[1])
+            self.size = sum(entry[2] for entry in entries)
+            for _, _, size, paths in entries:
+                if self.size <= self.max_bytes * CACHE_LOW_WATER:
+                    break
+                self.remove(paths)
+                self.size -= size
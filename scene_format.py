@@ -0,0 +1,745 @@
+"""
+Binary columnar container for step lists. Each step is stored as one record of
+typed columns (the same layout as scene_builder.SceneArrays), and a step
+index at the end of the file lets a reader memory-map the file and touch only
+the step being shown.
+
+Layout (little-endian):
+    header       magic, version, step count, index offset, metadata length
+    metadata     JSON object with the document level keys ("reset", "glyph")
+    records      one per step, 8-byte aligned, see STEP_HEADER and COLUMNS
+    index        uint64 byte offset of every record
+
+Run as a script to convert a JSON document:
+    python scene_format.py input.json output.pvb
+
+JSON input that has to stay JSON is read through JsonStepIndex, which finds the
+entries of the step list one at a time and remembers their byte offsets.
+"""
+import re
+import json
+import mmap
+import threading
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+import vtk
+
+from scene_builder import SceneArrays, entities_to_arrays, json_get,\
+                          strain_step_arrays, ID_DTYPE, STRAIN_CAP_DEFAULT,\
+                          to_uint8, build_sphere_polydata,\
+                          build_lines_polydata, polydata_to_arrays,\
+                          named_array
+
+MAGIC = b'PRIMVIS\0'
+# Version 1 stored colors as float32, version 2 as RGBA bytes, both with a
+# color per line point rather than per line
+VERSION = 3
+
+FILE_HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('pad', '<u4'),
+                        ('num_steps', '<u8'), ('index_offset', '<u8'),
+                        ('meta_length', '<u8')])
+
+# reset is -1 when the entry does not set it
+STEP_HEADER_V2 = np.dtype([('hold', 'u1'), ('reset', 'i1'), ('pad', 'u1', 6),
+                           ('num_spheres', '<u8'), ('num_line_points', '<u8'),
+                           ('num_offsets', '<u8'),
+                           ('num_connectivity', '<u8')])
+STEP_HEADER = np.dtype(STEP_HEADER_V2.descr + [('num_lines', '<u8')])
+
+# (attribute, dtype, components, step header count field)
+COLUMNS = [('sphere_points', '<f4', 3, 'num_spheres'),
+           ('sphere_colors', 'u1', 4, 'num_spheres'),
+           ('sphere_radii', '<f4', 1, 'num_spheres'),
+           ('line_points', '<f4', 3, 'num_line_points'),
+           ('line_colors', 'u1', 4, 'num_lines'),
+           ('line_radii', '<f4', 1, 'num_line_points'),
+           ('line_offsets', '<i8', 1, 'num_offsets'),
+           ('line_connectivity', '<i8', 1, 'num_connectivity')]
+COLUMNS_V2 = [(name, dtype, components,
+               'num_line_points' if count == 'num_lines' else count)
+              for name, dtype, components, count in COLUMNS]
+COLUMNS_V1 = [(name, '<f4' if name.endswith('colors') else dtype, components,
+               count) for name, dtype, components, count in COLUMNS_V2]
+
+def padding(size):
+    return -size % 8
+
+"""
+Returns True if the file starts with the binary scene magic
+"""
+def is_scene_file(filename):
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+"""
+Writes SceneArrays one step at a time. Radii may be NaN, meaning "use the
+radius given on the command line when loading".
+"""
+class SceneFileWriter:
+
+    def __init__(self, filename, meta):
+        self.f = open(filename, 'wb')
+        self.offsets = []
+        meta_bytes = json.dumps(meta).encode()
+        self.f.write(np.zeros(1, FILE_HEADER).tobytes())
+        self.f.write(meta_bytes + b'\0' * padding(len(meta_bytes)))
+        self.meta_length = len(meta_bytes)
+
+    def write_step(self, arrays, hold=False, reset=None):
+        self.offsets.append(self.f.tell())
+        header = np.zeros(1, STEP_HEADER)
+        header['hold'] = hold
+        header['reset'] = -1 if reset is None else int(reset)
+        header['num_spheres'] = arrays.num_spheres()
+        header['num_line_points'] = len(arrays.line_points)
+        header['num_offsets'] = len(arrays.line_offsets)
+        header['num_connectivity'] = len(arrays.line_connectivity)
+        header['num_lines'] = arrays.num_lines()
+        self.f.write(header.tobytes())
+        for name, dtype, _, _ in COLUMNS:
+            data = np.ascontiguousarray(getattr(arrays, name), dtype=dtype)
+            self.f.write(data.tobytes())
+            self.f.write(b'\0' * padding(data.nbytes))
+
+    def close(self):
+        index_offset = self.f.tell()
+        self.f.write(np.array(self.offsets, dtype='<u8').tobytes())
+        header = np.zeros(1, FILE_HEADER)
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['num_steps'] = len(self.offsets)
+        header['index_offset'] = index_offset
+        header['meta_length'] = self.meta_length
+        self.f.seek(0)
+        self.f.write(header.tobytes())
+        self.f.close()
+
+"""
+Memory-mapped reader; indexing it returns a SceneArrays whose columns are
+views into the file, so only the requested step is ever paged in
+"""
+class SceneFile:
+
+    def __init__(self, filename, sphere_radius, tube_radius):
+        self.data = np.memmap(filename, dtype=np.uint8, mode='r')
+        header = self.data[:FILE_HEADER.itemsize].view(FILE_HEADER)[0]
+        if bytes(self.data[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{filename} is not a binary scene file")
+        if header['version'] not in (1, 2, VERSION):
+            raise ValueError(f"Unsupported scene file version "
+                             f"{header['version']} in {filename}")
+        start = FILE_HEADER.itemsize
+        self.meta = json.loads(
+            bytes(self.data[start:start + int(header['meta_length'])]))
+        index_offset = int(header['index_offset'])
+        self.index = self.data[index_offset:index_offset +
+                               8 * int(header['num_steps'])].view('<u8')
+        self.version = int(header['version'])
+        self.columns = {1: COLUMNS_V1, 2: COLUMNS_V2}.get(self.version,
+                                                          COLUMNS)
+        self.step_header = STEP_HEADER if self.version == VERSION \
+                else STEP_HEADER_V2
+        self.sphere_radius = sphere_radius
+        self.tube_radius = tube_radius
+
+    def __len__(self):
+        return len(self.index)
+
+    def header(self, i):
+        if i < 0 or i >= len(self):
+            raise IndexError(i)
+        pos = int(self.index[i])
+        return self.data[pos:pos + self.step_header.itemsize]\
+                .view(self.step_header)[0]
+
+    """
+    Whether step i is held, read from its header alone
+    """
+    def is_held(self, i):
+        return bool(self.header(i)['hold'])
+
+    def __getitem__(self, i):
+        header = self.header(i)
+        pos = int(self.index[i]) + self.step_header.itemsize
+        arrays = SceneArrays()
+        for name, dtype, components, count in self.columns:
+            n = int(header[count])
+            nbytes = n * components * np.dtype(dtype).itemsize
+            column = self.data[pos:pos + nbytes].view(dtype)
+            if components > 1:
+                column = column.reshape(n, components)
+            setattr(arrays, name, column)
+            pos += nbytes + padding(nbytes)
+        if self.version == 1:
+            arrays.sphere_colors = to_uint8(arrays.sphere_colors)
+            arrays.line_colors = to_uint8(arrays.line_colors)
+        if self.version < 3:
+            # Every point of a line had the line's color
+            arrays.line_colors = arrays.line_colors[
+                    arrays.line_connectivity[arrays.line_offsets[:-1]]]
+        arrays.hold = bool(header['hold'])
+        arrays.reset = None if header['reset'] < 0 else bool(header['reset'])
+        # Fill in radii that were left to the command line
+        for name, default in (('sphere_radii', self.sphere_radius),
+                              ('line_radii', self.tube_radius)):
+            radii = getattr(arrays, name)
+            missing = np.isnan(radii)
+            if missing.any():
+                setattr(arrays, name, np.where(missing, default, radii)
+                        .astype(np.float32))
+        return arrays
+
+WHITESPACE = re.compile(rb'[ \t\n\r]*')
+
+"""
+Streaming reader for the step list of a JSON document. Entries of the top level
+array named by key are parsed one at a time, on demand, and their byte offsets
+are kept so going back to entry N only reads entry N. Every other top level key
+ends up in meta: the ones in front of the list when it is opened, the ones
+that follow it once the list has been walked (see find_meta).
+"""
+class JsonStepIndex:
+
+    def __init__(self, filename, key='list', window=1 << 12):
+        self.filename = filename
+        self.f = open(filename, 'rb')
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.key = key
+        # Bytes decode() reads first, sized from the value before
+        self.min_window = window
+        self.window = window
+        self.decoder = json.JSONDecoder()
+        # (start, end) byte span of every entry found so far, and whether it
+        # has "hold" set
+        self.spans = []
+        self.holds = []
+        self.meta = {}
+        self.complete = False
+        # Set once the list turned out to be cut short or malformed
+        self.error = None
+        self.last = (None, None)
+        # The playback worker reads ahead while the GUI thread may be reading
+        self.lock = threading.RLock()
+        self.scanner = self.scan()
+        # Walk up to the first entry so the keys in front of the list are known
+        self.advance()
+
+    def skip_whitespace(self, pos):
+        return WHITESPACE.match(self.mm, pos).end()
+
+    def expect(self, pos, char):
+        if self.mm[pos:pos + 1] != char:
+            raise ValueError(f"{self.filename}: expected {char.decode()} at "
+                             f"byte {pos}")
+        return pos + 1
+
+    """
+    Decodes the JSON value starting at pos. The bytes are decoded as latin-1,
+    which keeps character and byte offsets identical; values whose bytes are
+    not plain ASCII are decoded again as UTF-8 by the caller. The first read
+    is twice the size of the value before, since the entries of a list tend
+    to be alike, and grows until the value fits.
+    """
+    def decode(self, pos):
+        size = self.window
+        while True:
+            text = self.mm[pos:pos + size].decode('latin-1')
+            at_eof = pos + size >= len(self.mm)
+            try:
+                value, end = self.decoder.raw_decode(text)
+                # A value that runs to the end of the window may be cut short
+                if end < len(text) or at_eof:
+                    self.window = max(self.min_window, 2 * end)
+                    return value, pos + end
+            except json.JSONDecodeError as e:
+                if at_eof:
+                    raise ValueError(f"{self.filename}: {e.msg} (byte "
+                                     f"{pos + e.pos})") from None
+            size *= 4
+
+    def utf8(self, value, start, end):
+        if self.mm[start:end].isascii():
+            return value
+        return json.loads(self.mm[start:end])
+
+    def scan(self):
+        pos = self.expect(self.skip_whitespace(0), b'{')
+        while True:
+            pos = self.skip_whitespace(pos)
+            char = self.mm[pos:pos + 1]
+            if char == b'}' or not char:
+                break
+            if char == b',':
+                pos += 1
+                continue
+            start = pos
+            key, pos = self.decode(pos)
+            key = self.utf8(key, start, pos)
+            pos = self.skip_whitespace(self.expect(
+                self.skip_whitespace(pos), b':'))
+            if key != self.key:
+                start = pos
+                value, pos = self.decode(pos)
+                self.meta[key] = self.utf8(value, start, pos)
+                continue
+            pos = self.expect(pos, b'[')
+            while True:
+                pos = self.skip_whitespace(pos)
+                char = self.mm[pos:pos + 1]
+                if char == b']':
+                    pos += 1
+                    break
+                if char == b',':
+                    pos += 1
+                    continue
+                start = pos
+                entry, pos = self.decode(pos)
+                self.spans.append((start, pos))
+                self.holds.append(isinstance(entry, dict) and
+                                  bool(entry.get('hold', False)))
+                yield self.utf8(entry, start, pos)
+        self.complete = True
+
+    """
+    Indexes one more entry, returning False once the list is exhausted
+    """
+    def advance(self):
+        with self.lock:
+            if self.complete:
+                return False
+            if self.error is not None:
+                raise self.error
+            try:
+                entry = next(self.scanner)
+            except StopIteration:
+                return False
+            except ValueError as e:
+                # The entries before it can still be read
+                self.error = e
+                raise
+            self.last = (len(self.spans) - 1, entry)
+            return True
+
+    """
+    Makes sure meta holds whichever of keys the document has. Keys that come
+    after the list are only reached by indexing the rest of its entries, so
+    that is done when one of them is missing.
+    """
+    def find_meta(self, *keys):
+        if all(key in self.meta for key in keys):
+            return
+        while self.advance():
+            pass
+
+    """
+    Indexes entries up to entry i, raising IndexError if there is none
+    """
+    def reach(self, i):
+        if i < 0:
+            raise IndexError(i)
+        with self.lock:
+            while len(self.spans) <= i:
+                if not self.advance():
+                    raise IndexError(i)
+
+    """
+    Whether entry i has "hold" set, without reading it again
+    """
+    def is_held(self, i):
+        self.reach(i)
+        return self.holds[i]
+
+    def __getitem__(self, i):
+        self.reach(i)
+        with self.lock:
+            if self.last[0] == i:
+                return self.last[1]
+            start, end = self.spans[i]
+        entry = json.loads(self.mm[start:end])
+        with self.lock:
+            self.last = (i, entry)
+        return entry
+
+    def __len__(self):
+        while self.advance():
+            pass
+        return len(self.spans)
+
+    def __iter__(self):
+        i = 0
+        while True:
+            try:
+                yield self[i]
+            except IndexError:
+                return
+            i += 1
+
+"""
+Render mode input: a "positions" list holding the flattened vertex positions of
+every timestep, plus the "edges" (vertex pairs and rest lengths) shared by all
+of them. Steps are only read and built when they are indexed, and the most
+recently built ones are kept in a small LRU so stepping back and forth is
+instant. Without colors the tubes only carry their strain ratios, for when a
+lookup table colors them.
+"""
+class RenderBatch:
+
+    def __init__(self, filename, cache_size=16, cap=STRAIN_CAP_DEFAULT,
+                 colormap='strain', colors=True):
+        self.steps = JsonStepIndex(filename, key='positions')
+        self.steps.find_meta("edges", "scale_factor")
+        edges = self.steps.meta["edges"]
+        self.edges = np.array([edge["vertices"] for edge in edges],
+                              dtype=np.int64).reshape(-1, 2)
+        self.rest_lengths = np.array([edge["rest_length"] for edge in edges],
+                                     dtype=np.float32)
+        self.sphere_radius = self.steps.meta["scale_factor"] * 0.05
+        self.tube_radius = self.steps.meta["scale_factor"] * 0.025
+        self.cap = cap
+        self.colormap = colormap
+        self.colors = colors
+        self.cache_size = max(cache_size, 1)
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.steps)
+
+    """
+    Render mode steps are never held; this only checks that step i exists
+    """
+    def is_held(self, i):
+        self.steps.reach(i)
+        return False
+
+    def positions(self, i):
+        step = self.steps[i]
+        return np.array(step["positions"], dtype=np.float32).reshape(-1, 3)
+
+    """
+    Step i if it is in the LRU, else None
+    """
+    def cached(self, i):
+        with self.lock:
+            if i in self.cache:
+                self.cache.move_to_end(i)
+                return self.cache[i]
+        return None
+
+    def keep(self, i, arrays):
+        with self.lock:
+            self.cache[i] = arrays
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def __getitem__(self, i):
+        arrays = self.cached(i)
+        if arrays is None:
+            arrays = strain_step_arrays(self.positions(i), self.edges,
+                                        self.rest_lengths, self.sphere_radius,
+                                        self.tube_radius, self.cap,
+                                        self.colormap, self.colors)
+            self.keep(i, arrays)
+        return arrays
+
+# Share of the geometry cache that the steps of one file may take, so that
+# playing a long file once does not evict every other entry
+STEP_CACHE_SHARE = 0.25
+
+"""
+A step list (JsonStepIndex or RenderBatch) whose built steps are kept in a
+GeometryCache. Indexing returns a SceneArrays: taken from a RenderBatch's LRU
+when it is still there, read back from the cache when the step was built
+before, in which case the input is not read at all, or built and stored
+otherwise. The entity descriptions and the hold and reset flags go in the
+field data of the line polydata. Built steps are saved with store(key,
+polydata), cache.store unless the caller writes them elsewhere (off the Qt
+thread, say), until they take STEP_CACHE_SHARE of the cache.
+"""
+class CachedSteps:
+
+    def __init__(self, steps, cache, key, sphere_radius, tube_radius,
+                 descriptions=False, store=None):
+        self.steps = steps
+        self.cache = cache
+        self.key = key
+        self.sphere_radius = sphere_radius
+        self.tube_radius = tube_radius
+        self.descriptions = descriptions
+        self.store = store or cache.store
+        # What read_step needs back, anything less is built again
+        lines = ["Tube Radii", "Step Flags"]
+        if isinstance(steps, RenderBatch):
+            lines.append("Strain")
+        if not isinstance(steps, RenderBatch) or steps.colors:
+            lines.append("Colors")
+        if descriptions:
+            lines.append("Descriptions")
+        self.required = {'spheres': ("Colors", "Radii"), 'lines': lines}
+        # Bytes of this file's steps in the cache, counted on the first store
+        self.stored = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.steps)
+
+    def is_held(self, i):
+        return self.steps.is_held(i)
+
+    def __getitem__(self, i):
+        if i < 0:
+            raise IndexError(i)
+        # Recent render mode steps are still in memory
+        batch = self.steps if isinstance(self.steps, RenderBatch) else None
+        if batch is not None:
+            arrays = batch.cached(i)
+            if arrays is not None:
+                return arrays
+        key = f'{self.key}-{i}'
+        cached = self.cache.load(key, ('spheres', 'lines'), self.required)
+        if cached is not None:
+            arrays = self.read_step(cached['spheres'], cached['lines'])
+            if batch is not None:
+                batch.keep(i, arrays)
+            return arrays
+        curr = self.steps[i]
+        if isinstance(curr, SceneArrays):
+            arrays = curr
+        else:
+            arrays = entities_to_arrays(json_get(curr, 'entities', 'e'),
+                                        self.sphere_radius, self.tube_radius,
+                                        self.descriptions)
+            arrays.hold = bool(curr.get('hold', False))
+            arrays.reset = curr.get('reset')
+        lines_pd = build_lines_polydata(arrays)
+        flags = np.array([arrays.hold,
+                          -1 if arrays.reset is None else arrays.reset],
+                         dtype=np.int8)
+        lines_pd.GetFieldData().AddArray(named_array(flags, "Step Flags"))
+        if arrays.descriptions is not None:
+            descriptions = vtk.vtkStringArray()
+            descriptions.SetName("Descriptions")
+            descriptions.InsertNextValue(json.dumps(arrays.descriptions))
+            lines_pd.GetFieldData().AddArray(descriptions)
+        polydata = {'spheres': build_sphere_polydata(arrays),
+                    'lines': lines_pd}
+        if self.admit(polydata):
+            self.store(key, polydata)
+        return arrays
+
+    """
+    Whether polydata still fits in this file's share of the cache, counting
+    it in if so
+    """
+    def admit(self, polydata):
+        size = sum(data.GetActualMemorySize() for data in polydata.values())\
+                << 10
+        with self.lock:
+            if self.stored is None:
+                prefix = f'{self.key}-'
+                self.stored = sum(entry[2] for entry in self.cache.entries()
+                                  if entry[0].startswith(prefix))
+            if self.stored + size > self.cache.max_bytes * STEP_CACHE_SHARE:
+                return False
+            self.stored += size
+            return True
+
+    def read_step(self, sphere_pd, lines_pd):
+        arrays = polydata_to_arrays(sphere_pd, lines_pd)
+        field_data = lines_pd.GetFieldData()
+        flags = field_data.GetArray("Step Flags")
+        arrays.hold = bool(flags.GetValue(0))
+        arrays.reset = None if flags.GetValue(1) < 0 \
+                else bool(flags.GetValue(1))
+        descriptions = field_data.GetAbstractArray("Descriptions")
+        if descriptions is not None:
+            arrays.descriptions = json.loads(descriptions.GetValue(0))
+        return arrays
+
+"""
+Server mode stream frames: one binary WebSocket message per action, made of a
+STREAM_HEADER followed by the columns STREAM_COLUMNS lists for the action, each
+8-byte aligned. Colors are RGBA bytes, one per sphere and one per line. Ids
+below 0 ask for the next free id.
+"""
+STREAM_ACTIONS = ('init', 'append', 'update', 'remove')
+
+STREAM_HEADER = np.dtype([('action', 'u1'), ('pad', 'u1', 7),
+                          ('sequence', '<u8'), ('num_ids', '<u8'),
+                          ('num_points', '<u8'), ('num_colors', '<u8'),
+                          ('num_radii', '<u8'), ('num_spheres', '<u8'),
+                          ('num_lines', '<u8'), ('num_line_points', '<u8'),
+                          ('num_connectivity', '<u8')])
+
+# init and append carry whole entities, update a subset of their attributes
+# (positions hold every point of every listed entity, in id order)
+SCENE_COLUMNS = [('sphere_ids', '<i8', 1, 'num_spheres'),
+                 ('sphere_points', '<f4', 3, 'num_spheres'),
+                 ('sphere_colors', 'u1', 4, 'num_spheres'),
+                 ('sphere_radii', '<f4', 1, 'num_spheres'),
+                 ('line_ids', '<i8', 1, 'num_lines'),
+                 ('line_points', '<f4', 3, 'num_line_points'),
+                 ('line_colors', 'u1', 4, 'num_lines'),
+                 ('line_radii', '<f4', 1, 'num_line_points'),
+                 ('line_counts', '<i8', 1, 'num_lines'),
+                 ('line_connectivity', '<i8', 1, 'num_connectivity')]
+STREAM_COLUMNS = {'init': SCENE_COLUMNS,
+                  'append': SCENE_COLUMNS,
+                  'update': [('ids', '<i8', 1, 'num_ids'),
+                             ('positions', '<f4', 3, 'num_points'),
+                             ('colors', 'u1', 4, 'num_colors'),
+                             ('radii', '<f4', 1, 'num_radii')],
+                  'remove': [('ids', '<i8', 1, 'num_ids')]}
+
+# Sent back for every frame; status is STREAM_OK once the frame is queued,
+# with the number of frames waiting to be drawn. STREAM_BUSY frames were
+# dropped and should be sent again later (or superseded by a newer one).
+STREAM_ACK = np.dtype([('sequence', '<u8'), ('status', '<u4'),
+                       ('queue_depth', '<u4')])
+STREAM_OK = 0
+STREAM_MALFORMED = 1
+STREAM_BUSY = 2
+
+# What init and append columns that are left out are filled with: new ids,
+# opaque white and the radius given on the command line
+STREAM_DEFAULTS = {'sphere_ids': -1, 'line_ids': -1, 'sphere_colors': 255,
+                   'line_colors': 255, 'sphere_radii': np.nan,
+                   'line_radii': np.nan}
+
+"""
+Packs one action into a stream frame. columns are the arrays named in
+STREAM_COLUMNS for the action; left out ones are sent empty or, next to a
+column of the same length, filled from STREAM_DEFAULTS. The line connectivity
+defaults to every line point in order.
+"""
+def encode_stream_frame(action, sequence=0, **columns):
+    header = np.zeros(1, STREAM_HEADER)
+    header['action'] = STREAM_ACTIONS.index(action)
+    header['sequence'] = sequence
+    for name, _, _, count in STREAM_COLUMNS[action]:
+        if name in columns:
+            header[count] = len(columns[name])
+    if action in ('init', 'append') and 'line_connectivity' not in columns:
+        columns['line_connectivity'] = np.arange(header['num_line_points'][0])
+        header['num_connectivity'] = header['num_line_points']
+    chunks = []
+    for name, dtype, components, count in STREAM_COLUMNS[action]:
+        data = columns.get(name)
+        if data is None:
+            shape = (int(header[count][0]), components)
+            data = np.full(shape if components > 1 else shape[0],
+                           STREAM_DEFAULTS.get(name, 0), dtype=dtype)
+        data = np.ascontiguousarray(data, dtype=dtype)
+        chunks.append(data.tobytes() + b'\0' * padding(data.nbytes))
+    return header.tobytes() + b''.join(chunks)
+
+"""
+Unpacks a stream frame into its sequence number and a server mode payload:
+init and append come as a SceneArrays in "arrays", update and remove as
+arrays keyed like the JSON actions. Columns are views into frame. Raises
+ValueError if the frame does not hold what its header says.
+"""
+def decode_stream_frame(frame):
+    if len(frame) < STREAM_HEADER.itemsize:
+        raise ValueError("Stream frame shorter than its header")
+    header = np.frombuffer(frame, STREAM_HEADER, count=1)[0]
+    if header['action'] >= len(STREAM_ACTIONS):
+        raise ValueError(f"Unknown stream action {header['action']}")
+    action = STREAM_ACTIONS[header['action']]
+    columns = {}
+    pos = STREAM_HEADER.itemsize
+    for name, dtype, components, count in STREAM_COLUMNS[action]:
+        n = int(header[count])
+        nbytes = n * components * np.dtype(dtype).itemsize
+        if pos + nbytes > len(frame):
+            raise ValueError(f"Stream frame too short for {name}")
+        column = np.frombuffer(frame, dtype, n * components, pos)
+        columns[name] = column.reshape(n, components) if components > 1 \
+                else column
+        pos += nbytes + padding(nbytes)
+    if pos < len(frame):
+        raise ValueError("Stream frame longer than its columns")
+    payload = {'action': action}
+    if action in ('init', 'append'):
+        payload['arrays'] = stream_scene_arrays(columns)
+    else:
+        payload['ids'] = columns['ids']
+    if action == 'update':
+        ids = columns['ids']
+        for name in ('colors', 'radii'):
+            if len(columns[name]) not in (0, len(ids)):
+                raise ValueError(f"Stream frame needs one of {name} per id")
+        payload['positions'] = columns['positions'] \
+                if len(columns['positions']) else None
+        payload['colors'] = columns['colors'] \
+                if len(columns['colors']) else None
+        payload['radii'] = columns['radii'] if len(columns['radii']) else None
+    return int(header['sequence']), payload
+
+"""
+The SceneArrays of an init or append frame, with the line points shared as
+the frame's connectivity says
+"""
+def stream_scene_arrays(columns):
+    counts = columns['line_counts']
+    connectivity = columns['line_connectivity']
+    if counts.sum() != len(connectivity) or (len(connectivity) and (
+            connectivity.min() < 0 or
+            connectivity.max() >= len(columns['line_points']))):
+        raise ValueError("Stream frame has bad line connectivity")
+    arrays = SceneArrays()
+    arrays.sphere_ids = columns['sphere_ids']
+    arrays.sphere_points = columns['sphere_points']
+    arrays.sphere_colors = columns['sphere_colors']
+    arrays.sphere_radii = columns['sphere_radii']
+    arrays.line_ids = columns['line_ids']
+    arrays.line_points = columns['line_points']
+    arrays.line_colors = columns['line_colors']
+    arrays.line_radii = columns['line_radii']
+    arrays.line_offsets = np.concatenate(([0], np.cumsum(counts)))\
+            .astype(ID_DTYPE)
+    arrays.line_connectivity = connectivity
+    return arrays
+
+def stream_ack(sequence, status=STREAM_OK, depth=0):
+    ack = np.zeros(1, STREAM_ACK)
+    ack['sequence'] = sequence
+    ack['status'] = status
+    ack['queue_depth'] = depth
+    return ack.tobytes()
+
+"""
+Converts a JSON document using the "list"/"entities" schema
+"""
+def convert_json(in_filename, out_filename):
+    steps = JsonStepIndex(in_filename)
+    steps.find_meta('reset', 'glyph')
+    meta = {key: steps.meta[key] for key in ('reset', 'glyph')
+            if key in steps.meta}
+    writer = SceneFileWriter(out_filename, meta)
+    for curr in steps:
+        scene = json_get(curr, 'entities', 'e')
+        arrays = entities_to_arrays(scene, np.nan, np.nan)
+        writer.write_step(arrays, 'hold' in curr and curr['hold'],
+                          curr.get('reset'))
+    writer.close()
+    return len(steps)
+
+def main():
+    parser = argparse.ArgumentParser(
+            prog = 'scene_format',
+            description = 'Converts a PrimitivesVisualizer JSON file to the '
+                          'binary scene format')
+    parser.add_argument('input')
+    parser.add_argument('output')
+    args = parser.parse_args()
+    num_steps = convert_json(args.input, args.output)
+    print(f"Wrote {num_steps} steps to {args.output}")
+
+if __name__ == "__main__":
+    main()
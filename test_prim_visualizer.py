@@ -0,0 +1,115 @@
+import json
+import threading
+
+import numpy as np
+import pytest
+
+from prim_visualizer import obj_faces, obj_vertices, read_obj, open_steps,\
+        FrameQueue, qt_signal_emitter
+
+def test_obj_vertices():
+    assert obj_vertices([b'1 2 3', b'4 5 6']).tolist() ==\
+            [[1, 2, 3], [4, 5, 6]]
+    # w and vertex color columns are dropped, whatever each line has
+    assert obj_vertices([b'1 2 3', b'4 5 6 7 8']).tolist() ==\
+            [[1, 2, 3], [4, 5, 6]]
+    assert obj_vertices([b'1 2 3 1', b'4 5 6 0.5 0.5 0.5\r',
+                         b' 7\t8 9 ']).tolist() ==\
+            [[1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    assert obj_vertices([]).shape == (0, 3)
+    with pytest.raises(ValueError):
+        obj_vertices([b'1 2', b'3 4 5 6 7'])
+
+def test_obj_faces():
+    counts, indices = obj_faces([b'1 2 3', b'4 5 6'])
+    assert counts.tolist() == [3, 3]
+    assert indices.tolist() == [1, 2, 3, 4, 5, 6]
+    # Every corner form, mixed within and across lines
+    counts, indices = obj_faces([b'1 2 3', b'4/1 5/1 6/1',
+                                 b'7//2 8/3/4 9 -1/1/1\r', b'10/2 11 12//3'])
+    assert counts.tolist() == [3, 3, 4, 3]
+    assert indices.tolist() == [1, 2, 3, 4, 5, 6, 7, 8, 9, -1, 10, 11, 12]
+    counts, indices = obj_faces([])
+    assert counts.tolist() == [] and indices.tolist() == []
+
+def test_read_obj(tmp_path):
+    path = tmp_path / "a.obj"
+    path.write_bytes(b'# comment\nv 0 0 0\nv 1 0 0 1\nvn 0 0 1\n'
+                     b'v 1 1 0\nv 0 1 0 0.5 0.5 0.5\n'
+                     b'f 1//1 2//1 3//1\nf 1/1 3 -1/2/1\n')
+    # Chunks this small split lines across reads
+    for chunk_size in (1 << 24, 8):
+        vertices, (offsets, connectivity) = read_obj(str(path), chunk_size)
+        assert vertices.tolist() == [[0, 0, 0], [1, 0, 0], [1, 1, 0],
+                                     [0, 1, 0]]
+        assert offsets.tolist() == [0, 3, 6]
+        assert np.array_equal(connectivity, [0, 1, 2, 0, 2, 3])
+
+def test_read_obj_relative_indices(tmp_path):
+    path = tmp_path / "a.obj"
+    path.write_bytes(b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf -3 -2 -1\n'
+                     b'v 0 0 1\nv 1 0 1\nv 0 1 1\nf -3/1 -2/1 -1/1 1\n')
+    # Relative to the vertices defined before each face, also when they
+    # are in an earlier chunk
+    for chunk_size in (1 << 24, 8, 40):
+        vertices, (offsets, connectivity) = read_obj(str(path), chunk_size)
+        assert len(vertices) == 6
+        assert offsets.tolist() == [0, 3, 7]
+        assert connectivity.tolist() == [0, 1, 2, 3, 4, 5, 0]
+
+def test_open_steps_lazily(tmp_path):
+    # Like the README's example: "reset" after the list and no "glyph"
+    doc = {"list": [{"entities": [{"type": "point", "position": [i, 0, 0],
+                                   "color": [1, 1, 1], "opacity": 1.0}]}
+                    for i in range(2000)],
+           "reset": False}
+    path = tmp_path / "a.json"
+    path.write_text(json.dumps(doc))
+    steps, json_doc = open_steps(str(path), False, 16, 0.1, 0.05)
+    assert len(steps.spans) == 1
+    assert json_doc == {}
+    # The keys after the list turn up once it has been read to the end
+    assert len(steps) == 2000
+    assert json_doc == {"reset": False}
+
+def test_frame_queue():
+    signals = []
+    qt_signal_emitter.frames_pending.connect(lambda: signals.append(1))
+    frames = FrameQueue(3)
+    # Only the first frame of a batch asks the Qt thread for a take
+    assert frames.put(False, {'action': 'append'}) == 1
+    assert frames.put(True, {'action': 'update'}) == 2
+    assert len(signals) == 1 and len(frames) == 2
+    assert frames.take() == [(False, {'action': 'append'}),
+                             (True, {'action': 'update'})]
+    assert frames.take() == [] and len(frames) == 0
+    assert frames.put(False, {'action': 'remove'}) == 1
+    assert len(signals) == 2
+    # Full, until an init replaces everything pending
+    assert frames.put(False, {'action': 'update'}) == 2
+    assert frames.put(False, {'action': 'update'}) == 3
+    assert frames.put(True, {'action': 'update'}) is None
+    assert len(frames) == 3
+    assert frames.put(True, {'action': 'init'}) == 1
+    assert frames.put(False, {}) == 2
+    assert frames.take() == [(True, {'action': 'init'}), (False, {})]
+    # The init started a new batch
+    assert len(signals) == 3
+    # Nothing is lost or taken twice with several server threads
+    frames = FrameQueue(10**6)
+    taken = []
+    def put(binary):
+        for i in range(1000):
+            frames.put(binary, {'action': 'update', 'i': i})
+    threads = [threading.Thread(target=put, args=(i % 2 == 0,))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        taken += frames.take()
+    for thread in threads:
+        thread.join()
+    taken += frames.take()
+    assert len(taken) == 4000
+    assert sorted(payload['i'] for binary, payload in taken if binary) ==\
+            sorted(list(range(1000)) * 2)
@@ -0,0 +1,173 @@
+import glob
+import json
+import os
+
+import vtk
+
+from scene_cache import GeometryCache, read_polydata, write_polydata
+from scene_format import JsonStepIndex, RenderBatch, CachedSteps,\
+        STEP_CACHE_SHARE
+
+def document(num_steps):
+    return {"reset": True,
+            "list": [{"entities": [
+                {"type": "point", "position": [i, 0.0, 0.0],
+                 "color": [1.0, 0.5, 0.0], "opacity": 1.0,
+                 "description": f"point {i}"},
+                {"type": "vector", "position": [i, 0.0, 0.0, i, 1.0, 0.0],
+                 "color": [0.0, 0.0, 1.0], "opacity": 1.0}],
+                "hold": i == 1} for i in range(num_steps)]}
+
+def cached_steps(tmp_path, cache):
+    filename = str(tmp_path / "a.json")
+    if not os.path.exists(filename):
+        with open(filename, "w") as f:
+            json.dump(document(3), f)
+    key = cache.key(filename, 'steps')
+    return CachedSteps(JsonStepIndex(filename), cache, key, 0.1, 0.05, True)
+
+def truncate(path):
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+
+def test_read_damaged(tmp_path):
+    points = vtk.vtkPoints()
+    points.InsertNextPoint(1.0, 2.0, 3.0)
+    polydata = vtk.vtkPolyData()
+    polydata.SetPoints(points)
+    path = str(tmp_path / "a.vtp")
+    assert write_polydata(path, polydata)
+    assert read_polydata(path).GetNumberOfPoints() == 1
+    truncate(path)
+    assert read_polydata(path) is None
+    with open(path, 'wb') as f:
+        f.write(b'not a vtp file')
+    assert read_polydata(path) is None
+
+def test_load_damaged(tmp_path):
+    cache = GeometryCache(str(tmp_path / "cache"))
+    cache.store('k', {'a': vtk.vtkPolyData(), 'b': vtk.vtkPolyData()})
+    # An empty polydata reads back fine
+    assert set(cache.load('k', ('a', 'b'))) == {'a', 'b'}
+    # An entry without the arrays asked for counts as missing
+    assert cache.load('k', ('a', 'b'), {'b': ('Colors',)}) is None
+    assert not glob.glob(str(tmp_path / "cache" / "k.*"))
+    cache.store('k', {'a': vtk.vtkPolyData(), 'b': vtk.vtkPolyData()})
+    truncate(cache.path('k', 'b'))
+    assert cache.load('k', ('a', 'b')) is None
+    assert not glob.glob(str(tmp_path / "cache" / "k.*"))
+
+def test_cached_steps(tmp_path):
+    cache = GeometryCache(str(tmp_path / "cache"))
+    built = [cached_steps(tmp_path, cache)[i] for i in range(3)]
+    steps = cached_steps(tmp_path, cache)
+    # Read back from the cache, without the input
+    steps.steps = None
+    for i, arrays in enumerate(built):
+        cached = steps[i]
+        assert cached.sphere_points.tolist() == arrays.sphere_points.tolist()
+        assert cached.descriptions == arrays.descriptions
+        assert cached.hold == (i == 1)
+
+def test_cached_steps_damaged(tmp_path):
+    cache = GeometryCache(str(tmp_path / "cache"))
+    steps = cached_steps(tmp_path, cache)
+    steps[1]
+    lines = cache.path(f'{steps.key}-1', 'lines')
+    truncate(lines)
+    # Built again from the input and stored again
+    arrays = cached_steps(tmp_path, cache)[1]
+    assert arrays.hold
+    assert arrays.sphere_points.tolist() == [[1.0, 0.0, 0.0]]
+    assert read_polydata(lines) is not None
+    # A step written without its flags is built again too
+    steps = cached_steps(tmp_path, cache)
+    cache.store(f'{steps.key}-1', {'spheres': vtk.vtkPolyData(),
+                                   'lines': vtk.vtkPolyData()})
+    assert steps[1].hold
+
+def test_cached_steps_store(tmp_path):
+    cache = GeometryCache(str(tmp_path / "cache"))
+    stored = []
+    filename = str(tmp_path / "a.json")
+    with open(filename, "w") as f:
+        json.dump(document(2), f)
+    steps = CachedSteps(JsonStepIndex(filename), cache, 'k', 0.1, 0.05,
+                        store=lambda key, polydata: stored.append(key))
+    steps[0]
+    steps[1]
+    assert stored == ['k-0', 'k-1']
+    assert not glob.glob(str(tmp_path / "cache" / "k-*"))
+
+def test_cached_render_steps(tmp_path):
+    cache = GeometryCache(str(tmp_path / "cache"))
+    filename = str(tmp_path / "r.json")
+    with open(filename, "w") as f:
+        json.dump({"scale_factor": 1.0,
+                   "edges": [{"vertices": [0, 1], "rest_length": 1.0}],
+                   "positions": [{"positions": [0, 0, 0, 1.5, 0, 0]}]}, f)
+    def steps():
+        batch = RenderBatch(filename, colors=False)
+        return CachedSteps(batch, cache, 'r', batch.sphere_radius,
+                           batch.tube_radius)
+    built = steps()[0]
+    assert len(built.line_colors) == 0
+    # Read back without "Colors", which a lookup table stands in for
+    cached = steps()
+    cached.steps = None
+    arrays = cached[0]
+    assert len(arrays.line_colors) == 0
+    assert arrays.line_scalars.tolist() == [1.5]
+
+def render_file(tmp_path, num_steps):
+    filename = str(tmp_path / "r.json")
+    with open(filename, "w") as f:
+        json.dump({"scale_factor": 1.0,
+                   "edges": [{"vertices": [0, 1], "rest_length": 1.0}],
+                   "positions": [{"positions": [0, 0, 0, 1.0 + i, 0, 0]}
+                                 for i in range(num_steps)]}, f)
+    return filename
+
+def test_cached_steps_memory_first(tmp_path):
+    cache = GeometryCache(str(tmp_path / "cache"))
+    loads = []
+    load = cache.load
+    cache.load = lambda *args: loads.append(args[0]) or load(*args)
+    filename = render_file(tmp_path, 2)
+    steps = CachedSteps(RenderBatch(filename, 4), cache, 'r', 0.1, 0.05)
+    built = steps[1]
+    assert loads == ['r-1']
+    # Still in the RenderBatch LRU, so the disk cache is not read
+    assert steps[1] is built
+    assert loads == ['r-1']
+    # Steps read back from the disk cache go into the LRU too
+    steps = CachedSteps(RenderBatch(filename, 4), cache, 'r', 0.1, 0.05)
+    cached = steps[1]
+    assert steps[1] is cached
+    assert loads == ['r-1', 'r-1']
+    assert cached.line_scalars.tolist() == [2.0]
+
+def test_cached_steps_share(tmp_path):
+    # Room for only a few steps of one file
+    cache = GeometryCache(str(tmp_path / "cache"), 0.1)
+    filename = render_file(tmp_path, 40)
+    steps = CachedSteps(RenderBatch(filename, 4), cache, 'r', 0.1, 0.05)
+    for i in range(40):
+        assert steps[i].line_scalars.tolist() == [1.0 + i]
+    def stored():
+        entries = cache.entries()
+        assert sum(size for _, _, size, _ in entries) <=\
+                cache.max_bytes * STEP_CACHE_SHARE
+        return {key for key, *_ in entries}
+    first = stored()
+    assert 0 < len(first) < 40
+    # Opened again, what is there already counts against the share
+    steps = CachedSteps(RenderBatch(filename, 4), cache, 'r', 0.1, 0.05)
+    for i in range(40):
+        steps[i]
+    again = stored()
+    assert first <= again and len(again) < 40
+    # Other files have a share of their own
+    steps = CachedSteps(RenderBatch(filename, 4), cache, 'q', 0.1, 0.05)
+    steps[0]
+    assert {key for key, *_ in cache.entries()} == again | {'q-0'}
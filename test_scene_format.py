@@ -0,0 +1,492 @@
+import json
+import threading
+
+import numpy as np
+import pytest
+
+from scene_builder import entities_to_arrays, strain_step_arrays, LiveScene,\
+        triangulate_cells, ratios_to_rgba, build_lines_polydata
+from scene_format import JsonStepIndex, SceneFile, RenderBatch, convert_json,\
+        encode_stream_frame, decode_stream_frame, STREAM_ACTIONS, STREAM_HEADER
+
+def point(x, description=None):
+    entity = {"type": "point", "position": [x, 0.0, 0.0],
+              "color": [1.0, 0.5, 0.0], "opacity": 1.0}
+    if description is not None:
+        entity["description"] = description
+    return entity
+
+def vector(x):
+    return {"type": "vector", "position": [x, 0.0, 0.0, x + 1.0, 0.0, 0.0],
+            "color": [0.0, 0.0, 1.0], "opacity": 0.5}
+
+def write(path, text):
+    path.write_bytes(text.encode() if isinstance(text, str) else text)
+    return str(path)
+
+def document(num_steps):
+    return {"reset": True, "glyph": False,
+            "list": [{"entities": [point(i), vector(i)], "hold": i == 0}
+                     for i in range(num_steps)]}
+
+def test_entries_and_meta(tmp_path):
+    doc = document(5)
+    steps = JsonStepIndex(write(tmp_path / "a.json", json.dumps(doc)))
+    assert steps.meta == {"reset": True, "glyph": False}
+    assert len(steps) == 5
+    assert list(steps) == doc["list"]
+    # Going back reads the entry again from its offset
+    assert steps[1] == doc["list"][1]
+    with pytest.raises(IndexError):
+        steps[5]
+    with pytest.raises(IndexError):
+        steps[-1]
+
+def test_meta_after_list(tmp_path):
+    doc = {"list": document(3)["list"], "reset": False, "glyph": True}
+    steps = JsonStepIndex(write(tmp_path / "a.json", json.dumps(doc)))
+    assert steps.meta == {}
+    steps.find_meta("reset")
+    assert steps.meta == {"reset": False, "glyph": True}
+    assert list(steps) == doc["list"]
+
+def test_meta_in_front(tmp_path):
+    steps = JsonStepIndex(write(tmp_path / "a.json",
+                                json.dumps(document(3))))
+    steps.find_meta("reset", "glyph")
+    # Nothing past the first entry had to be read
+    assert len(steps.spans) == 1
+    # Keys the document does not have are left out
+    steps.find_meta("scale_factor")
+    assert "scale_factor" not in steps.meta
+    assert len(steps.spans) == 3
+
+def test_meta_around_list(tmp_path):
+    text = ('{"reset": false, "list": [' + json.dumps(document(1)["list"][0]) +
+            '], "glyph": true, "extra": [[1, 2], {"a": "]"}]}')
+    steps = JsonStepIndex(write(tmp_path / "a.json", text))
+    steps.find_meta("glyph")
+    assert steps.meta == {"reset": False, "glyph": True,
+                          "extra": [[1, 2], {"a": "]"}]}
+
+def test_pretty_printed(tmp_path):
+    doc = document(4)
+    steps = JsonStepIndex(write(tmp_path / "a.json",
+                                json.dumps(doc, indent=4)))
+    assert list(steps) == doc["list"]
+
+def test_empty_list(tmp_path):
+    steps = JsonStepIndex(write(tmp_path / "a.json",
+                                '{"reset": true, "list": []}'))
+    assert len(steps) == 0
+    assert steps.meta == {"reset": True}
+
+def test_non_ascii(tmp_path):
+    descriptions = ["Kante éè", "→ αβ",
+                    "\U0001f600 vertex", "plain"]
+    doc = {"résumé": "über",
+           "list": [{"entities": [point(i, d)]}
+                    for i, d in enumerate(descriptions)]}
+    filename = write(tmp_path / "a.json",
+                     json.dumps(doc, ensure_ascii=False))
+    # A window this small cuts through the multibyte characters
+    for window in (1 << 12, 7):
+        steps = JsonStepIndex(filename, window=window)
+        assert steps.meta == {"résumé": "über"}
+        assert [step["entities"][0]["description"] for step in steps] ==\
+                descriptions
+        assert steps[0]["entities"][0]["description"] == descriptions[0]
+
+def test_window_follows_entry_size(tmp_path):
+    # A big value in front of the list must not make every entry read a
+    # window that size
+    doc = {"big": "x" * (1 << 20), "list": document(50)["list"]}
+    steps = JsonStepIndex(write(tmp_path / "a.json", json.dumps(doc)),
+                          window=64)
+    assert len(steps) == 50
+    assert steps.window < 1 << 12
+
+def test_truncated(tmp_path):
+    text = json.dumps(document(4))
+    # Cut in the middle of the third entry
+    cut = text.index('{"entities"', text.index('{"entities"',
+                     text.index('{"entities"') + 1) + 1) + 20
+    steps = JsonStepIndex(write(tmp_path / "a.json", text[:cut]))
+    assert steps[1] == document(4)["list"][1]
+    with pytest.raises(ValueError, match="a.json"):
+        steps[2]
+    # The same error every time, not an early end of the list
+    with pytest.raises(ValueError):
+        len(steps)
+    assert steps[0] == document(4)["list"][0]
+
+def test_truncated_between_entries(tmp_path):
+    text = json.dumps(document(2))
+    cut = text.index('{"entities"', text.index('{"entities"') + 1)
+    steps = JsonStepIndex(write(tmp_path / "a.json", text[:cut]))
+    with pytest.raises(ValueError):
+        steps[1]
+
+def test_truncated_first_entry(tmp_path):
+    with pytest.raises(ValueError):
+        JsonStepIndex(write(tmp_path / "a.json",
+                            '{"list": [{"entities": [{"type"'))
+
+def test_not_an_object(tmp_path):
+    with pytest.raises(ValueError):
+        JsonStepIndex(write(tmp_path / "a.json", '[1, 2]'))
+
+def test_threads(tmp_path):
+    doc = document(200)
+    steps = JsonStepIndex(write(tmp_path / "a.json", json.dumps(doc)))
+    errors = []
+    def read(order):
+        for i in order:
+            if steps[i] != doc["list"][i]:
+                errors.append(i)
+    threads = [threading.Thread(target=read, args=(order,))
+               for order in (range(200), range(199, -1, -1),
+                             range(0, 200, 3))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+def test_entities_to_arrays():
+    scene = [point(0.0, "a"), vector(1.0), vector(2.0),
+             {"t": "y", "p": [[2, 0, 0], [3, 0, 0], [3, 1, 0]],
+              "c": [0, 1, 0], "o": 0.25, "r": 0.2}]
+    arrays = entities_to_arrays(scene, 0.1, 0.05, descriptions=True)
+    assert arrays.descriptions == ["a", None, None, None]
+    assert arrays.sphere_ids.tolist() == [0]
+    assert arrays.line_ids.tolist() == [1, 2, 3]
+    assert arrays.sphere_points.tolist() == [[0, 0, 0]]
+    assert arrays.sphere_colors.tolist() == [[255, 128, 0, 255]]
+    assert arrays.sphere_radii.tolist() == pytest.approx([0.1])
+    assert arrays.line_offsets.tolist() == [0, 2, 4, 7]
+    assert arrays.line_colors.tolist() == [[0, 0, 255, 128],
+                                           [0, 0, 255, 128],
+                                           [0, 255, 0, 64]]
+    # The vectors meet at x = 2 with the same radius, the polyline starts
+    # there with another radius
+    points = arrays.line_points[arrays.line_connectivity]
+    assert points[:, 0].tolist() == [1, 2, 2, 3, 2, 3, 3]
+    assert arrays.line_connectivity[1] == arrays.line_connectivity[2]
+    assert arrays.line_connectivity[4] != arrays.line_connectivity[1]
+    radii = arrays.line_radii[arrays.line_connectivity]
+    assert radii.tolist() == pytest.approx([0.05] * 4 + [0.2] * 3)
+
+def test_strain_step_arrays():
+    points = np.array([[0, 0, 0], [1.1, 0, 0], [1.1, 0.9, 0]])
+    edges = np.array([[0, 1], [1, 2]])
+    arrays = strain_step_arrays(points, edges, np.array([1.0, 1.0]), 0.1,
+                                0.05, 0.1)
+    assert arrays.line_scalars == pytest.approx([1.1, 0.9])
+    # Stretched is red, shortened blue
+    red, blue = arrays.line_colors
+    assert red[0] > red[2] and blue[2] > blue[0]
+    assert arrays.line_connectivity.tolist() == [0, 1, 1, 2]
+    # Left to a lookup table, the lines get no "Colors"
+    arrays = strain_step_arrays(points, edges, np.array([1.0, 1.0]), 0.1,
+                                0.05, 0.1, colors=False)
+    assert arrays.line_scalars == pytest.approx([1.1, 0.9])
+    assert len(arrays.line_colors) == 0
+    lines_pd = build_lines_polydata(arrays)
+    assert lines_pd.GetCellData().GetArray("Colors") is None
+    assert lines_pd.GetCellData().GetArray("Strain").GetNumberOfTuples() == 2
+
+def loop_triangulate_cells(positions, edge_vertices, edge_typed,
+                           rest_lengths, cell_offsets, cell_edges):
+    # The per-cell loop triangulate_cells replaced, on the same arrays
+    vertices = []
+    faces = []
+    ratios = []
+    new_index = [-1] * len(positions)
+    center_index = [-1] * len(edge_vertices)
+    for e, (v1, v2) in enumerate(edge_vertices):
+        if not edge_typed[e]:
+            vertices.append(np.mean([positions[v1], positions[v2]], axis=0))
+            center_index[e] = len(vertices) - 1
+    for c in range(len(cell_offsets) - 1):
+        edges = cell_edges[cell_offsets[c]:cell_offsets[c + 1]]
+        center = np.zeros(3)
+        count = 0
+        for e in edges:
+            if not edge_typed[e]:
+                for v in edge_vertices[e]:
+                    center += positions[v]
+                    count += 1
+                    if new_index[v] == -1:
+                        vertices.append(positions[v])
+                        new_index[v] = len(vertices) - 1
+        with np.errstate(invalid='ignore'):
+            vertices.append(center / count)
+        cc = len(vertices) - 1
+        e_count = -1
+        done = False
+        for e in edges:
+            if not edge_typed[e]:
+                v1, v2 = edge_vertices[e]
+                faces.append([new_index[v1], center_index[e], cc])
+                faces.append([center_index[e], new_index[v2], cc])
+                ratio = np.linalg.norm(positions[v1] - positions[v2]) /\
+                        rest_lengths[e]
+                e_count += 1
+            if not done and e_count == 5:
+                done = True
+                ratios += [ratio] * 12
+    colors = ratios_to_rgba(ratios, dtype=np.uint8)[:, :3]
+    return np.array(vertices).reshape(-1, 3), \
+            np.array(faces, dtype=int).reshape(-1, 3), colors
+
+def random_complex(rng):
+    num_vertices = int(rng.integers(1, 40))
+    num_edges = int(rng.integers(1, 80))
+    positions = rng.normal(size=(num_vertices, 3))
+    edge_vertices = rng.integers(0, num_vertices, size=(num_edges, 2))
+    edge_typed = rng.random(num_edges) < 0.3
+    rest_lengths = rng.uniform(0.5, 2.0, num_edges)
+    counts = rng.integers(1, 12, size=int(rng.integers(0, 30)))
+    cell_offsets = np.concatenate(([0], np.cumsum(counts)))
+    cell_edges = rng.integers(0, num_edges, size=cell_offsets[-1])
+    return positions, edge_vertices, edge_typed, rest_lengths, cell_offsets, \
+            cell_edges
+
+def assert_same_triangulation(*complex):
+    points, triangles, colors = triangulate_cells(*complex)
+    loop_points, loop_triangles, loop_colors = loop_triangulate_cells(*complex)
+    np.testing.assert_allclose(points, loop_points)
+    assert triangles.tolist() == loop_triangles.tolist()
+    assert colors.tolist() == loop_colors.tolist()
+    return points, triangles, colors
+
+def test_triangulate_cells():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        complex = random_complex(rng)
+        # Cells of typed edges only have a NaN center
+        with np.errstate(invalid='ignore'):
+            assert_same_triangulation(*complex)
+
+def test_triangulate_cells_degenerate():
+    positions = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+    edge_vertices = np.array([[0, 1], [1, 2], [2, 0], [1, 1]])
+    rest_lengths = np.ones(4)
+    # No cells, no edges at all
+    points, triangles, colors = assert_same_triangulation(
+            positions, edge_vertices, np.zeros(4, bool), rest_lengths, [0],
+            np.zeros(0, int))
+    assert len(points) == 4 and triangles.shape == (0, 3) and \
+            colors.shape == (0, 3)
+    points, triangles, colors = triangulate_cells(
+            np.zeros((0, 3)), np.zeros((0, 2), int), np.zeros(0, bool),
+            np.zeros(0), [0], np.zeros(0, int))
+    assert points.shape == (0, 3) and triangles.shape == (0, 3) and \
+            colors.shape == (0, 3)
+    # A cell of typed edges only gets just its (undefined) center, a
+    # collapsed edge two flat triangles, and an empty cell a center too
+    edge_typed = np.array([False, False, False, True])
+    points, triangles, colors = assert_same_triangulation(
+            positions, edge_vertices, edge_typed, rest_lengths,
+            [0, 1, 1, 4, 5], [3, 0, 1, 2, 3])
+    assert len(points) == 3 + 3 + 4 and len(triangles) == 6
+    assert np.isnan(points[-1]).all()
+    edge_typed[3] = False
+    with np.errstate(invalid='ignore'):
+        assert_same_triangulation(positions, edge_vertices, edge_typed,
+                                  rest_lengths, [0, 2], [3, 3])
+    # The sixth untyped edge colors the cell, counting repeats
+    points, triangles, colors = assert_same_triangulation(
+            positions, edge_vertices, edge_typed, rest_lengths,
+            [0, 7, 9], [0, 3, 1, 1, 2, 3, 0, 1, 2])
+    assert len(triangles) == 18 and len(colors) == 12
+
+def test_live_scene_bad_input():
+    scene = LiveScene(0.1, 0.05)
+    scene.init([point(0.0), vector(1.0)])
+    def state():
+        return scene.next_id, {name: getattr(scene.arrays, name).tolist()
+                               for name in ('sphere_ids', 'line_ids',
+                                            'sphere_points', 'line_points',
+                                            'sphere_colors', 'line_radii')}
+    before = state()
+    for call, args, error in (
+            (scene.append, ([{"type": "point", "position": [1, 2]}],),
+             ValueError),
+            (scene.append, ([point(2.0), 3],), AttributeError),
+            (scene.update, ([0, 1], [[5, 5, 5]]), IndexError),
+            (scene.update, ([0, 1], None, [[1, 1], [1, 1]]), ValueError),
+            (scene.update, ([0, 1], [[5, 5, 5], [1, 1, 1, 2, 2, 2]], None,
+                            [[1, 2], [3, 4]]), ValueError)):
+        with pytest.raises(error):
+            call(*args)
+        assert state() == before
+    scene.append([point(2.0)])
+    assert scene.arrays.sphere_ids.tolist() == [0, 2]
+
+def scene_columns():
+    return {'sphere_ids': [4, -1],
+            'sphere_points': [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]],
+            'sphere_colors': [[255, 0, 0, 255], [0, 255, 0, 128]],
+            'sphere_radii': [0.5, 0.25],
+            'line_ids': [7],
+            'line_points': [[0.0, 0.0, 0.0], [1.0, 0.0, 0.0],
+                            [1.0, 1.0, 0.0]],
+            'line_colors': [[0, 0, 255, 255]],
+            'line_radii': [0.125, 0.25, 0.375],
+            'line_counts': [4],
+            'line_connectivity': [0, 1, 2, 1]}
+
+@pytest.mark.parametrize("action", ['init', 'append'])
+def test_stream_frame_scene(action):
+    columns = scene_columns()
+    sequence, payload = decode_stream_frame(
+            encode_stream_frame(action, 12, **columns))
+    assert sequence == 12 and payload['action'] == action
+    arrays = payload['arrays']
+    for name, values in columns.items():
+        if name != 'line_counts':
+            assert getattr(arrays, name).tolist() == values
+    assert arrays.line_offsets.tolist() == [0, 4]
+    # Left out columns are filled in, the connectivity runs over every point
+    del columns['sphere_ids'], columns['sphere_colors'], \
+            columns['sphere_radii'], columns['line_colors'], \
+            columns['line_radii'], columns['line_connectivity']
+    columns['line_counts'] = [3]
+    _, payload = decode_stream_frame(encode_stream_frame(action, **columns))
+    arrays = payload['arrays']
+    assert arrays.sphere_ids.tolist() == [-1, -1]
+    assert arrays.sphere_colors.tolist() == [[255] * 4] * 2
+    assert np.isnan(arrays.sphere_radii).all()
+    assert arrays.line_colors.tolist() == [[255] * 4]
+    assert np.isnan(arrays.line_radii).all() and len(arrays.line_radii) == 3
+    assert arrays.line_connectivity.tolist() == [0, 1, 2]
+    # Nothing at all
+    _, payload = decode_stream_frame(encode_stream_frame(action))
+    assert len(payload['arrays'].sphere_points) == 0
+    assert payload['arrays'].line_offsets.tolist() == [0]
+
+def test_stream_frame_update():
+    sequence, payload = decode_stream_frame(encode_stream_frame(
+            'update', 3, ids=[2, 5], positions=[[1, 2, 3], [4, 5, 6],
+                                                [7, 8, 9]],
+            colors=[[1, 2, 3, 4], [5, 6, 7, 8]], radii=[0.5, 1.5]))
+    assert sequence == 3 and payload['action'] == 'update'
+    assert payload['ids'].tolist() == [2, 5]
+    assert payload['positions'].tolist() == [[1, 2, 3], [4, 5, 6],
+                                             [7, 8, 9]]
+    assert payload['colors'].tolist() == [[1, 2, 3, 4], [5, 6, 7, 8]]
+    assert payload['radii'].tolist() == [0.5, 1.5]
+    # Left out attributes are not updated
+    _, payload = decode_stream_frame(encode_stream_frame('update', ids=[2]))
+    assert payload['ids'].tolist() == [2]
+    assert payload['positions'] is None and payload['colors'] is None and \
+            payload['radii'] is None
+    with pytest.raises(ValueError):
+        decode_stream_frame(encode_stream_frame('update', ids=[2, 5],
+                                                radii=[0.5]))
+
+def test_stream_frame_remove():
+    sequence, payload = decode_stream_frame(
+            encode_stream_frame('remove', 2**40, ids=[1, 3, 5]))
+    assert sequence == 2**40
+    assert payload == {'action': 'remove', 'ids': payload['ids']}
+    assert payload['ids'].tolist() == [1, 3, 5]
+
+@pytest.mark.parametrize("action", ['init', 'append', 'update', 'remove'])
+def test_stream_frame_bad_size(action):
+    columns = scene_columns() if action in ('init', 'append') else \
+            {'ids': [1, 2, 3]}
+    frame = encode_stream_frame(action, **columns)
+    decode_stream_frame(frame)
+    for size in (0, STREAM_HEADER.itemsize - 1, STREAM_HEADER.itemsize,
+                 len(frame) - 8, len(frame) - 1):
+        with pytest.raises(ValueError):
+            decode_stream_frame(frame[:size])
+    for extra in (b'\0', b'\0' * 8, frame):
+        with pytest.raises(ValueError):
+            decode_stream_frame(frame + extra)
+
+def test_stream_frame_bad_content():
+    frame = bytearray(encode_stream_frame('remove', ids=[1]))
+    for action in (len(STREAM_ACTIONS), 255):
+        frame[0] = action
+        with pytest.raises(ValueError):
+            decode_stream_frame(bytes(frame))
+    # Connectivity past the line points or not adding up to the counts
+    for changes in ({'line_connectivity': [0, 1, 2, 3]},
+                    {'line_connectivity': [0, 1, -1, 1]},
+                    {'line_counts': [3]}):
+        columns = scene_columns()
+        columns.update(changes)
+        with pytest.raises(ValueError):
+            decode_stream_frame(encode_stream_frame('init', **columns))
+
+def test_convert_json(tmp_path):
+    doc = document(3)
+    doc["list"][1]["reset"] = False
+    pvb = str(tmp_path / "a.pvb")
+    assert convert_json(write(tmp_path / "a.json", json.dumps(doc)),
+                        pvb) == 3
+    steps = SceneFile(pvb, 0.1, 0.05)
+    assert steps.meta == {"reset": True, "glyph": False}
+    assert len(steps) == 3
+    for i, entry in enumerate(doc["list"]):
+        expected = entities_to_arrays(entry["entities"], 0.1, 0.05)
+        arrays = steps[i]
+        for name in ('sphere_points', 'sphere_colors', 'sphere_radii',
+                     'line_points', 'line_colors', 'line_radii',
+                     'line_offsets', 'line_connectivity'):
+            assert np.array_equal(getattr(arrays, name),
+                                  getattr(expected, name)), name
+        assert arrays.hold == (i == 0)
+    assert [steps[i].reset for i in range(3)] == [None, False, None]
+
+def render_document(num_vertices, num_edges, num_steps, order):
+    rng = np.random.default_rng(0)
+    parts = {
+        "positions": [{"positions": rng.random(3 * num_vertices)
+                       .round(3).tolist()} for _ in range(num_steps)],
+        "edges": [{"vertices": [int(a), int(b)], "rest_length": 0.5}
+                  for a, b in rng.integers(0, num_vertices,
+                                           (num_edges, 2))],
+        "scale_factor": 2.0}
+    return {key: parts[key] for key in order}
+
+@pytest.mark.parametrize("order", [
+        ("scale_factor", "edges", "positions"),
+        ("positions", "scale_factor", "edges"),
+        # Edges far bigger than any window read from the end of the file
+        ("positions", "edges", "scale_factor")])
+def test_render_batch_key_order(tmp_path, order):
+    doc = render_document(2000, 20000, 5, order)
+    batch = RenderBatch(write(tmp_path / "a.json", json.dumps(doc)))
+    assert len(batch) == 5
+    assert batch.edges.tolist() == [e["vertices"] for e in doc["edges"]]
+    assert batch.sphere_radius == pytest.approx(0.1)
+    arrays = batch[4]
+    assert np.allclose(arrays.sphere_points, np.reshape(
+            doc["positions"][4]["positions"], (-1, 3)))
+    assert len(arrays.line_colors) == 20000
+
+def test_render_batch_missing_edges(tmp_path):
+    doc = render_document(10, 5, 2, ("positions", "scale_factor"))
+    with pytest.raises(KeyError):
+        RenderBatch(write(tmp_path / "a.json", json.dumps(doc)))
+
+def test_is_held(tmp_path):
+    doc = document(4)
+    doc["list"][2]["hold"] = True
+    filename = write(tmp_path / "a.json", json.dumps(doc))
+    pvb = str(tmp_path / "a.pvb")
+    convert_json(filename, pvb)
+    for steps in (JsonStepIndex(filename), SceneFile(pvb, 0.1, 0.05)):
+        assert [steps.is_held(i) for i in range(4)] ==\
+                [True, False, True, False]
+        with pytest.raises(IndexError):
+            steps.is_held(4)
+    steps = JsonStepIndex(filename)
+    assert steps.is_held(2)
+    # Indexed up to the entry asked about and no further
+    assert len(steps.spans) == 3